@@ -0,0 +1,146 @@
+"""
+Manifest of per-report stage outputs for incremental analysis runs.
+
+process_extracted_reports --incremental keys every report on the SHA-256 of
+its text and stores each stage's output together with a fingerprint of
+everything that produced it: the prompt template, the backend, model and
+generation profile the stage is routed to, the guideline document it
+retrieves from with the retrieval settings (top-k, token budget, chunk size,
+index version) and the fingerprints of the stages it depends on. On the next run a stage is only
+recomputed when its fingerprint changed, so adding one report to
+combined_reports.md runs the pipeline for that report alone, and editing the
+care plan prompt reruns care plan and provider message but not diagnosis.
+comprehensive_analysis.md is then reassembled from the stored outputs.
+
+Each analysis output has its own manifest next to it (<output>.manifest.json,
+e.g. comprehensive_analysis.md.manifest.json), rewritten atomically after
+each report, so runs writing different outputs never prune each other's
+entries.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+MANIFEST_SUFFIX = ".manifest.json"
+MANIFEST_VERSION = 1
+
+
+def manifest_path_for(output_path: str) -> str:
+    """Manifest file of an analysis output file (stored next to it)."""
+    return os.path.abspath(output_path) + MANIFEST_SUFFIX
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _fingerprint(*parts: Any) -> str:
+    material = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()[:16]
+
+
+def _route(stage: str):
+    import backends
+    selected, model = backends.resolve(stage)
+    return [selected.name, model or selected.default_model, list(backends.stage_profile(stage, selected))]
+
+
+def _guideline_sha(source: str) -> Optional[str]:
+    try:
+        with open(source, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def stage_fingerprints(provider_prompt: str, structured: bool = False) -> Dict[str, str]:
+    """
+    Fingerprint of every pipeline stage under the current prompts and routes.
+
+    A stage's fingerprint includes those of the stages it depends on, so a
+    change upstream invalidates everything downstream of it.
+
+    Args:
+        provider_prompt: Provider message prompt template of the caller
+        structured: Whether the findings extraction stage runs first
+    """
+    import care_plan_prompt
+    import diagnose_prompt
+    import guideline_index
+    import stats_finder
+    import structured_report
+
+    fingerprints = {}
+    upstream = []
+    if structured:
+        fingerprints['findings'] = _fingerprint('findings', structured_report.EXTRACTION_PROMPT,
+                                                structured_report.FINDINGS_SCHEMA, _route('findings'))
+        upstream = [fingerprints['findings'], structured_report.CONTEXT_TOKEN_BUDGET]
+        fingerprints['stats'] = _fingerprint('stats', 'structured', upstream)
+    else:
+        fingerprints['stats'] = _fingerprint('stats', stats_finder.stats_prompt, stats_finder.USE_LOCAL_MATCHER,
+                                             _route('stats'))
+    retrieval = guideline_index.retrieval_settings()
+    fingerprints['care_plan'] = _fingerprint(
+        'care_plan', care_plan_prompt.CARE_PLAN_PROMPT, _route('care_plan'),
+        _guideline_sha(guideline_index.CARE_PLAN_GUIDELINES), retrieval, upstream)
+    fingerprints['diagnosis'] = _fingerprint(
+        'diagnosis', diagnose_prompt.DIAGNOSE_PROMPT, _route('diagnosis'),
+        _guideline_sha(guideline_index.DIAGNOSIS_GUIDELINES), retrieval, upstream)
+    fingerprints['provider_message'] = _fingerprint(
+        'provider_message', provider_prompt, _route('provider_message'),
+        fingerprints['care_plan'], fingerprints['diagnosis'])
+    return fingerprints
+
+
+class AnalysisManifest:
+    """Stage outputs per report text hash, with the fingerprint each was produced under."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.reports: Dict[str, Dict[str, Any]] = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('version') != MANIFEST_VERSION:
+            return {}
+        return manifest.get('reports', {})
+
+    def completed(self, key: str, fingerprints: Dict[str, str]) -> Dict[str, Any]:
+        """Stored outputs of a report whose fingerprints still match."""
+        with self._lock:
+            stages = self.reports.get(key, {}).get('stages', {})
+            return {stage: entry['output'] for stage, entry in stages.items()
+                    if fingerprints.get(stage) == entry['fingerprint']}
+
+    def record(self, key: str, title: str, stage: str, fingerprint: str, output: Any) -> None:
+        with self._lock:
+            entry = self.reports.setdefault(key, {'title': title, 'stages': {}})
+            entry['title'] = title
+            entry['stages'][stage] = {'fingerprint': fingerprint, 'output': output}
+
+    def prune(self, keep: Iterable[str]) -> int:
+        """Drop reports that are no longer in the input; returns how many."""
+        keep = set(keep)
+        with self._lock:
+            stale = [key for key in self.reports if key not in keep]
+            for key in stale:
+                del self.reports[key]
+        return len(stale)
+
+    def save(self) -> None:
+        # Serialized so an older snapshot never replaces a newer one
+        with self._lock:
+            data = json.dumps({'version': MANIFEST_VERSION, 'reports': self.reports}, ensure_ascii=False, indent=1)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
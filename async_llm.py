@@ -0,0 +1,57 @@
+"""
+One awaitable interface over the LLM backends.
+
+Callers pick a backend by name and await a completion; many completions can be
+in flight on a single event loop without a thread per request. The blocking
+call_openai / call_ollama functions remain available for scripts.
+
+Backends are looked up in the backends registry (openai, ollama,
+ollama-assistant, ollama-cli, fake, ...).
+"""
+
+import asyncio
+from typing import Iterable, List, Optional, Union
+
+import backends
+
+BACKENDS = backends.available_backends()
+
+
+async def acomplete(prompt: str, backend: str = 'ollama', model: Optional[str] = None,
+                    timeout: Optional[float] = None) -> str:
+    """
+    Await a single completion.
+
+    Args:
+        prompt: Prompt text
+        backend: Name of a registered backend (see backends.available_backends)
+        model: Optional model override for the backend
+        timeout: Overall deadline in seconds; asyncio.TimeoutError (or the
+            backend's timeout error) is raised when it expires
+
+    Returns:
+        The generated text
+    """
+    return await backends.get_backend(backend).acomplete(prompt, model=model, timeout=timeout)
+
+
+async def acomplete_many(prompts: Iterable[str], backend: str = 'ollama', model: Optional[str] = None,
+                         timeout: Optional[float] = None) -> List[Union[str, BaseException]]:
+    """
+    Run many completions concurrently on the current event loop.
+
+    In-flight requests are bounded by backend_limits. A failed or timed-out
+    prompt yields its exception in place of the text instead of cancelling
+    the others.
+
+    Returns:
+        Results in prompt order
+    """
+    tasks = [acomplete(prompt, backend=backend, model=model, timeout=timeout) for prompt in prompts]
+    return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def complete(prompt: str, backend: str = 'ollama', model: Optional[str] = None,
+             timeout: Optional[float] = None) -> str:
+    """Blocking counterpart of acomplete using the backends' sync clients."""
+    return backends.get_backend(backend).complete(prompt, model=model, timeout=timeout)
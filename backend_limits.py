@@ -0,0 +1,288 @@
+"""
+Per-backend concurrency limits for LLM calls.
+
+Batch runs fan reports out over many worker threads, but each backend can only
+usefully serve so many requests at once (a local Ollama server far fewer than
+the OpenAI API). Every backend call holds a slot of its backend's limit for
+the duration of the request.
+
+Backends in ADAPTIVE_BACKENDS (Ollama by default) start at their
+BACKEND_CONCURRENCY and adjust the limit AIMD-style: while calls are using
+every slot and their latency (per weighted token when the server reports
+token counts) stays near the best seen, the limit grows by one slot per
+limit's worth of calls; when recent latency rises above
+AIMD_LATENCY_TOLERANCE times that baseline (requests queueing inside the
+server or contending for its CPU) or a call fails, it is cut
+multiplicatively. Callers beyond the limit block, which applies backpressure
+to the worker pool. set_limit() pins a backend to a fixed limit.
+"""
+
+import collections
+import os
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from typing import Deque, Dict, Optional
+
+import tracing
+
+# Default maximum number of in-flight requests per backend (the starting
+# point for adaptive backends)
+BACKEND_CONCURRENCY = {
+    'ollama': 2,
+    'openai': 16,
+}
+# Backends whose limit adapts to observed latency; OLLAMA_ADAPTIVE_CONCURRENCY=0 pins Ollama
+ADAPTIVE_BACKENDS = {'ollama'} if os.getenv("OLLAMA_ADAPTIVE_CONCURRENCY", "1") != "0" else set()
+ADAPTIVE_MAX_CONCURRENCY = {
+    'ollama': int(os.getenv("OLLAMA_MAX_CONCURRENCY", "8")),
+}
+AIMD_DECREASE = 0.75  # Limit factor when latency rises above the tolerance
+AIMD_ERROR_DECREASE = 0.5  # Limit factor when a call fails or times out
+AIMD_LATENCY_TOLERANCE = 1.5  # Recent latency over baseline that counts as congestion
+AIMD_WINDOW = 200  # Latency samples the baseline is taken from
+AIMD_MIN_SAMPLES = 5  # Samples needed before latency can trigger a decrease
+AIMD_SMOOTHING = 0.3  # Weight of the newest sample in the recent latency average
+AIMD_PROMPT_TOKEN_WEIGHT = 0.1  # Prompt tokens are evaluated ~10x faster than generated
+AIMD_POLL_S = 0.02  # Async waiters poll an adaptive limit at this interval
+
+_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+_adaptive: Dict[str, "AdaptiveLimit"] = {}
+_lock = threading.Lock()
+# event loop -> {backend: asyncio.Semaphore}; asyncio primitives are loop-bound
+_async_semaphores = weakref.WeakKeyDictionary()
+
+
+class AdaptiveLimit:
+    """In-flight request limit adjusted by additive increase / multiplicative decrease."""
+
+    def __init__(self, initial: int, max_limit: int, min_limit: int = 1):
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.increases = 0
+        self.decreases = 0
+        self._cond = threading.Condition()
+        # Separate baselines for per-token and whole-call latencies
+        self._samples: Dict[str, Deque[float]] = collections.defaultdict(
+            lambda: collections.deque(maxlen=AIMD_WINDOW))
+        self._recent: Dict[str, float] = {}
+        self._hold_until = 0.0
+
+    @property
+    def slots(self) -> int:
+        return int(self.limit)
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if self.in_flight >= self.slots:
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.in_flight >= self.slots:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency: Optional[float] = None, cost: Optional[float] = None, failed: bool = False) -> None:
+        """
+        Return a slot and adjust the limit from the call's outcome.
+
+        Args:
+            latency: Wall time of the call; None (e.g. a cancelled call) leaves the limit alone
+            cost: Weighted token count of the call, normalizing its latency
+            failed: The call failed or timed out
+        """
+        with self._cond:
+            saturated = self.in_flight >= self.slots
+            self.in_flight -= 1
+            now = time.monotonic()
+            if failed:
+                self._decrease(AIMD_ERROR_DECREASE, now, latency or 0.0)
+            elif latency is not None:
+                unit = 'token' if cost else 'call'
+                self._observe(unit, latency / cost if cost else latency, saturated, now, latency)
+            self._cond.notify_all()
+
+    def _baseline(self, unit: str) -> Optional[float]:
+        samples = sorted(self._samples[unit])
+        if len(samples) < AIMD_MIN_SAMPLES:
+            return None
+        return samples[len(samples) // 10]
+
+    def _observe(self, unit: str, value: float, saturated: bool, now: float, latency: float) -> None:
+        baseline = self._baseline(unit)
+        self._samples[unit].append(value)
+        recent = self._recent.get(unit, value)
+        recent = self._recent[unit] = recent + AIMD_SMOOTHING * (value - recent)
+        if baseline is not None and recent > baseline * AIMD_LATENCY_TOLERANCE:
+            self._decrease(AIMD_DECREASE, now, latency)
+        elif saturated and now >= self._hold_until and self.limit < self.max_limit:
+            # +1 slot per limit's worth of calls completed at full use
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.increases += 1
+
+    def _decrease(self, factor: float, now: float, latency: float) -> None:
+        # Calls started before a decrease still report the old congestion;
+        # ignore them for about one call's latency
+        if now < self._hold_until:
+            return
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.decreases += 1
+        self._hold_until = now + latency
+        self._recent.clear()
+
+
+def set_limit(backend: str, limit: int) -> None:
+    """
+    Pin the in-flight request limit of a backend (disabling adaptation).
+
+    Should be called before work is submitted; calls already holding a slot
+    of the previous semaphore are unaffected.
+    """
+    if limit < 1:
+        raise ValueError(f"Concurrency limit for {backend!r} must be at least 1")
+    with _lock:
+        BACKEND_CONCURRENCY[backend] = limit
+        ADAPTIVE_BACKENDS.discard(backend)
+        _adaptive.pop(backend, None)
+        _semaphores[backend] = threading.BoundedSemaphore(limit)
+        for semaphores in _async_semaphores.values():
+            semaphores.pop(backend, None)
+
+
+def set_adaptive(backend: str, max_limit: Optional[int] = None) -> None:
+    """Let a backend's limit adapt between 1 and max_limit, starting at BACKEND_CONCURRENCY."""
+    with _lock:
+        if max_limit is not None:
+            ADAPTIVE_MAX_CONCURRENCY[backend] = max_limit
+        ADAPTIVE_BACKENDS.add(backend)
+        _adaptive.pop(backend, None)
+
+
+def _adaptive_limit(backend: str) -> Optional[AdaptiveLimit]:
+    with _lock:
+        if backend not in ADAPTIVE_BACKENDS:
+            return None
+        limit = _adaptive.get(backend)
+        if limit is None:
+            initial = BACKEND_CONCURRENCY.get(backend, 1)
+            limit = AdaptiveLimit(initial, max(initial, ADAPTIVE_MAX_CONCURRENCY.get(backend, initial)))
+            _adaptive[backend] = limit
+        return limit
+
+
+def current_limit(backend: str) -> int:
+    """The backend's limit right now (adaptive limits move during a run)."""
+    limit = _adaptive_limit(backend)
+    return limit.slots if limit is not None else BACKEND_CONCURRENCY.get(backend, 1)
+
+
+def in_flight(backend: str) -> Optional[int]:
+    """Calls holding a slot of an adaptive backend's limit (None for fixed limits)."""
+    limit = _adaptive_limit(backend)
+    return None if limit is None else limit.in_flight
+
+
+def describe_limits() -> str:
+    """One-line summary of the limits, e.g. for a startup banner."""
+    parts = []
+    for backend in sorted(set(BACKEND_CONCURRENCY) | ADAPTIVE_BACKENDS):
+        limit = _adaptive_limit(backend)
+        if limit is None:
+            parts.append(f"{backend} {BACKEND_CONCURRENCY.get(backend, 1)}")
+        else:
+            parts.append(f"{backend} adaptive {limit.slots} (max {limit.max_limit})")
+    return ", ".join(parts)
+
+
+def _semaphore(backend: str) -> threading.BoundedSemaphore:
+    with _lock:
+        semaphore = _semaphores.get(backend)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(BACKEND_CONCURRENCY.get(backend, 1))
+            _semaphores[backend] = semaphore
+        return semaphore
+
+
+def _call_cost() -> Optional[float]:
+    # Token counts the backend recorded on the active call's span, if any
+    current = tracing.current_llm_span()
+    if current is None or not current.attrs.get('completion_tokens'):
+        return None
+    return current.attrs['completion_tokens'] + AIMD_PROMPT_TOKEN_WEIGHT * (current.attrs.get('prompt_tokens') or 0)
+
+
+def _release(limit: AdaptiveLimit, started: float, error: Optional[BaseException]) -> None:
+    if error is not None and not isinstance(error, Exception):
+        # Cancelled or abandoned (GeneratorExit): says nothing about the server
+        limit.release()
+        return
+    limit.release(time.perf_counter() - started, _call_cost(), failed=error is not None)
+    tracing.record_usage(concurrency_limit=limit.slots)
+
+
+@contextmanager
+def backend_slot(backend: str):
+    """
+    Hold one in-flight request slot of backend for the duration of the block.
+
+    Time spent waiting for the slot is recorded as queue time on the active
+    tracing span. For adaptive backends the block's latency and token counts
+    (recorded on the span before it exits) feed the limit.
+    """
+    limit = _adaptive_limit(backend)
+    waiting = time.perf_counter()
+    if limit is None:
+        semaphore = _semaphore(backend)
+        semaphore.acquire()
+        tracing.record_queue_time(time.perf_counter() - waiting)
+        try:
+            yield
+        finally:
+            semaphore.release()
+        return
+
+    limit.acquire()
+    started = time.perf_counter()
+    tracing.record_queue_time(started - waiting)
+    try:
+        yield
+    except BaseException as e:
+        _release(limit, started, e)
+        raise
+    _release(limit, started, None)
+
+
+@asynccontextmanager
+async def async_backend_slot(backend: str):
+    """Async counterpart of backend_slot; fixed limits are bounded per event loop."""
+    import asyncio  # Only needed (and already loaded) inside a running loop
+    limit = _adaptive_limit(backend)
+    waiting = time.perf_counter()
+    if limit is None:
+        loop = asyncio.get_running_loop()
+        semaphores = _async_semaphores.setdefault(loop, {})
+        semaphore = semaphores.get(backend)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(BACKEND_CONCURRENCY.get(backend, 1))
+            semaphores[backend] = semaphore
+        async with semaphore:
+            tracing.record_queue_time(time.perf_counter() - waiting)
+            yield
+        return
+
+    while not limit.try_acquire():
+        await asyncio.sleep(AIMD_POLL_S)
+    started = time.perf_counter()
+    tracing.record_queue_time(started - waiting)
+    try:
+        yield
+    except BaseException as e:
+        _release(limit, started, e)
+        raise
+    _release(limit, started, None)
@@ -0,0 +1,601 @@
+"""
+Registry of LLM backends behind one interface.
+
+Every backend turns a prompt into text, blocking (complete, optionally
+streaming chunks to on_token) or awaitable (acomplete). Backends are looked
+up by name, and pipeline stages are routed to a backend and model through
+pipeline_config, so the choice is configuration rather than module aliasing.
+
+Registered backends:
+    openai            models (OpenAI chat completions, gpt-4o by default)
+    ollama-http       models_ollama (/api/generate, llama3.1:8b by default); alias "ollama"
+    ollama-assistant  ollama_models.OllamaClient (medgemma-assistant by default)
+    ollama-cli        `ollama run` subprocess, for machines without the HTTP API exposed
+    fake              Deterministic offline responses for dry runs and benchmarks
+    hedged            hedging.HedgedBackend: primary with a latency-based hedge/failover secondary
+
+The modules behind a backend are imported on first use, so an Ollama-only
+process never needs the openai package or an API key.
+
+Stage calls pass the stage's pipeline_config.GenerationProfile to the
+backend, reduced to the settings it can apply (generation_settings): the
+Ollama HTTP backends send them as request options, OpenAI as
+max_completion_tokens/temperature/stop, and backends without request
+options (ollama-cli, fake) cut the output at the token cap (estimated at
+CHARS_PER_TOKEN) and at stop sequences, stopping generation there.
+"""
+
+import json
+import subprocess
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import backend_limits
+import llm_cache
+import pipeline_config
+import streaming
+import tracing
+
+CHARS_PER_TOKEN = 4  # Output length per token for backends that enforce max_tokens client-side
+
+
+class Backend:
+    """
+    Interface of an LLM backend.
+
+    Subclasses set name and default_model and implement complete and
+    acomplete; a model of None means default_model.
+    """
+
+    name = ""
+    default_model: Optional[str] = None
+    # GenerationProfile fields the backend applies; others keep its defaults
+    generation_settings: Tuple[str, ...] = ('max_tokens', 'temperature', 'stop', 'num_ctx')
+
+    def complete(self, prompt: str, model: Optional[str] = None, timeout: Optional[float] = None,
+                 on_token: Optional[Callable[[str], None]] = None, cache: bool = True,
+                 profile: Optional[pipeline_config.GenerationProfile] = None) -> str:
+        """
+        Generate a completion.
+
+        Args:
+            prompt: Prompt text
+            model: Model name, defaults to default_model
+            timeout: Request timeout in seconds
+            on_token: Optional callback; when given the response is streamed
+                and on_token receives each chunk as it arrives
+            cache: Set to False to bypass llm_cache
+            profile: Optional generation settings; max_tokens is a hard cap
+                on the generated tokens
+
+        Returns:
+            Generated text
+        """
+        raise NotImplementedError
+
+    async def acomplete(self, prompt: str, model: Optional[str] = None, timeout: Optional[float] = None,
+                        cache: bool = True, profile: Optional[pipeline_config.GenerationProfile] = None) -> str:
+        """Awaitable counterpart of complete; timeout is an overall deadline."""
+        raise NotImplementedError
+
+    def complete_json(self, prompt: str, schema: Dict[str, Any], model: Optional[str] = None,
+                      timeout: Optional[float] = None, cache: bool = True,
+                      profile: Optional[pipeline_config.GenerationProfile] = None) -> Dict[str, Any]:
+        """
+        Generate a JSON object matching a JSON schema.
+
+        Backends with structured outputs constrain decoding to the schema;
+        this default asks for JSON in the prompt and parses the reply.
+
+        Raises:
+            ValueError: If the reply contains no JSON object
+        """
+        instructions = f"\n\nRespond only with a JSON object matching this JSON schema:\n{json.dumps(schema)}"
+        return parse_json(self.complete(prompt + instructions, model=model, timeout=timeout, cache=cache,
+                                        profile=profile))
+
+    def effective_profile(self, profile: Optional[pipeline_config.GenerationProfile]
+                          ) -> Optional[pipeline_config.GenerationProfile]:
+        """The settings of a profile this backend applies (the rest reset to its defaults)."""
+        if profile is None:
+            return None
+        return pipeline_config.GenerationProfile(**{field: value for field, value in profile._asdict().items()
+                                                    if field in self.generation_settings})
+
+    def warm(self, model: Optional[str] = None) -> Optional[str]:
+        """
+        Prepare for the first call: create clients and connection pools and,
+        for local servers, load the model.
+
+        Returns:
+            Summary of what was warmed (e.g. model load time), or None
+        """
+        return None
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.name!r} default_model={self.default_model!r}>"
+
+
+def _preload_ollama(model: str) -> Optional[str]:
+    import ollama_http
+    ollama_http.get_session()
+    if not ollama_http.PRELOAD_MODELS:
+        return None
+    return ollama_http.describe_preload(ollama_http.preload(model))
+
+
+class OutputLimit:
+    """
+    Client-side max_tokens and stop sequences for backends without request
+    options: feed() the output as it arrives and stop reading once reached.
+    """
+
+    def __init__(self, profile: Optional[pipeline_config.GenerationProfile]):
+        self.max_chars = profile.max_tokens * CHARS_PER_TOKEN if profile and profile.max_tokens else None
+        self.stop = profile.stop if profile else ()
+        self.text = ""
+        self.reached: Optional[str] = None  # 'length' or 'stop' once the output was cut
+
+    @property
+    def bounded(self) -> bool:
+        return self.max_chars is not None or bool(self.stop)
+
+    def feed(self, chunk: str) -> str:
+        """Add a chunk of output; returns the part of it within the limits."""
+        if self.reached:
+            return ""
+        text = self.text + chunk
+        cut = len(text)
+        for stop in self.stop:
+            index = text.find(stop, max(0, len(self.text) - len(stop) + 1))
+            if index != -1 and index < cut:
+                cut, self.reached = index, 'stop'
+        if self.max_chars is not None and self.max_chars < cut:
+            cut, self.reached = self.max_chars, 'length'
+        emitted = text[len(self.text):cut]
+        self.text = text[:cut]
+        if self.reached:
+            tracing.record_usage(finish_reason=self.reached)
+        return emitted
+
+    def options(self) -> Optional[Dict[str, Any]]:
+        """The limits as llm_cache options (part of the cache key)."""
+        if not self.bounded:
+            return None
+        return {'max_chars': self.max_chars, 'stop': list(self.stop)}
+
+
+def parse_json(text: str) -> Dict[str, Any]:
+    """Decode the outermost JSON object in a model reply (tolerates code fences and prose)."""
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError(f"No JSON object in response: {text[:200]!r}")
+    return json.loads(text[start:end + 1])
+
+
+class OpenAIBackend(Backend):
+    name = 'openai'
+    generation_settings = ('max_tokens', 'temperature', 'stop')  # No context window setting
+
+    @property
+    def default_model(self):
+        import models
+        return models.DEFAULT_MODEL
+
+    def complete(self, prompt, model=None, timeout=None, on_token=None, cache=True, profile=None):
+        import models
+        return models.call_openai(prompt, model=model, timeout=timeout, cache=cache,
+                                  on_token=on_token, profile=profile).choices[0].message.content
+
+    async def acomplete(self, prompt, model=None, timeout=None, cache=True, profile=None):
+        import models
+        response = await models.acall_openai(prompt, model=model, timeout=timeout, cache=cache, profile=profile)
+        return response.choices[0].message.content
+
+    def complete_json(self, prompt, schema, model=None, timeout=None, cache=True, profile=None):
+        import models
+        return models.call_json(prompt, schema, model=model, timeout=timeout, cache=cache, profile=profile)
+
+    def warm(self, model=None):
+        import models
+        models.get_client()
+        return None
+
+
+class OllamaHTTPBackend(Backend):
+    name = 'ollama-http'
+
+    @property
+    def default_model(self):
+        import models_ollama
+        return models_ollama.DEFAULT_MODEL
+
+    def complete(self, prompt, model=None, timeout=None, on_token=None, cache=True, profile=None):
+        import models_ollama
+        return models_ollama.call_openai(prompt, model=model, timeout=timeout, cache=cache,
+                                         on_token=on_token, profile=profile).choices[0].message.content
+
+    async def acomplete(self, prompt, model=None, timeout=None, cache=True, profile=None):
+        import models_ollama
+        response = await models_ollama.acall_openai(prompt, model=model, timeout=timeout, cache=cache,
+                                                    profile=profile)
+        return response.choices[0].message.content
+
+    def complete_json(self, prompt, schema, model=None, timeout=None, cache=True, profile=None):
+        import models_ollama
+        return models_ollama.call_json(prompt, schema, model=model, timeout=timeout, cache=cache, profile=profile)
+
+    def warm(self, model=None):
+        return _preload_ollama(model or self.default_model)
+
+
+class OllamaAssistantBackend(Backend):
+    name = 'ollama-assistant'
+    default_model = 'medgemma-assistant'
+
+    def _client(self, model, timeout, cache):
+        import ollama_models
+        client = ollama_models.OllamaClient(model or self.default_model, cache=cache)
+        if timeout is not None:
+            client.timeout = timeout
+        return client
+
+    def complete(self, prompt, model=None, timeout=None, on_token=None, cache=True, profile=None):
+        import ollama_http
+        return self._client(model, timeout, cache).generate(
+            prompt, on_token=on_token, options=ollama_http.generation_options(profile))
+
+    async def acomplete(self, prompt, model=None, timeout=None, cache=True, profile=None):
+        import ollama_http
+        return await self._client(model, timeout, cache).agenerate(
+            prompt, timeout=timeout, options=ollama_http.generation_options(profile))
+
+    def warm(self, model=None):
+        return _preload_ollama(model or self.default_model)
+
+
+def _write_stdin(stdin, text: str) -> None:
+    try:
+        stdin.write(text)
+        stdin.close()
+    except (BrokenPipeError, OSError, ValueError):
+        pass  # The process exited or was killed; its exit status reports why
+
+
+def _read_lines(stream, put: Callable[[Optional[str]], None]) -> None:
+    try:
+        for line in iter(stream.readline, ''):
+            put(line)
+    except (OSError, ValueError):
+        pass  # Closed after the process was killed
+    finally:
+        put(None)
+        stream.close()
+
+
+class OllamaCLIBackend(Backend):
+    """
+    Runs `ollama run MODEL` with the prompt on stdin, one process per call.
+
+    `ollama run` takes no request options, so max_tokens and stop sequences
+    are enforced on its output (the process is killed once they are reached)
+    and temperature and num_ctx keep the Modelfile's values.
+    """
+
+    name = 'ollama-cli'
+    default_model = 'medgemma-assistant'
+    executable = 'ollama'
+    generation_settings = ('max_tokens', 'stop')
+
+    def _command(self, model):
+        return [self.executable, 'run', model]
+
+    def _run(self, model, prompt, timeout):
+        with backend_limits.backend_slot('ollama'):
+            result = subprocess.run(self._command(model), input=prompt, capture_output=True, text=True,
+                                    encoding='utf-8', timeout=timeout)
+        if result.returncode != 0:
+            raise Exception(f"ollama run failed ({result.returncode}): {result.stderr.strip()}")
+        return result.stdout.strip()
+
+    def _stream(self, model, prompt, timeout, limit):
+        import queue
+        import time
+        command = self._command(model)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining():
+            return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+        with backend_limits.backend_slot('ollama'):
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE, text=True, encoding='utf-8')
+            # Pipes are served by threads so the deadline holds even if the process stalls
+            lines: "queue.Queue[Optional[str]]" = queue.Queue()
+            stderr = []
+            pumps = [threading.Thread(target=_write_stdin, args=(process.stdin, prompt), daemon=True),
+                     threading.Thread(target=_read_lines, args=(process.stdout, lines.put), daemon=True),
+                     threading.Thread(target=_read_lines, args=(process.stderr, stderr.append), daemon=True)]
+            for pump in pumps:
+                pump.start()
+            try:
+                while True:
+                    try:
+                        line = lines.get(timeout=remaining())
+                    except queue.Empty:
+                        raise subprocess.TimeoutExpired(command, timeout)
+                    if line is None:
+                        break
+                    chunk = limit.feed(line)
+                    if chunk:
+                        yield chunk
+                    if limit.reached:
+                        return  # The process is killed below
+                if process.wait(remaining()) != 0:
+                    pumps[2].join(1)
+                    message = "".join(line for line in stderr if line).strip()
+                    raise Exception(f"ollama run failed ({process.returncode}): {message}")
+            finally:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+
+    def complete(self, prompt, model=None, timeout=None, on_token=None, cache=True, profile=None):
+        model = model or self.default_model
+        limit = OutputLimit(profile)
+        if on_token is not None or limit.bounded:
+            chunks = llm_cache.cached_stream(self.name, model, prompt, limit.options(),
+                                             lambda: self._stream(model, prompt, timeout, limit), cache=cache)
+            return streaming.collect(chunks, on_token).strip()
+        return llm_cache.cached_text(self.name, model, prompt, None,
+                                     lambda: self._run(model, prompt, timeout), cache=cache)
+
+    async def acomplete(self, prompt, model=None, timeout=None, cache=True, profile=None):
+        import asyncio
+        model = model or self.default_model
+        limit = OutputLimit(profile)
+
+        async def read(process):
+            process.stdin.write(prompt.encode('utf-8'))
+            await process.stdin.drain()
+            process.stdin.close()
+            while not limit.reached:
+                line = await process.stdout.readline()
+                if not line:
+                    break
+                limit.feed(line.decode('utf-8'))
+            if not limit.reached and await process.wait() != 0:
+                stderr = await process.stderr.read()
+                raise Exception(f"ollama run failed ({process.returncode}): {stderr.decode(errors='replace').strip()}")
+
+        async def compute():
+            async with backend_limits.async_backend_slot('ollama'):
+                process = await asyncio.create_subprocess_exec(
+                    *self._command(model), stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+                try:
+                    await asyncio.wait_for(read(process), timeout)
+                finally:
+                    if process.returncode is None:
+                        process.kill()
+                        await process.wait()
+            return limit.text.strip()
+
+        return await llm_cache.acached_text(self.name, model, prompt, limit.options(), compute, cache=cache)
+
+
+class FakeBackend(Backend):
+    """
+    Offline backend returning a deterministic echo of the prompt, for dry
+    runs of the pipeline wiring. Responses are never cached.
+    """
+
+    name = 'fake'
+    default_model = 'fake'
+    words = 40  # Words of the prompt echoed back
+    generation_settings = ('max_tokens', 'stop')
+
+    def _respond(self, prompt, model, limit):
+        limit.feed(f"[{model}] " + " ".join(prompt.split()[:self.words]))
+        return limit.text
+
+    def complete(self, prompt, model=None, timeout=None, on_token=None, cache=True, profile=None):
+        model = model or self.default_model
+        limit = OutputLimit(profile)
+        text = llm_cache.cached_text(self.name, model, prompt, limit.options(),
+                                     lambda: self._respond(prompt, model, limit), cache=False)
+        if on_token is not None:
+            on_token(text)
+        return text
+
+    async def acomplete(self, prompt, model=None, timeout=None, cache=True, profile=None):
+        return self.complete(prompt, model=model, profile=profile)
+
+    def complete_json(self, prompt, schema, model=None, timeout=None, cache=True, profile=None):
+        return _empty_instance(schema)
+
+
+def _empty_instance(schema: Dict[str, Any]) -> Any:
+    """Smallest value matching a JSON schema: empty arrays/strings, null where allowed."""
+    types = schema.get('type')
+    types = types if isinstance(types, list) else [types]
+    if 'null' in types:
+        return None
+    if 'enum' in schema:
+        return schema['enum'][-1]
+    if 'object' in types:
+        return {key: _empty_instance(value) for key, value in schema.get('properties', {}).items()}
+    if 'array' in types:
+        return []
+    if 'string' in types:
+        return ""
+    return 0
+
+
+_factories: Dict[str, Callable[[], Backend]] = {}
+_aliases: Dict[str, str] = {}
+_instances: Dict[str, Backend] = {}
+_lock = threading.Lock()
+
+
+def register_backend(name: str, factory: Callable[[], Backend], aliases: Tuple[str, ...] = ()) -> None:
+    """
+    Register (or replace) a backend.
+
+    Args:
+        name: Backend name used in pipeline_config routes
+        factory: Zero-argument callable returning the Backend, called on first use
+        aliases: Other names resolving to this backend
+    """
+    with _lock:
+        _factories[name] = factory
+        _instances.pop(name, None)
+        for alias in aliases:
+            _aliases[alias] = name
+
+
+def available_backends() -> Tuple[str, ...]:
+    """Registered backend names (without aliases)."""
+    return tuple(_factories)
+
+
+def get_backend(name: str) -> Backend:
+    """
+    Return the shared instance of a registered backend.
+
+    Raises:
+        ValueError: If no backend is registered under name
+    """
+    name = _aliases.get(name, name)
+    with _lock:
+        backend = _instances.get(name)
+        if backend is None:
+            factory = _factories.get(name)
+            if factory is None:
+                raise ValueError(f"Unknown backend {name!r}, expected one of {available_backends()}")
+            backend = _instances[name] = factory()
+        return backend
+
+
+def resolve(stage: Optional[str] = None, backend: Optional[str] = None,
+            model: Optional[str] = None) -> Tuple[Backend, Optional[str]]:
+    """Backend and model for a stage; explicit backend/model override its route."""
+    route = pipeline_config.route_for(stage) if stage else pipeline_config.DEFAULT_ROUTE
+    if backend is not None and backend != route.backend:
+        route = pipeline_config.Route(backend, model)
+    return get_backend(route.backend), model or route.model
+
+
+def stage_profile(stage: str, selected: Backend,
+                  profile: Optional[pipeline_config.GenerationProfile] = None) -> pipeline_config.GenerationProfile:
+    """
+    Generation settings a stage's call runs with: its pipeline_config
+    profile, overridden by the set fields of profile, as far as the selected
+    backend applies them.
+    """
+    configured = pipeline_config.profile_for(stage)
+    if profile is not None:
+        configured = configured.merged(profile)
+    return selected.effective_profile(configured)
+
+
+def describe_stage(stage: str, backend: Optional[str] = None) -> str:
+    """Route and effective generation settings of a stage, e.g. for a startup banner."""
+    selected, model = resolve(stage, backend)
+    return f"{selected.name} ({model or selected.default_model}) {stage_profile(stage, selected).describe()}"
+
+
+def _annotate(profile: pipeline_config.GenerationProfile) -> None:
+    # Effective limits on the stage span, next to the tokens its calls generated
+    tracing.annotate(max_tokens=profile.max_tokens, temperature=profile.temperature,
+                     stop=list(profile.stop) or None, num_ctx=profile.num_ctx)
+
+
+def complete_stage(stage: str, prompt: str, on_token: Optional[Callable[[str], None]] = None,
+                   timeout: Optional[float] = None, backend: Optional[str] = None,
+                   model: Optional[str] = None, cache: bool = True,
+                   profile: Optional[pipeline_config.GenerationProfile] = None) -> str:
+    """
+    Complete a prompt with the backend, model and generation profile
+    configured for a stage.
+
+    Args:
+        stage: Pipeline stage name looked up in pipeline_config
+        prompt: Prompt text
+        on_token: Optional streaming callback
+        timeout: Request timeout in seconds
+        backend: Backend overriding the stage's route
+        model: Model overriding the stage's route
+        cache: Set to False to bypass llm_cache
+        profile: Generation settings overriding those of the stage's profile
+
+    Returns:
+        Generated text
+    """
+    selected, model = resolve(stage, backend, model)
+    profile = stage_profile(stage, selected, profile)
+    _annotate(profile)
+    return selected.complete(prompt, model=model, timeout=timeout, on_token=on_token, cache=cache, profile=profile)
+
+
+def complete_stage_json(stage: str, prompt: str, schema: Dict[str, Any], timeout: Optional[float] = None,
+                        backend: Optional[str] = None, model: Optional[str] = None,
+                        cache: bool = True,
+                        profile: Optional[pipeline_config.GenerationProfile] = None) -> Dict[str, Any]:
+    """Schema-constrained counterpart of complete_stage, returning the decoded object."""
+    selected, model = resolve(stage, backend, model)
+    profile = stage_profile(stage, selected, profile)
+    _annotate(profile)
+    return selected.complete_json(prompt, schema, model=model, timeout=timeout, cache=cache, profile=profile)
+
+
+def warm_routes(extra: Tuple[Tuple[str, Optional[str]], ...] = ()) -> None:
+    """
+    Warm the backend and model of every stage route once, printing what was
+    loaded (Ollama models are preloaded and pinned for ollama_http.KEEP_ALIVE).
+    Failures are reported, not raised: the first real call will surface them.
+
+    Args:
+        extra: Further (backend, model) pairs to warm, model None meaning the
+            backend's default
+    """
+    seen = set()
+    targets = [resolve(stage) for stage in pipeline_config.STAGE_ROUTES]
+    targets += [(get_backend(name), model) for name, model in extra]
+    for selected, model in targets:
+        key = (selected.name, model or selected.default_model)
+        if key in seen:
+            continue
+        seen.add(key)
+        try:
+            summary = selected.warm(model)
+        except Exception as e:
+            print(f"⚠️ Could not warm {key[0]} ({key[1]}): {e}")
+            continue
+        if summary:
+            print(f"🔥 {summary}")
+
+
+async def acomplete_stage(stage: str, prompt: str, timeout: Optional[float] = None,
+                          backend: Optional[str] = None, model: Optional[str] = None, cache: bool = True,
+                          profile: Optional[pipeline_config.GenerationProfile] = None) -> str:
+    """Awaitable counterpart of complete_stage."""
+    selected, model = resolve(stage, backend, model)
+    profile = stage_profile(stage, selected, profile)
+    _annotate(profile)
+    return await selected.acomplete(prompt, model=model, timeout=timeout, cache=cache, profile=profile)
+
+
+register_backend('openai', OpenAIBackend)
+register_backend('ollama-http', OllamaHTTPBackend, aliases=('ollama',))
+register_backend('ollama-assistant', OllamaAssistantBackend)
+register_backend('ollama-cli', OllamaCLIBackend)
+register_backend('fake', FakeBackend)
+
+
+def _hedged_backend() -> Backend:
+    import hedging
+    return hedging.HedgedBackend()
+
+
+register_backend('hedged', _hedged_backend)
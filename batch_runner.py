@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Batch job runner for large report sets, with checkpoint/resume.
+
+Reads report records from a JSONL file (one {"id", "title", "text"} object
+per line; "id" and "title" are optional) or a directory/glob of PDFs, runs
+each through the process_extracted_reports pipeline and appends one result
+record per report to an output JSONL file as soon as it finishes.
+
+Input is streamed and only a bounded number of reports is in flight, so
+memory stays flat for 50k-report runs. Progress is kept in two append-only
+files, which makes a crashed or interrupted run resumable by re-running the
+same command:
+
+- the output JSONL itself: reports whose id is in it are skipped;
+- OUTPUT.checkpoint.jsonl: every finished stage of a report that is still in
+  progress, so a resumed report only runs the stages it had not finished.
+  Each stage output carries a fingerprint of the report text and of the
+  stage's prompt, route and inputs (analysis_manifest.stage_fingerprints);
+  outputs whose fingerprint no longer matches (text edited under the same
+  id, --structured or --config changed) are run again.
+
+A torn last line (crash mid-write) is dropped on resume. The checkpoint file
+is removed once a run finishes without failures.
+
+    python batch_runner.py reports.jsonl --output results.jsonl --workers 8
+    python batch_runner.py ./pdfs --output results.jsonl   # resumes if interrupted
+"""
+
+import argparse
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, Optional, Set
+
+import analysis_manifest
+import backend_limits
+
+CHECKPOINT_SUFFIX = ".checkpoint.jsonl"
+PDF_CHUNK = 32  # PDFs extracted per extract_pdfs call
+IN_FLIGHT_PER_WORKER = 2  # Reports queued ahead of the workers
+PROGRESS_EVERY = 50  # Reports between progress lines
+
+
+def record_id(record: Dict[str, Any]) -> str:
+    """Stable id of an input record: its "id" field, else a hash of title and text."""
+    if record.get('id') is not None:
+        return str(record['id'])
+    digest = hashlib.sha256(f"{record.get('title', '')}\0{record['text']}".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def checkpoint_fingerprints(text: str, stage_fingerprints: Dict[str, str]) -> Dict[str, str]:
+    """Fingerprint of each stage output of a report: its text and the stage's fingerprint."""
+    text_hash = analysis_manifest.text_hash(text)
+    return {stage: hashlib.sha256(f"{text_hash}\0{fingerprint}".encode('utf-8')).hexdigest()[:16]
+            for stage, fingerprint in stage_fingerprints.items()}
+
+
+def read_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the records of a JSONL file, skipping blank lines.
+
+    A final line without a trailing newline that is not valid JSON (a torn
+    write) is ignored; other invalid lines raise ValueError.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                if line.endswith("\n"):
+                    raise ValueError(f"{path}:{number}: invalid JSON line")
+
+
+def repair_tail(path: str) -> None:
+    """Truncate a torn last line so records appended after it stay parseable."""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Scan back for the last complete line
+        position = size
+        while position > 0:
+            step = min(65536, position)
+            position -= step
+            f.seek(position)
+            chunk = f.read(step)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                f.truncate(position + newline + 1)
+                return
+        f.truncate(0)
+
+
+def iter_jsonl_reports(path: str) -> Iterator[Dict[str, Any]]:
+    """Report records of a JSONL file; the text may also be under "report"."""
+    for record in read_jsonl(path):
+        text = record.get('text', record.get('report'))
+        if not text:
+            continue
+        report = dict(record, text=text)
+        report['id'] = record_id(report)
+        report.setdefault('title', report['id'])
+        yield report
+
+
+def iter_pdf_reports(source: str, skip: Set[str], cache_dir: Optional[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Report records extracted from a directory or glob of PDFs, PDF_CHUNK at
+    a time. PDFs whose id (the path) is in skip are not extracted.
+    """
+    import extract_pdfs
+
+    paths = [path for path in extract_pdfs.find_pdfs(source) if path not in skip]
+    for start in range(0, len(paths), PDF_CHUNK):
+        texts = extract_pdfs.extract_pdfs(paths[start:start + PDF_CHUNK], cache_dir=cache_dir)
+        for path, text in texts.items():
+            if text:
+                yield {'id': path, 'title': extract_pdfs.title_from_filename(path), 'text': text}
+            else:
+                print(f"⚠️ No text extracted, skipping: {path}")
+
+
+def is_pdf_source(source: str) -> bool:
+    return os.path.isdir(source) or source.lower().endswith('.pdf') or glob.has_magic(source)
+
+
+class Checkpoint:
+    """Completed reports (from the output file) and finished stages of the others."""
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self.path = output_path + CHECKPOINT_SUFFIX
+        self._lock = threading.Lock()
+        self.done: Set[str] = set()
+        self.stages: Dict[str, Dict[str, Dict[str, Any]]] = {}  # id -> stage -> {'fingerprint', 'output'}
+
+        for path in (self.output_path, self.path):
+            repair_tail(path)
+        if os.path.exists(self.output_path):
+            self.done = {record['id'] for record in read_jsonl(self.output_path)}
+        if os.path.exists(self.path):
+            for entry in read_jsonl(self.path):
+                if entry['id'] not in self.done:
+                    self.stages.setdefault(entry['id'], {})[entry['stage']] = {
+                        'fingerprint': entry.get('fingerprint'), 'output': entry['output']}
+
+    def _append(self, path: str, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock, open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+    def completed(self, report_id: str, fingerprints: Dict[str, str]) -> Dict[str, Any]:
+        """Checkpointed stage outputs of a report whose fingerprints still match."""
+        with self._lock:
+            stages = self.stages.get(report_id, {})
+            return {stage: entry['output'] for stage, entry in stages.items()
+                    if entry['fingerprint'] is not None and fingerprints.get(stage) == entry['fingerprint']}
+
+    def stage_done(self, report_id: str, stage: str, fingerprint: Optional[str], output: Any) -> None:
+        self._append(self.path, {'id': report_id, 'stage': stage, 'fingerprint': fingerprint, 'output': output})
+
+    def report_done(self, result: Dict[str, Any]) -> None:
+        self._append(self.output_path, result)
+        with self._lock:
+            self.done.add(result['id'])
+            self.stages.pop(result['id'], None)
+
+    def clear(self) -> None:
+        """Remove the stage checkpoint file (all reports finished)."""
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path)
+
+
+def run_batch(source: str, output_path: str, workers: int = 4, cache_dir: Optional[str] = None,
+              limit: Optional[int] = None) -> Dict[str, int]:
+    """
+    Run the pipeline over every report of source, resuming from output_path.
+
+    Args:
+        source: JSONL file of report records, or a directory/glob of PDFs
+        output_path: Result JSONL file, appended to
+        workers: Reports processed concurrently (backend calls are further
+            bounded by backend_limits)
+        cache_dir: extraction_cache directory for PDF sources (None disables)
+        limit: Stop after this many reports were submitted in this run
+
+    Returns:
+        Counts of 'processed', 'failed' and 'skipped' (already done) reports
+    """
+    import process_extracted_reports
+
+    checkpoint = Checkpoint(output_path)
+    counts = {'processed': 0, 'failed': 0, 'skipped': 0}
+    if checkpoint.done or checkpoint.stages:
+        print(f"♻️  Resuming: {len(checkpoint.done)} reports done, "
+              f"{len(checkpoint.stages)} partially done")
+
+    if is_pdf_source(source):
+        reports = iter_pdf_reports(source, checkpoint.done, cache_dir)
+    else:
+        reports = iter_jsonl_reports(source)
+
+    # Under the prompts, routes and --structured setting of this run
+    stage_fingerprints = analysis_manifest.stage_fingerprints(
+        process_extracted_reports.PROVIDER_ASSISTANT_PROMPT, process_extracted_reports.STRUCTURED_EXTRACTION)
+
+    def run(report):
+        report_id = report['id']
+        fingerprints = checkpoint_fingerprints(report['text'], stage_fingerprints)
+        result = process_extracted_reports.process_single_report(
+            report,
+            completed=checkpoint.completed(report_id, fingerprints),
+            on_stage=lambda stage, output: checkpoint.stage_done(report_id, stage, fingerprints.get(stage), output),
+        )
+        if result is None:
+            return False
+        checkpoint.report_done(dict(result, id=report_id))
+        return True
+
+    started = time.perf_counter()
+    in_flight = {}
+    submitted = 0
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for report in reports:
+            if report['id'] in checkpoint.done:
+                counts['skipped'] += 1
+                continue
+            if limit is not None and submitted >= limit:
+                break
+            # Keep a bounded queue so a huge input is never held in memory
+            while len(in_flight) >= workers * IN_FLIGHT_PER_WORKER:
+                _collect(wait(in_flight, return_when=FIRST_COMPLETED).done, in_flight, counts, started)
+            in_flight[executor.submit(run, report)] = report
+            submitted += 1
+        while in_flight:
+            _collect(wait(in_flight, return_when=FIRST_COMPLETED).done, in_flight, counts, started)
+    except KeyboardInterrupt:
+        print("\n⏹️  Interrupted; waiting for running reports (their finished stages are checkpointed)...")
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    finally:
+        executor.shutdown(wait=True)
+
+    if counts['failed'] == 0 and not checkpoint.stages:
+        checkpoint.clear()
+    return counts
+
+
+def _collect(done, in_flight, counts, started) -> None:
+    for future in done:
+        report = in_flight.pop(future)
+        try:
+            ok = future.result()
+        except Exception as e:
+            print(f"❌ Error processing {report.get('title', report['id'])}: {e}")
+            ok = False
+        if ok:
+            counts['processed'] += 1
+        else:
+            counts['failed'] += 1
+            print(f"❌ Failed: {report['id']} (finished stages are kept for the next run)")
+        finished = counts['processed'] + counts['failed']
+        if finished % PROGRESS_EVERY == 0:
+            rate = finished / (time.perf_counter() - started)
+            print(f"⏳ {counts['processed']} processed, {counts['failed']} failed ({rate:.2f} reports/s)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the report pipeline over a JSONL file or PDF directory, resumably")
+    parser.add_argument('source', help="JSONL file of report records, or a directory/glob of PDFs")
+    parser.add_argument('--output', required=True, help="Result JSONL file (appended; also the resume checkpoint)")
+    parser.add_argument('--workers', type=int, default=4, help="Reports processed concurrently")
+    parser.add_argument('--ollama-concurrency', type=int, default=None, help="Pin in-flight Ollama requests (default: adaptive, see backend_limits)")
+    parser.add_argument('--openai-concurrency', type=int, default=None, help="Max in-flight OpenAI requests")
+    parser.add_argument('--config', default=None, help="JSON file of per-stage backend routes (see pipeline_config)")
+    parser.add_argument('--structured', action='store_true',
+                        help="Extract structured findings first and prompt the other stages from them")
+    parser.add_argument('--limit', type=int, default=None, help="Process at most this many reports in this run")
+    parser.add_argument('--no-cache', action='store_true', help="Re-extract PDFs instead of using .extraction_cache")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.ollama_concurrency:
+        backend_limits.set_limit('ollama', args.ollama_concurrency)
+    if args.openai_concurrency:
+        backend_limits.set_limit('openai', args.openai_concurrency)
+    if args.config:
+        import pipeline_config
+        pipeline_config.load_config(args.config)
+    if args.structured:
+        import process_extracted_reports
+        process_extracted_reports.STRUCTURED_EXTRACTION = True
+
+    print(f"🏥 Batch run: {args.source} -> {args.output} ({args.workers} workers)")
+    import backends
+    backends.warm_routes()
+    counts = run_batch(args.source, args.output, workers=args.workers,
+                       cache_dir=None if args.no_cache else ".extraction_cache",
+                       limit=args.limit)
+    print(f"✅ {counts['processed']} processed, {counts['failed']} failed, "
+          f"{counts['skipped']} already done")
+    print(f"⚙️  Backend limits at the end: {backend_limits.describe_limits()}")
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the report pipeline against fake_llm_server.
+
+Runs process_extracted_reports' stage graph over test_reports.REPORT /
+JAMES_REPORT, the sample PDFs (when pdfplumber is installed) and synthetic
+variants of them, at several concurrency levels, plus raw backend calls to
+the Ollama and OpenAI clients. Reports per-stage p50/p95/p99 latency,
+throughput and peak RSS, and can save a baseline and flag regressions
+against one (exit status 1), e.g. in CI:
+
+    python benchmark.py --save-baseline benchmark_baseline.json
+    python benchmark.py --compare benchmark_baseline.json --tolerance 0.25
+
+The LLM response cache is bypassed unless --with-cache is given.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Sequence
+
+from fake_llm_server import FakeLLMServer, DEFAULT_LATENCY, DEFAULT_TOKENS, DEFAULT_TOKENS_PER_S
+
+CONCURRENCY_LEVELS = (1, 4, 8)
+REPORT_COUNT = 12
+PERCENTILES = (50, 95, 99)
+# Relative slowdown (or throughput drop / RSS growth) tolerated against a baseline
+TOLERANCE = 0.25
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of values."""
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(values: Sequence[float]) -> Dict[str, float]:
+    return {f"p{pct}": round(percentile(values, pct), 4) for pct in PERCENTILES}
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def sample_pdf_reports() -> List[Dict[str, str]]:
+    """Reports extracted from the date-prefixed sample PDFs, if pdfplumber is available."""
+    try:
+        import extract_pdfs
+        paths = extract_pdfs.find_pdfs(extract_pdfs.DEFAULT_SOURCE)
+        with contextlib.redirect_stdout(io.StringIO()):
+            texts = extract_pdfs.extract_pdfs(paths, cache_dir=".extraction_cache")
+    except ImportError:
+        return []
+    return [{'title': extract_pdfs.title_from_filename(path), 'text': text}
+            for path, text in texts.items() if text]
+
+
+def synthetic_variant(report: Dict[str, str], index: int, rng: random.Random) -> Dict[str, str]:
+    """A distinct report derived from a real one: shuffled finding lines and a variant tag."""
+    lines = report['text'].splitlines()
+    body = lines[1:]
+    rng.shuffle(body)
+    text = "\n".join(lines[:1] + body) + f"\n\nVariant {index}: age {rng.randint(25, 85)}"
+    return {'title': f"{report['title']} (variant {index})", 'text': text}
+
+
+def build_workload(count: int, seed: int = 0) -> List[Dict[str, str]]:
+    """count reports: the real samples first, then synthetic variants of them."""
+    import test_reports
+
+    base = [
+        {'title': 'Sample report', 'text': test_reports.REPORT},
+        {'title': 'James report', 'text': test_reports.JAMES_REPORT},
+    ] + sample_pdf_reports()
+    rng = random.Random(seed)
+    workload = base[:count]
+    while len(workload) < count:
+        workload.append(synthetic_variant(base[len(workload) % len(base)], len(workload), rng))
+    return workload
+
+
+def bench_pipeline(reports: List[Dict[str, str]], concurrency: int) -> Dict[str, Any]:
+    """Run the batch pipeline once at a concurrency level and collect stage latencies."""
+    import backend_limits
+    import process_extracted_reports
+
+    backend_limits.set_limit('ollama', concurrency)
+    backend_limits.set_limit('openai', concurrency)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = process_extracted_reports.process_reports_batch(reports, max_workers=concurrency)
+    elapsed = time.perf_counter() - started
+
+    stages: Dict[str, Dict[str, List[float]]] = {}
+    for result in results:
+        for stage, timing in (result or {}).get('timings', {}).items():
+            for metric in ('total_s', 'ttft_s'):
+                if timing.get(metric) is not None:
+                    stages.setdefault(stage, {}).setdefault(metric, []).append(timing[metric])
+    return {
+        'reports': len(reports),
+        'failed': sum(result is None for result in results),
+        'wall_s': round(elapsed, 3),
+        'throughput_rps': round(len(reports) / elapsed, 3),
+        'stages': {stage: {metric: summarize(values) for metric, values in metrics.items()}
+                   for stage, metrics in sorted(stages.items())},
+    }
+
+
+def bench_backend(name: str, call, prompts: List[str], concurrency: int) -> Dict[str, Any]:
+    """Latency percentiles and throughput of raw backend calls."""
+    def timed(prompt):
+        started = time.perf_counter()
+        call(prompt)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(timed, prompts))
+    elapsed = time.perf_counter() - started
+    return {'calls': len(prompts), 'throughput_rps': round(len(prompts) / elapsed, 3),
+            'latency_s': summarize(latencies)}
+
+
+def run(args) -> Dict[str, Any]:
+    server = FakeLLMServer(latency=args.latency, tokens_per_s=args.tokens_per_s, tokens=args.tokens, seed=0).start()
+    # Backends read these on first use; set them before the pipeline modules are imported
+    os.environ["OLLAMA_BASE_URL"] = server.url
+    os.environ["OPENAI_BASE_URL"] = f"{server.url}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    if not args.with_cache:
+        os.environ["LLM_CACHE_BYPASS"] = "1"
+
+    import models
+    import models_ollama
+
+    reports = build_workload(args.reports)
+    prompts = [f"Explain finding {i} of the report in plain language." for i in range(args.reports * 2)]
+    report: Dict[str, Any] = {
+        'config': {'latency': args.latency, 'tokens_per_s': args.tokens_per_s, 'tokens': args.tokens,
+                   'reports': len(reports), 'python': platform.python_version()},
+        'pipeline': {},
+        'backends': {},
+    }
+    try:
+        # Warm-up: guideline index load, client creation, connection pools, lazy imports
+        bench_pipeline(reports[:1], 1)
+        models.call_openai(prompts[0])
+        for concurrency in args.concurrency:
+            print(f"⏱️  Pipeline, concurrency {concurrency}...")
+            report['pipeline'][str(concurrency)] = bench_pipeline(reports, concurrency)
+            for backend, call in (('ollama', models_ollama.call_openai), ('openai', models.call_openai)):
+                report['backends'].setdefault(backend, {})[str(concurrency)] = bench_backend(
+                    backend, call, prompts, concurrency)
+    finally:
+        server.stop()
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    for concurrency, result in report['pipeline'].items():
+        print(f"\n📊 Pipeline @ concurrency {concurrency}: {result['throughput_rps']} reports/s "
+              f"({result['reports']} reports in {result['wall_s']} s, {result['failed']} failed)")
+        for stage, metrics in result['stages'].items():
+            total = metrics.get('total_s', {})
+            ttft = metrics.get('ttft_s', {})
+            print(f"  {stage:<18} total p50/p95/p99 {total.get('p50')}/{total.get('p95')}/{total.get('p99')} s"
+                  f"   ttft p50 {ttft.get('p50')} s")
+    for backend, levels in report['backends'].items():
+        for concurrency, result in levels.items():
+            latency = result['latency_s']
+            print(f"🔌 {backend} @ {concurrency}: {result['throughput_rps']} calls/s, "
+                  f"p50/p95/p99 {latency['p50']}/{latency['p95']}/{latency['p99']} s")
+    print(f"💾 Peak RSS: {report['peak_rss_mb']} MiB")
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Regressions of report against baseline beyond tolerance.
+
+    Compares stage p95 latencies and throughput per concurrency level, backend
+    p95 latencies and peak RSS.
+    """
+    regressions = []
+
+    def slower(label, current, previous):
+        if current is not None and previous and current > previous * (1 + tolerance):
+            regressions.append(f"{label}: {previous} -> {current} (+{current / previous - 1:.0%})")
+
+    def lower(label, current, previous):
+        if current is not None and previous and current < previous * (1 - tolerance):
+            regressions.append(f"{label}: {previous} -> {current} ({current / previous - 1:.0%})")
+
+    for concurrency, previous in baseline.get('pipeline', {}).items():
+        current = report['pipeline'].get(concurrency)
+        if current is None:
+            continue
+        lower(f"pipeline@{concurrency} throughput_rps", current['throughput_rps'], previous['throughput_rps'])
+        for stage, metrics in previous['stages'].items():
+            slower(f"pipeline@{concurrency} {stage} total p95",
+                   current['stages'].get(stage, {}).get('total_s', {}).get('p95'), metrics['total_s']['p95'])
+    for backend, levels in baseline.get('backends', {}).items():
+        for concurrency, previous in levels.items():
+            current = report['backends'].get(backend, {}).get(concurrency)
+            if current is not None:
+                slower(f"{backend}@{concurrency} latency p95", current['latency_s']['p95'], previous['latency_s']['p95'])
+    slower("peak_rss_mb", report['peak_rss_mb'], baseline.get('peak_rss_mb'))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark against a fake LLM server")
+    parser.add_argument('--reports', type=int, default=REPORT_COUNT, help="Reports per pipeline run")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=list(CONCURRENCY_LEVELS),
+                        help="Concurrency levels to measure")
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY, help="Fake server time to first token")
+    parser.add_argument('--tokens-per-s', type=float, default=DEFAULT_TOKENS_PER_S, help="Fake server token rate")
+    parser.add_argument('--tokens', type=int, default=DEFAULT_TOKENS, help="Tokens per fake response")
+    parser.add_argument('--with-cache', action='store_true', help="Keep the LLM response cache enabled")
+    parser.add_argument('--output', default=None, help="Write the full results as JSON")
+    parser.add_argument('--save-baseline', default=None, help="Save the results as a baseline JSON file")
+    parser.add_argument('--compare', default=None, help="Baseline JSON file to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="Allowed relative regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    print_report(report)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"💾 Results saved to: {path}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) against {args.compare}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\n✅ No regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
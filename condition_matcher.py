@@ -0,0 +1,246 @@
+"""
+Deterministic, LLM-free matcher for the conditions in data.stats_data.
+
+Report text is scanned with compiled synonym patterns per condition (e.g.
+"facet arthrosis" -> Facet degeneration, "disc space narrowing" -> Disk height
+loss). A small NegEx-style pass marks findings inside a negated phrase
+("without bulge or herniation", "no spondylolisthesis") so they are not
+counted.
+"""
+
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+import data
+import report_fields
+
+_DISC = r"dis[ck]s?"
+
+# Synonym patterns per data.stats_data condition
+CONDITION_PATTERNS: Dict[str, List[str]] = {
+    'Disk degeneration': [
+        rf"{_DISC}\s+degeneration",
+        rf"degenerat(?:ive|ed|ion of the)\s+{_DISC}",
+        r"\bDDD\b",
+        r"discogenic",
+    ],
+    'Disk signal loss': [
+        rf"(?:decreased|diminished|reduced|loss of|low)\s+(?:T2\s+)?{_DISC}\s+signal",
+        rf"{_DISC}\s+signal\s+(?:loss|decrease)",
+        r"desiccat(?:ion|ed)",
+        rf"dark\s+{_DISC}",
+    ],
+    'Disk height loss': [
+        rf"(?:decreased|diminished|reduced|loss of)\s+(?:{_DISC}\s+)?(?:signal\s+and\s+{_DISC}\s+)?height",
+        rf"{_DISC}\s+(?:space\s+)?height\s+loss",
+        rf"{_DISC}\s+space\s+(?:narrowing|loss)",
+        rf"narrow(?:ed|ing)\s+(?:of\s+the\s+)?{_DISC}\s+space",
+    ],
+    'Disk bulge': [
+        r"bulg(?:e|es|ing)\b",
+    ],
+    'Disk protrusion': [
+        r"protrusions?",
+        r"herniat(?:ion|ions|ed)",
+        r"extru(?:sion|ded)",
+    ],
+    'Annular fissure': [
+        r"annular\s+(?:fissure|tear)s?",
+        r"high[-\s]intensity\s+zone",
+    ],
+    'Facet degeneration': [
+        r"facet\s+(?:joint\s+)?(?:arthrosis|arthropathy|degeneration|hypertrophy|osteoarthritis|arthritis|change)",
+        r"(?:degenerative|hypertrophic)\s+facet",
+        r"apophyseal\s+joint\s+arthrosis",
+        r"facets?\s+(?:which\s+are\s+)?hypertrophied",
+    ],
+    'Spondylolisthesis': [
+        r"spondylolisthesis",
+        r"(?:antero|retro)listhesis",
+    ],
+}
+
+_COMPILED = {
+    condition: re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE)
+    for condition, patterns in CONDITION_PATTERNS.items()
+}
+
+# Negation triggers apply to the next few words of the same clause
+_PRE_NEGATION_RE = re.compile(
+    r"\b(?:no|without|negative for|free of|absence of|no evidence of|not)\b(?:\s+\S+){0,5}\s*$",
+    re.IGNORECASE,
+)
+_POST_NEGATION_RE = re.compile(r"^\s*(?:is|are)?\s*(?:not\s+(?:seen|present|identified)|absent|resolved)\b",
+                               re.IGNORECASE)
+# Clause boundaries that end a negation scope. A comma starts a new phrase
+# ("no fracture, mild disc bulge") unless it continues a list of negated
+# items ("no bulge, protrusion, or herniation").
+_SEVERITY = r"(?:mild|moderate|severe|minimal|small|large|marked|trace)"
+_LIST_COMMA = rf"(?!\s*{_SEVERITY}\b)\s*(?:(?:or|nor)\b|(?:[a-z-]+\s+)?[a-z-]+\s*(?:,|\bor\b|\bnor\b))"
+_CLAUSE_BREAK_RE = re.compile(rf"[.;:|\n]|,(?!{_LIST_COMMA})|\bbut\b|\bhowever\b|\bwith\b"
+                              r"|\band\s+(?=[a-z]+\s+(?:at|in)\b)",
+                              re.IGNORECASE)
+_LEVEL_RE = re.compile(r"\b([CTL]\d{1,2})\s*[-/]\s*([CTLS]?\d{1,2})\b")
+_LEVEL_AFTER_RE = re.compile(r"\s*(?:(?:is|are|seen|present|noted)\s+)*(?:at|in|of|from)\s+(?:the\s+)?"
+                             r"(?:level\s+of\s+)?([CTL]\d{1,2})\s*[-/]\s*([CTLS]?\d{1,2})\b", re.IGNORECASE)
+_LEVEL_LABEL_RE = re.compile(r"[-|\s]*([CTL]\d{1,2})\s*[-/]\s*([CTLS]?\d{1,2})\s*:")
+_NEGATION_WINDOW = 60
+
+
+class ConditionHit(NamedTuple):
+    condition: str
+    text: str
+    start: int
+    end: int
+    negated: bool
+    level: Optional[str]
+
+
+def _clause_before(report: str, start: int) -> str:
+    # Breaks are matched against the whole report so a comma's lookahead sees past the window
+    window_start = max(0, start - _NEGATION_WINDOW)
+    clause_start = window_start
+    for match in _CLAUSE_BREAK_RE.finditer(report, window_start):
+        if match.end() > start:
+            break
+        clause_start = match.end()
+    return report[clause_start:start]
+
+
+def _clause_after(report: str, end: int) -> str:
+    window_end = end + _NEGATION_WINDOW
+    match = _CLAUSE_BREAK_RE.search(report, end)
+    return report[end:min(window_end, match.start()) if match else window_end]
+
+
+def _level_for(report: str, start: int, end: int) -> Optional[str]:
+    """
+    Spinal level a match refers to: a level right after it ("facet arthrosis
+    at L4-L5"), else the last level mentioned earlier in the same sentence,
+    else the label of the bullet/table row it sits in.
+    """
+    match = _LEVEL_AFTER_RE.match(_clause_after(report, end))
+    if match:
+        return f"{match.group(1)}-{match.group(2)}".upper()
+    block_start = max(report.rfind("\n- ", 0, start), report.rfind("\n|", 0, start),
+                      report.rfind("\n\n", 0, start)) + 1
+    sentence_start = max(block_start, report.rfind(". ", block_start, start) + 1)
+    levels = list(_LEVEL_RE.finditer(report, sentence_start, start))
+    match = levels[-1] if levels else _LEVEL_LABEL_RE.match(report, block_start)
+    if not match:
+        return None
+    return f"{match.group(1)}-{match.group(2)}".upper()
+
+
+def match_conditions(report: str) -> List[ConditionHit]:
+    """
+    Find every mention of a data.stats_data condition in a report.
+
+    Args:
+        report: Radiology report text
+
+    Returns:
+        Hits in report order, including negated mentions (negated=True)
+    """
+    hits = []
+    for condition, pattern in _COMPILED.items():
+        for match in pattern.finditer(report):
+            negated = bool(
+                _PRE_NEGATION_RE.search(_clause_before(report, match.start()))
+                or _POST_NEGATION_RE.match(_clause_after(report, match.end()))
+            )
+            hits.append(ConditionHit(condition, match.group(0), match.start(), match.end(),
+                                     negated, _level_for(report, match.start(), match.end())))
+    hits.sort(key=lambda hit: hit.start)
+    return hits
+
+
+def find_conditions(report: str) -> Dict[str, List[str]]:
+    """
+    Conditions affirmed by a report and the spinal levels they were seen at.
+
+    Returns:
+        {condition: [levels]} in data.stats_data order
+    """
+    found: Dict[str, List[str]] = {}
+    for hit in match_conditions(report):
+        if hit.negated:
+            continue
+        levels = found.setdefault(hit.condition, [])
+        if hit.level and hit.level not in levels:
+            levels.append(hit.level)
+    return {condition: found[condition] for condition in data.stats_data if condition in found}
+
+
+def prevalence_for_age(condition: str, age: int) -> str:
+    """Prevalence string (e.g. '37%') for a condition at the patient's age decade."""
+    import prevalence  # numpy is only loaded once prevalence is actually needed
+    return prevalence.percent(condition, age)
+
+
+def describe_conditions(report: str) -> str:
+    """Text equivalent of the stats_prompt answer: matched conditions or NO DIAGNOSIS."""
+    found = find_conditions(report)
+    if not found:
+        return "NO DIAGNOSIS"
+    return "\n".join(
+        f"- {condition}" + (f" ({', '.join(levels)})" if levels else "")
+        for condition, levels in found.items()
+    )
+
+
+def describe_age_statistics(report: str, age: Optional[int] = None) -> str:
+    """
+    Text equivalent of the stats_for_age_prompt answer.
+
+    Args:
+        report: Radiology report text
+        age: Patient age; extracted from the report header when omitted
+
+    Returns:
+        One line per matched condition with its prevalence for the patient's
+        age group, or an empty string if nothing matched
+    """
+    found = find_conditions(report)
+    if not found:
+        return ""
+    if age is None:
+        age = report_fields.patient_age(report)
+    if age is None:
+        return "\n".join(f"- {condition}: patient age unknown" for condition in found)
+    import prevalence
+    decade = prevalence.age_decade(age)
+    return "\n".join(
+        f"- {condition}: {prevalence_for_age(condition, age)} of asymptomatic people in their {decade}s"
+        for condition in found
+    )
+
+
+# Sentences whose negation scope or level was once misread, with the expected find_conditions()
+REGRESSION_CASES = [
+    ("No acute fracture, mild disc bulge at L4-L5.", {'Disk bulge': ['L4-L5']}),
+    ("No fracture or subluxation, moderate facet arthropathy.", {'Facet degeneration': []}),
+    ("Alignment is normal without spondylolisthesis, there is disc desiccation at L5-S1.",
+     {'Disk signal loss': ['L5-S1']}),
+    ("Facet arthrosis at L4-L5.", {'Facet degeneration': ['L4-L5']}),
+    ("Mild disc bulge at L4-L5 and facet arthrosis at L5-S1.",
+     {'Disk bulge': ['L4-L5'], 'Facet degeneration': ['L5-S1']}),
+    ("No disc bulge, protrusion, or herniation.", {}),
+    ("No stenosis, bulge or herniation at L3-L4.", {}),
+]
+
+
+if __name__ == "__main__":
+    import test_reports
+
+    for sentence, expected in REGRESSION_CASES:
+        found = find_conditions(sentence)
+        print(f"{'✅' if found == expected else '❌'} {sentence} -> {found}")
+    print()
+
+    for name in ("REPORT", "JAMES_REPORT"):
+        report = getattr(test_reports, name)
+        print(f"🔎 {name} (age {report_fields.patient_age(report)})")
+        print(describe_conditions(report))
+        print(describe_age_statistics(report))
+        print()
@@ -1,11 +1,5 @@
-import requests
-try:
-    from llama_parse import LlamaParse
-except ImportError:
-    import subprocess
-    subprocess.check_call(["pip", "install", "llama-parse"])
-    from llama_parse import LlamaParse
 import os
+import extraction_cache
 
 LLM_MODELS = {}
 
@@ -15,7 +9,17 @@ LLM_MODELS['llamaindex'] = {
 }
 
 
+def _llama_parse():
+    # Imported on first extraction: llama_parse is slow to import and only
+    # needed when a PDF is actually sent to LlamaParse
+    try:
+        from llama_parse import LlamaParse
+    except ImportError as e:
+        raise ImportError("llama-parse is required for PDF extraction: pip install llama-parse") from e
+    return LlamaParse
+
 def store_data(url, file_name):
+    import requests
     with open(file_name, 'wb') as out_file:
         content = requests.get(url, stream=True).content
         out_file.write(content)
@@ -26,22 +30,33 @@ def store_extracted_info(content, file_name):
         out_file.write(content)
 
 
-def sync_extract_report_from_pdf(data_file_name, output_format="markdown", options = {"model": "llamaindex"}):
+def sync_extract_report_from_pdf(data_file_name, output_format="markdown", options = {"model": "llamaindex"}, cache=True):
     """
         Extracting the report from pdf into a specified output format.
 
+        Results are cached in extraction_cache by the PDF's content hash, the
+        llama-parse version and output_format, so an unchanged PDF is not
+        sent to LlamaParse again.
+
         Args:
         data: Bytes of the data that are in the PDF.
         output_format: Data format of the output.
         options: Parameters that can be configurable for the extraction report.
+        cache: Set to False to force a new LlamaParse job.
     """
-    # Prefer environment variable LLAMA_CLOUD_API_KEY if available
-    api_key = LLM_MODELS.get(options.get('model', 'llamaindex'), {}).get('key') or os.getenv("LLAMA_CLOUD_API_KEY", "")
+    def compute():
+        # Prefer environment variable LLAMA_CLOUD_API_KEY if available
+        api_key = LLM_MODELS.get(options.get('model', 'llamaindex'), {}).get('key') or os.getenv("LLAMA_CLOUD_API_KEY", "")
 
-    parser = LlamaParse(
-        api_key=api_key,  # can also be set in your env as LLAMA_CLOUD_API_KEY
-        result_type=output_format  # "markdown" and "text" are available
-    )
+        parser = _llama_parse()(
+            api_key=api_key,  # can also be set in your env as LLAMA_CLOUD_API_KEY
+            result_type=output_format  # "markdown" and "text" are available
+        )
 
-    documents = parser.load_data(data_file_name)
-    return documents[0].text
+        documents = parser.load_data(data_file_name)
+        return documents[0].text
+
+    return extraction_cache.cached_extract(
+        data_file_name, 'llamaparse', extraction_cache.package_version('llama-parse'), output_format, compute,
+        params={'model': options.get('model', 'llamaindex')}, cache=cache
+    )
@@ -1,23 +1,57 @@
 #!/usr/bin/env python3
 """
 Extract text from PDF files and create a combined markdown file.
+
+Extraction runs in a process pool: every PDF is split into page ranges of
+PAGES_PER_TASK pages and all ranges of all files are extracted in parallel,
+so a single long guideline PDF uses every core as well as a directory of
+short reports.
 """
 
-import pdfplumber
-import PyPDF2
-from datetime import datetime
+import argparse
+import glob
+import io
 import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import extraction_cache
+
+# Pages extracted per pool task; small enough to balance a single large PDF
+# across workers, large enough that re-opening the PDF per task is amortized
+PAGES_PER_TASK = 8
+# Below this many characters the pdfplumber text is considered a failure
+MIN_TEXT_CHARS = 50
+# Date-prefixed report scans in the project root (excludes guideline PDFs)
+DEFAULT_SOURCE = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] *.pdf"
+
+# Bump when the extraction logic changes so cached results are refreshed
+EXTRACTOR_VERSION = 1
+
+_DATED_NAME_RE = re.compile(r"^(\d{4}-\d{2}-\d{2})\s+(.+)$")
+
+def _join_pages(page_texts):
+    """Join non-empty page texts the way the serial extractors did."""
+    return "\n\n".join(text for text in page_texts if text).strip()
+
+# pdfplumber and PyPDF2 are imported where they are used so the CLI and pool
+# workers only load the parser they actually run
+
+def _pdfplumber_pages(source, start=0, stop=None):
+    import pdfplumber
+    with pdfplumber.open(source) as pdf:
+        return [page.extract_text() or "" for page in pdf.pages[start:stop]]
+
+def _pypdf2_pages(source, start=0, stop=None):
+    import PyPDF2
+    reader = PyPDF2.PdfReader(source)
+    return [page.extract_text() or "" for page in reader.pages[start:stop]]
 
 def extract_with_pdfplumber(pdf_path):
     """Extract text using pdfplumber (better for complex layouts)."""
     try:
-        text = ""
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n\n"
-        return text.strip()
+        return _join_pages(_pdfplumber_pages(pdf_path))
     except Exception as e:
         print(f"pdfplumber failed for {pdf_path}: {e}")
         return None
@@ -25,89 +59,209 @@ def extract_with_pdfplumber(pdf_path):
 def extract_with_pypdf2(pdf_path):
     """Extract text using PyPDF2 (fallback method)."""
     try:
-        text = ""
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n\n"
-        return text.strip()
+        return _join_pages(_pypdf2_pages(pdf_path))
     except Exception as e:
         print(f"PyPDF2 failed for {pdf_path}: {e}")
         return None
 
-def extract_text_from_pdf(pdf_path):
-    """Try multiple extraction methods."""
-    print(f"📄 Extracting text from: {pdf_path}")
-    
-    # Try pdfplumber first (usually better)
-    text = extract_with_pdfplumber(pdf_path)
-    
-    # Fall back to PyPDF2 if pdfplumber fails
-    if not text or len(text.strip()) < 50:
-        print(f"  ⚠️  pdfplumber extraction insufficient, trying PyPDF2...")
-        text = extract_with_pypdf2(pdf_path)
-    
-    if text and len(text.strip()) >= 50:
-        print(f"  ✅ Extracted {len(text)} characters")
-        return text
-    else:
-        print(f"  ❌ Failed to extract meaningful text")
+def extract_page_range(pdf_path, start, stop):
+    """
+    Extract pages [start, stop) of a PDF; runs inside a pool worker.
+
+    The file is read once and both parsers work on the same in-memory copy.
+    PyPDF2 is only run for the range when pdfplumber found too little text
+    in it, so the fallback costs nothing for PDFs with a text layer.
+
+    Returns:
+        (pdfplumber page texts, PyPDF2 page texts or None)
+    """
+    with open(pdf_path, 'rb') as file:
+        data = file.read()
+
+    try:
+        primary = _pdfplumber_pages(io.BytesIO(data), start, stop)
+    except Exception as e:
+        print(f"pdfplumber failed for {pdf_path} pages {start + 1}-{stop}: {e}")
+        primary = []
+
+    fallback = None
+    if len(_join_pages(primary)) < MIN_TEXT_CHARS:
+        try:
+            fallback = _pypdf2_pages(io.BytesIO(data), start, stop)
+        except Exception as e:
+            print(f"PyPDF2 failed for {pdf_path} pages {start + 1}-{stop}: {e}")
+    return primary, fallback
+
+def page_count(pdf_path):
+    """Number of pages in a PDF, or None if it can't be read."""
+    import PyPDF2
+    try:
+        return len(PyPDF2.PdfReader(pdf_path).pages)
+    except Exception:
         return None
 
-def main():
+def page_ranges(pages, pages_per_task=PAGES_PER_TASK):
+    """Split a page count into [start, stop) ranges; one open range if unknown."""
+    if not pages:
+        return [(0, None)]
+    return [(start, min(start + pages_per_task, pages)) for start in range(0, pages, pages_per_task)]
+
+def _combine(pdf_path, parts):
+    """Assemble a document from its ranges, falling back to PyPDF2 as a whole."""
+    text = _join_pages(page for primary, _ in parts for page in primary)
+    if len(text) < MIN_TEXT_CHARS:
+        print(f"  ⚠️  pdfplumber extraction insufficient for {pdf_path}, using PyPDF2...")
+        # Every range is below the threshold here, so each carries its fallback text
+        text = _join_pages(page for _, fallback in parts for page in (fallback or []))
+
+    if len(text) >= MIN_TEXT_CHARS:
+        print(f"  ✅ {pdf_path}: extracted {len(text)} characters")
+        return text
+    print(f"  ❌ {pdf_path}: failed to extract meaningful text")
+    return None
+
+def extractor_version():
+    """Version string for extraction_cache keys: our logic plus the parser libraries."""
+    return f"{EXTRACTOR_VERSION};{extraction_cache.package_version('pdfplumber', 'PyPDF2')}"
+
+def extract_pdfs(pdf_paths, max_workers=None, pages_per_task=PAGES_PER_TASK, cache_dir=None):
+    """
+    Extract many PDFs in parallel across files and page ranges.
+
+    Args:
+        pdf_paths: PDF file paths
+        max_workers: Worker processes, defaults to the CPU count
+        pages_per_task: Pages per pool task
+        cache_dir: extraction_cache directory; PDFs whose contents were
+            extracted before are answered from it and only new or modified
+            ones are parsed. None disables the cache.
+
+    Returns:
+        Dict of path -> extracted text (None if extraction failed), in
+        input order
+    """
+    texts = dict.fromkeys(pdf_paths)
+    pending = {}
+    store = None
+    if cache_dir is not None and not extraction_cache.BYPASS:
+        store = extraction_cache.get_cache(cache_dir)
+        version = extractor_version()
+    for pdf_path in pdf_paths:
+        if store is not None:
+            content_hash = extraction_cache.file_sha256(pdf_path)
+            key = extraction_cache.cache_key(content_hash, 'pdfplumber', version, 'text')
+            texts[pdf_path] = store.get(key)
+            if texts[pdf_path] is not None:
+                print(f"♻️  Unchanged, using cached text: {pdf_path}")
+                continue
+            pending[pdf_path] = (key, content_hash)
+        else:
+            pending[pdf_path] = None
+    if not pending:
+        return texts
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for pdf_path in pending:
+            print(f"📄 Extracting text from: {pdf_path}")
+            futures[pdf_path] = [
+                pool.submit(extract_page_range, pdf_path, start, stop)
+                for start, stop in page_ranges(page_count(pdf_path), pages_per_task)
+            ]
+        for pdf_path, range_futures in futures.items():
+            texts[pdf_path] = _combine(pdf_path, [future.result() for future in range_futures])
+
+    if store is not None:
+        for pdf_path, (key, content_hash) in pending.items():
+            if texts[pdf_path] is not None:
+                store.put(key, texts[pdf_path], pdf_path, content_hash, 'pdfplumber', version, 'text')
+    return texts
+
+def extract_text_from_pdf(pdf_path, max_workers=None, cache_dir=None):
+    """Try multiple extraction methods, splitting the PDF's pages across processes."""
+    return extract_pdfs([pdf_path], max_workers=max_workers, cache_dir=cache_dir)[pdf_path]
+
+def find_pdfs(source):
+    """
+    Resolve a directory, glob pattern or single file into sorted PDF paths.
+    """
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(glob.escape(source), "*.pdf")))
+    if os.path.isfile(source):
+        return [source]
+    return sorted(path for path in glob.glob(source) if path.lower().endswith(".pdf"))
+
+def title_from_filename(pdf_path):
+    """'2021-06-20 MRI Lumbar Spine.pdf' -> 'MRI Lumbar Spine (2021-06-20)'."""
+    name = os.path.splitext(os.path.basename(pdf_path))[0]
+    match = _DATED_NAME_RE.match(name)
+    return f"{match.group(2)} ({match.group(1)})" if match else name
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extract PDF reports into a combined markdown file.")
+    parser.add_argument("source", nargs="?", default=DEFAULT_SOURCE,
+                        help="Directory, glob pattern or PDF file (default: date-prefixed PDFs in the current directory)")
+    parser.add_argument("--output", default="combined_reports.md", help="Combined markdown output file")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--pages-per-task", type=int, default=PAGES_PER_TASK,
+                        help="Pages extracted per worker task")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Re-extract every PDF instead of reusing cached text of unchanged files")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
     # PDF files to process
-    pdf_files = [
-        ("2021-06-20 Cashion Danny MRI Lumbar Spine.pdf", "Cashion Danny MRI Lumbar Spine (2021-06-20)"),
-        ("2025-09-11 XR Cx 2-3 View FlexExt.pdf", "XR Cx 2-3 View FlexExt (2025-09-11)"),
-        ("2025-09-20 CT Cx without Contrast.pdf", "CT Cx without Contrast (2025-09-20)")
-    ]
-    
-    # Create combined markdown file
-    markdown_content = f"""# Medical Reports Extraction
+    pdf_files = [(pdf_file, title_from_filename(pdf_file)) for pdf_file in find_pdfs(args.source)]
+    if not pdf_files:
+        print(f"⚠️  No PDF files found for: {args.source}")
+        return
+
+    cache_dir = None if args.no_cache else extraction_cache.cache_dir_for(args.output)
+    texts = extract_pdfs([pdf_file for pdf_file, _ in pdf_files], max_workers=args.workers,
+                         pages_per_task=args.pages_per_task, cache_dir=cache_dir)
+
+    # Create combined markdown file; sections are collected and joined once
+    sections = [f"""# Medical Reports Extraction
 
 Extracted on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 
-This document contains text extracted from 3 medical PDF reports for processing with the Medical AI Assistant.
+This document contains text extracted from {len(pdf_files)} medical PDF reports for processing with the Medical AI Assistant.
 
-"""
+"""]
 
     extracted_count = 0
     
     for pdf_file, title in pdf_files:
-        if not os.path.exists(pdf_file):
-            print(f"⚠️  File not found: {pdf_file}")
-            continue
-        
-        text = extract_text_from_pdf(pdf_file)
+        text = texts[pdf_file]
         
-        markdown_content += f"""## Report {extracted_count + 1}: {title}
+        sections.append(f"""## Report {extracted_count + 1}: {title}
 
-"""
+""")
         
         if text:
             # Clean up the text a bit
             cleaned_text = text.replace('\x00', '').replace('\x0c', '\n\n')  # Remove null chars and form feeds
-            markdown_content += f"""```
+            sections.append(f"""```
 {cleaned_text}
 ```
 
 ---
 
-"""
+""")
             extracted_count += 1
         else:
-            markdown_content += """*Could not extract text from this PDF. It may be an image-based PDF requiring OCR.*
+            sections.append("""*Could not extract text from this PDF. It may be an image-based PDF requiring OCR.*
 
 ---
 
-"""
+""")
     
     # Write to file
-    output_file = "combined_reports.md"
+    output_file = args.output
     with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(markdown_content)
+        f.write("".join(sections))
     
     print(f"\n{'='*60}")
     print(f"📝 EXTRACTION COMPLETE")
@@ -0,0 +1,181 @@
+"""
+Content-addressed cache of PDF extraction results.
+
+Extracting a PDF (a paid LlamaParse job, or a local pdfplumber pass over a
+long guideline document) is keyed on the SHA-256 of the PDF bytes plus the
+extractor's name, version and output format. Results are stored as plain
+files in a cache directory next to the extraction outputs, described by a
+manifest.json, so unchanged documents return instantly and only new or
+modified PDFs are parsed again.
+
+Set EXTRACTION_CACHE_BYPASS=1 (or pass cache=False) to force re-extraction.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+CACHE_DIRNAME = ".extraction_cache"
+MANIFEST_NAME = "manifest.json"
+BYPASS = os.getenv("EXTRACTION_CACHE_BYPASS", "") not in ("", "0", "false", "False")
+
+_HASH_BLOCK = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file's contents, read in 1 MiB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(_HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def package_version(*packages: str) -> str:
+    """Installed versions of packages, e.g. 'pdfplumber=0.11.4,PyPDF2=3.0.1'."""
+    from importlib import metadata  # Slow to import; only needed on a lookup
+    versions = []
+    for package in packages:
+        try:
+            versions.append(f"{package}={metadata.version(package)}")
+        except metadata.PackageNotFoundError:
+            versions.append(f"{package}=unknown")
+    return ",".join(versions)
+
+
+def cache_dir_for(output_path: str) -> str:
+    """Cache directory that sits next to an extraction output file."""
+    return os.path.join(os.path.dirname(os.path.abspath(output_path)), CACHE_DIRNAME)
+
+
+def cache_key(content_hash: str, extractor: str, version: str, output_format: str,
+              params: Optional[Dict[str, Any]] = None) -> str:
+    """Key of one extraction: document hash, extractor identity and output settings."""
+    material = json.dumps([content_hash, extractor, version, output_format, params or {}], sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """Directory of extracted documents plus a manifest describing each entry."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._manifest = self._load_manifest()
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _entry_path(self, key: str, output_format: str) -> str:
+        extension = "md" if output_format == "markdown" else "txt"
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached text for key, or None on a miss (or a manifest entry whose file is gone)."""
+        with self._lock:
+            entry = self._manifest.get(key)
+        if entry is None:
+            return None
+        try:
+            with open(os.path.join(self.directory, entry['file']), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, key: str, text: str, source: str, content_hash: str, extractor: str,
+            version: str, output_format: str) -> None:
+        """Store an extraction result and record it in the manifest."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._entry_path(key, output_format)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._manifest[key] = {
+                'source': source,
+                'sha256': content_hash,
+                'extractor': extractor,
+                'version': version,
+                'output_format': output_format,
+                'file': os.path.basename(path),
+                'chars': len(text),
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            }
+            self._save_manifest()
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return dict(self._manifest)
+
+
+_caches: Dict[str, ExtractionCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(directory: str) -> ExtractionCache:
+    """Return the shared ExtractionCache for a directory."""
+    directory = os.path.abspath(directory)
+    with _caches_lock:
+        if directory not in _caches:
+            _caches[directory] = ExtractionCache(directory)
+        return _caches[directory]
+
+
+def cached_extract(pdf_path: str, extractor: str, version: str, output_format: str,
+                   compute: Callable[[], Optional[str]], cache_dir: Optional[str] = None,
+                   params: Optional[Dict[str, Any]] = None, cache: bool = True) -> Optional[str]:
+    """
+    Return the cached extraction of a PDF or run compute and store its result.
+
+    Args:
+        pdf_path: PDF file whose contents are hashed
+        extractor: Extractor name, e.g. "llamaparse"
+        version: Extractor version string; a new version invalidates entries
+        output_format: Output format requested from the extractor
+        compute: Zero-argument callable performing the extraction
+        cache_dir: Cache directory, defaults to one next to the PDF
+        params: Other settings that change the output
+        cache: False (or EXTRACTION_CACHE_BYPASS) skips lookup and store
+
+    Returns:
+        Extracted text; a None result from compute is not cached
+    """
+    if not cache or BYPASS:
+        return compute()
+    store = get_cache(cache_dir or cache_dir_for(pdf_path))
+    content_hash = file_sha256(pdf_path)
+    key = cache_key(content_hash, extractor, version, output_format, params)
+    hit = store.get(key)
+    if hit is not None:
+        return hit
+    text = compute()
+    if text is not None:
+        store.put(key, text, pdf_path, content_hash, extractor, version, output_format)
+    return text
+
+
+if __name__ == "__main__":
+    import sys
+
+    store = get_cache(sys.argv[1] if len(sys.argv) > 1 else CACHE_DIRNAME)
+    entries = store.entries()
+    print(f"🗂️  {store.directory}: {len(entries)} cached extractions")
+    for entry in sorted(entries.values(), key=lambda e: e['source']):
+        print(f"  {entry['source']} [{entry['extractor']} {entry['output_format']}] "
+              f"{entry['chars']} chars, {entry['created_at']}")
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Ollama and OpenAI HTTP APIs, for offline benchmarks.
+
+Serves the endpoints the pipeline uses with a synthetic response whose
+timing is configurable: a fixed latency before the first token, then tokens
+at a fixed rate.
+
+- POST /api/generate, /api/chat (Ollama; NDJSON when "stream" is true, with
+  prompt_eval_count / eval_count / *_duration statistics)
+- GET  /api/tags, /api/ps (models loaded so far; the first request for a
+  model pays load_time, a request without a prompt only loads it)
+- POST /v1/chat/completions (OpenAI; server-sent events when "stream" is
+  true, usage block included)
+
+Requests with a JSON schema (Ollama "format", OpenAI "response_format") are
+answered with the smallest JSON value matching it. A token cap (Ollama
+options.num_predict, OpenAI max_completion_tokens / max_tokens) shortens the
+response, which then ends with finish reason "length".
+
+Point the backends at it with OLLAMA_BASE_URL=http://127.0.0.1:PORT and
+OPENAI_BASE_URL=http://127.0.0.1:PORT/v1 (any OPENAI_API_KEY).
+
+    python fake_llm_server.py --port 11434 --latency 0.2 --tokens-per-s 40
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional
+
+DEFAULT_LATENCY = 0.05  # Seconds before the first token
+DEFAULT_TOKENS_PER_S = 200.0
+DEFAULT_TOKENS = 40  # Tokens per response
+DEFAULT_JITTER = 0.1  # +/- fraction applied to latency and token rate
+
+_WORDS = ("the", "disc", "patient", "findings", "mild", "level", "care", "plan", "imaging", "report",
+          "degeneration", "common", "age", "follow-up", "symptoms", "treatment")
+
+
+class FakeLLMServer:
+    """Threaded fake Ollama/OpenAI server; use as a context manager or start()/stop()."""
+
+    def __init__(self, port: int = 0, host: str = "127.0.0.1", latency: float = DEFAULT_LATENCY,
+                 tokens_per_s: float = DEFAULT_TOKENS_PER_S, tokens: int = DEFAULT_TOKENS,
+                 jitter: float = DEFAULT_JITTER, seed: Optional[int] = None, parallel: Optional[int] = None,
+                 load_time: float = 0.0):
+        """
+        Args:
+            port: Port to listen on; 0 picks a free one
+            host: Interface to bind
+            latency: Seconds before the first token (model load + prompt eval)
+            tokens_per_s: Generation speed after the first token
+            tokens: Number of tokens in every response
+            jitter: Random +/- fraction applied to latency and token rate
+            seed: Seed for the jitter, for reproducible runs
+            parallel: Requests generated at once, like OLLAMA_NUM_PARALLEL;
+                others wait for a slot (None = unlimited)
+            load_time: Seconds the first Ollama request for a model spends loading it
+        """
+        self.latency = latency
+        self.tokens_per_s = tokens_per_s
+        self.tokens = tokens
+        self.jitter = jitter
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._slots = threading.Semaphore(parallel) if parallel else None
+        self.load_time = load_time
+        self.loaded: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeLLMServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _jittered(self, value: float) -> float:
+        with self._lock:
+            self.requests += 1
+            return value * (1 + self._random.uniform(-self.jitter, self.jitter))
+
+    def load(self, model: str) -> float:
+        """Load a model on first use; returns the seconds spent loading."""
+        with self._lock:
+            if model in self.loaded:
+                return 0.0
+            self.loaded[model] = {"name": model, "model": model, "size": 0, "size_vram": 0}
+        time.sleep(self.load_time)
+        return self.load_time
+
+    def response_tokens(self, cap: Optional[int]) -> int:
+        """Tokens in a response to a request capped at cap tokens (None = uncapped)."""
+        return self.tokens if cap is None else min(self.tokens, max(cap, 0))
+
+    def generate(self, tokens: Optional[int] = None) -> Iterator[str]:
+        """Yield response tokens (default: self.tokens) with the configured timing."""
+        tokens = self.tokens if tokens is None else tokens
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            time.sleep(self._jittered(self.latency))
+            interval = 1 / self._jittered(self.tokens_per_s)
+            for index in range(tokens):
+                if index:
+                    time.sleep(interval)
+                yield _WORDS[index % len(_WORDS)] + " "
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+
+def schema_instance(schema: Any) -> Any:
+    """Smallest value matching a JSON schema (null where allowed, empty arrays)."""
+    if not isinstance(schema, dict):
+        return {}
+    types = schema.get("type")
+    types = types if isinstance(types, list) else [types]
+    if "null" in types:
+        return None
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "object" in types:
+        return {key: schema_instance(value) for key, value in schema.get("properties", {}).items()}
+    if "array" in types:
+        return []
+    if "string" in types:
+        return ""
+    return 0
+
+
+def _ollama_stats(prompt_tokens: int, completion_tokens: int, started: float, first_token: float,
+                  load_s: float = 0.0) -> Dict[str, int]:
+    now = time.perf_counter()
+    return {
+        "prompt_eval_count": prompt_tokens,
+        "eval_count": completion_tokens,
+        "load_duration": int(load_s * 1e9),
+        "prompt_eval_duration": int((first_token - started) * 1e9),
+        "eval_duration": int((now - first_token) * 1e9),
+        "total_duration": int((now - started) * 1e9),
+    }
+
+
+def _make_handler(server: FakeLLMServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _read_json(self) -> Dict[str, Any]:
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def _send_json(self, body: Dict[str, Any]) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _start_chunked(self, content_type: str) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+        def _chunk(self, data: bytes) -> None:
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def _end_chunked(self) -> None:
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._send_json({"models": [{"name": "llama3.1:8b"}, {"name": "medgemma-assistant:latest"}]})
+            elif self.path == "/api/ps":
+                with server._lock:
+                    self._send_json({"models": list(server.loaded.values())})
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            request = self._read_json()
+            try:
+                if self.path in ("/api/generate", "/api/chat"):
+                    self._ollama(request, chat=self.path == "/api/chat")
+                elif self.path in ("/v1/chat/completions", "/chat/completions"):
+                    self._openai(request)
+                else:
+                    self.send_error(404)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True  # Client abandoned the response (e.g. a cancelled hedge)
+
+        def _ollama(self, request: Dict[str, Any], chat: bool) -> None:
+            prompt = " ".join(m.get("content", "") for m in request.get("messages", [])) if chat \
+                else request.get("prompt", "")
+            prompt_tokens = len(prompt.split())
+            model = request.get("model", "")
+            tokens = server.response_tokens((request.get("options") or {}).get("num_predict"))
+            done_reason = "length" if tokens < server.tokens else "stop"
+
+            def part(text: str, done: bool) -> Dict[str, Any]:
+                body = {"model": model, "done": done}
+                if chat:
+                    body["message"] = {"role": "assistant", "content": text}
+                else:
+                    body["response"] = text
+                return body
+
+            started = time.perf_counter()
+            first_token = None
+            load_s = server.load(model)
+            if not chat and "prompt" not in request:
+                body = part("", True)
+                body.update(done_reason="load", load_duration=int(load_s * 1e9))
+                self._send_json(body)
+            elif request.get("format"):
+                body = part(json.dumps(schema_instance(request["format"])), True)
+                body.update(_ollama_stats(prompt_tokens, 1, started, started, load_s))
+                self._send_json(body)
+            elif request.get("stream"):
+                self._start_chunked("application/x-ndjson")
+                for token in server.generate(tokens):
+                    first_token = first_token or time.perf_counter()
+                    self._chunk(json.dumps(part(token, False)).encode("utf-8") + b"\n")
+                final = part("", True)
+                final.update(_ollama_stats(prompt_tokens, tokens, started, first_token or started, load_s),
+                             done_reason=done_reason)
+                self._chunk(json.dumps(final).encode("utf-8") + b"\n")
+                self._end_chunked()
+            else:
+                generated: List[str] = []
+                for token in server.generate(tokens):
+                    first_token = first_token or time.perf_counter()
+                    generated.append(token)
+                body = part("".join(generated), True)
+                body.update(_ollama_stats(prompt_tokens, len(generated), started, first_token or started, load_s),
+                            done_reason=done_reason)
+                self._send_json(body)
+
+        def _openai(self, request: Dict[str, Any]) -> None:
+            prompt_tokens = sum(len(m.get("content", "").split()) for m in request.get("messages", []))
+            tokens = server.response_tokens(request.get("max_completion_tokens") or request.get("max_tokens"))
+            finish_reason = "length" if tokens < server.tokens else "stop"
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": tokens,
+                     "total_tokens": prompt_tokens + tokens}
+            base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": request.get("model", "")}
+
+            response_format = request.get("response_format") or {}
+            if response_format.get("type") == "json_schema":
+                text = json.dumps(schema_instance(response_format["json_schema"]["schema"]))
+                self._send_json(dict(base, object="chat.completion", usage=usage, choices=[
+                    {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}
+                ]))
+            elif request.get("stream"):
+                self._start_chunked("text/event-stream")
+                for token in server.generate(tokens):
+                    chunk = dict(base, object="chat.completion.chunk",
+                                 choices=[{"index": 0, "delta": {"content": token}, "finish_reason": None}])
+                    self._chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                final = dict(base, object="chat.completion.chunk",
+                             choices=[{"index": 0, "delta": {}, "finish_reason": finish_reason}])
+                self._chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+                if (request.get("stream_options") or {}).get("include_usage"):
+                    self._chunk(f"data: {json.dumps(dict(base, object='chat.completion.chunk', choices=[], usage=usage))}\n\n"
+                                .encode("utf-8"))
+                self._chunk(b"data: [DONE]\n\n")
+                self._end_chunked()
+            else:
+                text = "".join(server.generate(tokens))
+                self._send_json(dict(base, object="chat.completion", usage=usage, choices=[
+                    {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish_reason}
+                ]))
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Ollama/OpenAI server for offline benchmarks.")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-s", type=float, default=DEFAULT_TOKENS_PER_S)
+    parser.add_argument("--tokens", type=int, default=DEFAULT_TOKENS, help="Tokens per response")
+    parser.add_argument("--jitter", type=float, default=DEFAULT_JITTER)
+    parser.add_argument("--load-time", type=float, default=0.0, help="Seconds to load a model on first use")
+    parser.add_argument("--parallel", type=int, default=None, help="Requests generated at once (OLLAMA_NUM_PARALLEL)")
+    args = parser.parse_args()
+
+    fake = FakeLLMServer(args.port, args.host, args.latency, args.tokens_per_s, args.tokens, args.jitter,
+                         parallel=args.parallel, load_time=args.load_time)
+    print(f"🧪 Fake Ollama/OpenAI server on {fake.url} (OpenAI base URL {fake.url}/v1)")
+    try:
+        fake._httpd.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,318 @@
+"""
+Chunked BM25 retrieval over the guideline markdown corpora.
+
+Instead of pasting all of acp_guidelines.md / ajnr.md into every prompt, the
+documents are split into heading-aware chunks once, indexed with BM25 and
+persisted under INDEX_DIR. Each stage then asks for the passages most relevant
+to the report it is working on, capped by a token budget.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# Guideline corpora used by the pipeline stages
+CARE_PLAN_GUIDELINES = "acp_guidelines.md"
+DIAGNOSIS_GUIDELINES = "ajnr.md"
+
+# Retrieval configuration
+INDEX_DIR = ".guideline_index"
+INDEX_VERSION = 1
+CHUNK_CHARS = 1200
+CONTEXT_TOP_K = 6
+CONTEXT_TOKEN_BUDGET = 1500
+CHARS_PER_TOKEN = 4  # Rough estimate that holds for English prose
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_HEADING_RE = re.compile(r"^#+\s*(.*)$")
+_STOPWORDS = frozenset("""
+a an and are as at be been but by for from had has have in into is it its of on or
+that the their there these this to was were which with without no not than then
+patient patients report image series mm md dr date physician exam
+""".split())
+
+_INDEXES: Dict[str, "GuidelineIndex"] = {}
+_indexes_lock = threading.Lock()
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens with stopwords removed."""
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS and len(t) > 1]
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token count estimate used for context budgeting."""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def _split_oversized(block: str, chunk_chars: int) -> List[str]:
+    """Split a block that exceeds chunk_chars on line boundaries, then hard-cut."""
+    pieces, current = [], []
+    size = 0
+    for line in block.splitlines():
+        if size + len(line) > chunk_chars and current:
+            pieces.append("\n".join(current))
+            current, size = [], 0
+        while len(line) > chunk_chars:
+            pieces.append(line[:chunk_chars])
+            line = line[chunk_chars:]
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+
+def chunk_markdown(text: str, chunk_chars: int = CHUNK_CHARS) -> List[Dict[str, str]]:
+    """
+    Split a markdown document into roughly chunk_chars sized passages.
+
+    Paragraphs are packed together until the size limit is reached and every
+    chunk remembers the most recent heading so retrieved passages keep their
+    section context.
+
+    Args:
+        text: Markdown document text
+        chunk_chars: Target maximum chunk size in characters
+
+    Returns:
+        List of {'heading': str, 'text': str} dicts in document order
+    """
+    chunks = []
+    heading = ""
+    current: List[str] = []
+    size = 0
+
+    def flush():
+        nonlocal current, size
+        if current:
+            chunks.append({"heading": heading, "text": "\n\n".join(current)})
+        current, size = [], 0
+
+    for block in re.split(r"\n\s*\n", text):
+        block = block.strip()
+        if not block:
+            continue
+        heading_match = _HEADING_RE.match(block)
+        if heading_match and "\n" not in block:
+            flush()
+            heading = heading_match.group(1).strip()
+            continue
+        for piece in _split_oversized(block, chunk_chars):
+            if size + len(piece) > chunk_chars:
+                flush()
+            current.append(piece)
+            size += len(piece) + 2
+    flush()
+    return chunks
+
+
+def _file_sha256(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class GuidelineIndex:
+    """BM25 index over the chunks of a single guideline document."""
+
+    def __init__(self, source: str, source_sha: str, chunks: List[Dict[str, str]]):
+        self.source = source
+        self.source_sha = source_sha
+        self.chunks = chunks
+        self.term_freqs = [Counter(tokenize(c["heading"] + " " + c["text"])) for c in chunks]
+        self.lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        doc_freqs: Counter = Counter()
+        for tf in self.term_freqs:
+            doc_freqs.update(tf.keys())
+        n = len(chunks)
+        self.idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for term, df in doc_freqs.items()
+        }
+
+    @classmethod
+    def build(cls, source: str) -> "GuidelineIndex":
+        """Chunk and index a markdown file from disk."""
+        with open(source, "r", encoding="utf-8") as f:
+            text = f.read()
+        return cls(source, _file_sha256(source), chunk_markdown(text))
+
+    @classmethod
+    def load(cls, source: str, index_dir: str = INDEX_DIR) -> "GuidelineIndex":
+        """
+        Load the persisted index for source, rebuilding it if the file changed.
+
+        Args:
+            source: Path to the guideline markdown file
+            index_dir: Directory holding persisted indexes
+
+        Returns:
+            GuidelineIndex for the current contents of source
+        """
+        index_path = os.path.join(index_dir, os.path.basename(source) + ".json")
+        source_sha = _file_sha256(source)
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored.get("version") == INDEX_VERSION and stored.get("source_sha") == source_sha \
+                    and stored.get("chunk_chars") == CHUNK_CHARS:
+                return cls(source, source_sha, stored["chunks"])
+        except (OSError, ValueError, KeyError):
+            pass
+
+        index = cls.build(source)
+        index.save(index_path)
+        return index
+
+    def save(self, index_path: str) -> None:
+        """Persist the chunked document so later runs skip re-chunking."""
+        import tempfile
+        directory = os.path.dirname(index_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # Unique temp file per writer: other processes may be saving the same index
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, suffix=".tmp",
+                                         prefix=os.path.basename(index_path) + ".", delete=False) as f:
+            tmp_path = f.name
+            try:
+                json.dump({
+                    "version": INDEX_VERSION,
+                    "source": self.source,
+                    "source_sha": self.source_sha,
+                    "chunk_chars": CHUNK_CHARS,
+                    "chunks": self.chunks,
+                }, f)
+            except BaseException:
+                f.close()
+                os.unlink(tmp_path)
+                raise
+        os.replace(tmp_path, index_path)
+
+    def search(self, query: str, top_k: int = CONTEXT_TOP_K) -> List[Tuple[float, int]]:
+        """
+        Score chunks against a query with BM25.
+
+        Args:
+            query: Free text query (usually the report findings)
+            top_k: Maximum number of hits to return
+
+        Returns:
+            List of (score, chunk_id) pairs, best first
+        """
+        query_terms = set(tokenize(query))
+        scores = []
+        for chunk_id, tf in enumerate(self.term_freqs):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[chunk_id] / (self.avg_length or 1))
+            score = 0.0
+            for term in query_terms:
+                freq = tf.get(term)
+                if freq:
+                    score += self.idf[term] * freq * (BM25_K1 + 1) / (freq + norm)
+            if score > 0:
+                scores.append((score, chunk_id))
+        scores.sort(reverse=True)
+        return scores[:top_k]
+
+    def context_for(self, query: str, top_k: int = CONTEXT_TOP_K,
+                    token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+        """
+        Build a prompt context from the best matching chunks.
+
+        Chunks are taken best-first until the token budget is spent and are then
+        emitted in document order so the passages read naturally.
+
+        Args:
+            query: Free text query (usually the report findings)
+            top_k: Maximum number of passages to include
+            token_budget: Maximum estimated tokens of context
+
+        Returns:
+            Context text for the prompt
+        """
+        selected = []
+        spent = 0
+        for _, chunk_id in self.search(query, top_k):
+            cost = estimate_tokens(self._render(chunk_id))
+            if spent + cost > token_budget:
+                continue
+            selected.append(chunk_id)
+            spent += cost
+        return "\n\n".join(self._render(chunk_id) for chunk_id in sorted(selected))
+
+    def _render(self, chunk_id: int) -> str:
+        chunk = self.chunks[chunk_id]
+        if chunk["heading"]:
+            return f"## {chunk['heading']}\n{chunk['text']}"
+        return chunk["text"]
+
+
+def get_index(source: str) -> GuidelineIndex:
+    """Return the process-wide index for a guideline file, loading it once (thread-safe)."""
+    key = os.path.abspath(source)
+    index = _INDEXES.get(key)
+    if index is None:
+        with _indexes_lock:
+            index = _INDEXES.get(key)
+            if index is None:
+                index = _INDEXES[key] = GuidelineIndex.load(source)
+    return index
+
+
+def retrieval_settings() -> Dict[str, float]:
+    """Settings that change which passages retrieve_context returns (e.g. for cache fingerprints)."""
+    return {
+        "index_version": INDEX_VERSION,
+        "chunk_chars": CHUNK_CHARS,
+        "top_k": CONTEXT_TOP_K,
+        "token_budget": CONTEXT_TOKEN_BUDGET,
+        "chars_per_token": CHARS_PER_TOKEN,
+        "bm25_k1": BM25_K1,
+        "bm25_b": BM25_B,
+    }
+
+
+def report_query(report: str) -> str:
+    """Use the findings/impression part of a report as the retrieval query."""
+    match = re.search(r"\bFINDINGS\b", report, flags=re.IGNORECASE)
+    return report[match.start():] if match else report
+
+
+def retrieve_context(source: str, report: str, top_k: Optional[int] = None,
+                     token_budget: Optional[int] = None) -> str:
+    """
+    Retrieve the guideline passages most relevant to a report.
+
+    Args:
+        source: Path to the guideline markdown file
+        report: Radiology report (or other text) to retrieve for
+        top_k: Maximum passages, defaults to CONTEXT_TOP_K
+        token_budget: Maximum estimated context tokens, defaults to CONTEXT_TOKEN_BUDGET
+
+    Returns:
+        Context text to substitute into the prompt
+    """
+    return get_index(source).context_for(
+        report_query(report),
+        top_k=CONTEXT_TOP_K if top_k is None else top_k,
+        token_budget=CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget,
+    )
+
+
+if __name__ == "__main__":
+    import test_reports
+
+    for source in (CARE_PLAN_GUIDELINES, DIAGNOSIS_GUIDELINES):
+        context = retrieve_context(source, test_reports.JAMES_REPORT)
+        print(f"📚 {source}: {len(get_index(source).chunks)} chunks, "
+              f"~{estimate_tokens(context)} context tokens")
+        print(context[:500] + "...")
+        print()
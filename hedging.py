@@ -0,0 +1,302 @@
+"""
+Hedged requests with latency-based failover between two backends.
+
+HedgedBackend sends a prompt to a primary backend (Ollama by default). If
+the primary has not started answering within a deadline, the same prompt is
+also sent to a secondary backend (OpenAI by default); the first to answer
+wins and the other is cancelled. A primary that fails is failed over to the
+secondary immediately.
+
+The deadline is a percentile (HEDGE_PERCENTILE) of the primary's recent
+latencies, clamped to [HEDGE_MIN_DELAY, HEDGE_MAX_DELAY]; until enough
+samples exist HEDGE_DEFAULT_DELAY is used. Blocking calls race on time to
+first token (attempts are streamed internally, so a loser is cancelled at
+its next chunk and its stream closed, releasing its backend slot);
+awaitable calls race on the full response and the losing task is
+cancelled. A blocking call commits to the attempt that streamed first: if
+that attempt fails later, its error is raised without falling back, since
+the other attempt was already cancelled and part of the answer may
+already have reached on_token.
+
+Every routing decision is recorded as a 'route' tracing span (outcome,
+winner, hedge delay, primary latency) and counted in
+llm_route_decisions_total. Route a stage to it with backend 'hedged':
+
+    HEDGE_PRIMARY=ollama HEDGE_SECONDARY=openai python process_extracted_reports.py --backend hedged
+"""
+
+import collections
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Optional
+
+import backends
+import tracing
+
+HEDGE_PRIMARY = os.getenv("HEDGE_PRIMARY", "ollama")
+HEDGE_SECONDARY = os.getenv("HEDGE_SECONDARY", "openai")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_DEFAULT_DELAY = 10.0  # Seconds, until HEDGE_MIN_SAMPLES latencies were seen
+HEDGE_MIN_DELAY = 0.5
+HEDGE_MAX_DELAY = 60.0
+HEDGE_MIN_SAMPLES = 10
+HEDGE_WINDOW = 200  # Recent latencies the percentile is computed over
+HEDGE_THREADS = 32  # Threads running attempts of blocking calls
+
+
+class Cancelled(Exception):
+    """Raised inside the losing attempt of a race to abort it."""
+
+
+class LatencyTracker:
+    """Sliding window of recent latencies and the hedge deadline derived from them."""
+
+    def __init__(self, percentile: float = HEDGE_PERCENTILE, window: int = HEDGE_WINDOW):
+        self.percentile = percentile
+        self._samples: Deque[float] = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def delay(self) -> float:
+        """Seconds to wait for the primary before sending the hedge."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        rank = max(1, -(-len(samples) * self.percentile // 100))
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, samples[int(rank) - 1]))
+
+
+class _Race:
+    """State shared by the attempts of one blocking hedged call."""
+
+    def __init__(self, on_token: Optional[Callable[[str], None]]):
+        self.on_token = on_token
+        self.cond = threading.Condition()
+        self.winner: Optional[int] = None
+        self.first_chunk_at: Dict[int, float] = {}
+        self.finished: Dict[int, Optional[BaseException]] = {}
+
+    def chunk_callback(self, index: int) -> Callable[[str], None]:
+        def on_chunk(chunk: str) -> None:
+            with self.cond:
+                self.first_chunk_at.setdefault(index, time.perf_counter())
+                if self.winner is None:
+                    self.winner = index
+                    self.cond.notify_all()
+                won = self.winner == index
+            if not won:
+                raise Cancelled()
+            if self.on_token is not None:
+                self.on_token(chunk)
+        return on_chunk
+
+    def done(self, index: int, error: Optional[BaseException]) -> None:
+        with self.cond:
+            self.finished[index] = error
+            if error is None and self.winner is None:
+                # Answered without streaming a chunk (e.g. an empty response)
+                self.winner = index
+            self.cond.notify_all()
+
+
+class HedgedBackend(backends.Backend):
+    """Primary backend with a hedged/failover secondary; see the module docstring."""
+
+    name = 'hedged'
+
+    def __init__(self, primary: str = HEDGE_PRIMARY, secondary: str = HEDGE_SECONDARY,
+                 percentile: float = HEDGE_PERCENTILE):
+        """
+        Args:
+            primary: Backend tried first; the route's model applies to it
+            secondary: Backend hedged to, with its default model
+            percentile: Percentile of the primary's latencies used as the hedge deadline
+        """
+        self.primary = primary
+        self.secondary = secondary
+        self.trackers = {'ttft': LatencyTracker(percentile), 'total': LatencyTracker(percentile)}
+        self.outcomes: Dict[str, int] = collections.Counter()
+        self._executor = ThreadPoolExecutor(max_workers=HEDGE_THREADS, thread_name_prefix='hedge')
+
+    @property
+    def default_model(self):
+        return backends.get_backend(self.primary).default_model
+
+    @property
+    def generation_settings(self):
+        # Each attempt applies the settings its own backend supports
+        settings = (backends.get_backend(self.primary).generation_settings
+                    + backends.get_backend(self.secondary).generation_settings)
+        return tuple(dict.fromkeys(settings))
+
+    def warm(self, model=None):
+        summaries = [backends.get_backend(name).warm(attempt_model)
+                     for name, attempt_model in self._attempt_models(model)]
+        return "; ".join(filter(None, summaries)) or None
+
+    def _attempt_models(self, model):
+        return ((self.primary, model), (self.secondary, None))
+
+    def _record(self, route, outcome: str, winner: Optional[int], delay: float, started: float) -> None:
+        self.outcomes[outcome] += 1
+        route.set(outcome=outcome, hedge_delay_s=delay,
+                  winner=None if winner is None else (self.primary, self.secondary)[winner],
+                  winner_latency_s=time.perf_counter() - started)
+
+    def complete(self, prompt, model=None, timeout=None, on_token=None, cache=True, profile=None):
+        race = _Race(on_token)
+        tracker = self.trackers['ttft']
+        delay = tracker.delay()
+        attempts = self._attempt_models(model)
+        futures = {}
+
+        def launch(index):
+            backend_name, attempt_model = attempts[index]
+            selected = backends.get_backend(backend_name)
+
+            def run():
+                try:
+                    text = selected.complete(prompt, model=attempt_model, timeout=timeout,
+                                             on_token=race.chunk_callback(index), cache=cache, profile=profile)
+                except Cancelled:
+                    # Lost the race. Keep no traceback: it would tie this attempt's
+                    # frames (and its open stream) to the race in a reference cycle
+                    race.done(index, Cancelled())
+                    return None
+                except BaseException as e:
+                    race.done(index, e)
+                    raise
+                race.done(index, None)
+                return text
+
+            # Run with the caller's context so backend spans nest under the route span
+            futures[index] = self._executor.submit(contextvars.copy_context().run, run)
+
+        with tracing.span('hedged', kind='route', primary=self.primary, secondary=self.secondary) as route:
+            started = time.perf_counter()
+            launch(0)
+            outcome = 'primary'
+            with race.cond:
+                while race.winner is None:
+                    if len(race.finished) == len(futures) and all(race.finished.values()):
+                        if len(futures) == 2:
+                            break  # Both failed
+                        outcome = 'failover'
+                        race.cond.release()
+                        try:
+                            launch(1)
+                        finally:
+                            race.cond.acquire()
+                        continue
+                    wait = None
+                    if len(futures) == 1:
+                        wait = started + delay - time.perf_counter()
+                        if wait <= 0:
+                            outcome = 'hedged'
+                            race.cond.release()
+                            try:
+                                launch(1)
+                            finally:
+                                race.cond.acquire()
+                            continue
+                    race.cond.wait(wait)
+                winner = race.winner
+                primary_ttft = race.first_chunk_at.get(0)
+
+            if not isinstance(race.finished.get(0), Exception) or isinstance(race.finished[0], Cancelled):
+                # Censored sample when the primary lost before its first chunk
+                tracker.observe((primary_ttft or time.perf_counter()) - started)
+            if winner is None:
+                self._record(route, 'failed', None, delay, started)
+                raise race.finished[0]
+            if outcome == 'hedged':
+                outcome = 'hedge_won' if winner == 1 else 'primary_won'
+            try:
+                text = futures[winner].result()
+            finally:
+                self._record(route, outcome, winner, delay, started)
+            route.set(primary_ttft_s=None if primary_ttft is None else primary_ttft - started)
+            return text
+
+    async def acomplete(self, prompt, model=None, timeout=None, cache=True, profile=None):
+        import asyncio
+
+        tracker = self.trackers['total']
+        delay = tracker.delay()
+        attempts = self._attempt_models(model)
+
+        def launch(index):
+            backend_name, attempt_model = attempts[index]
+            selected = backends.get_backend(backend_name)
+            return asyncio.ensure_future(selected.acomplete(prompt, model=attempt_model, timeout=timeout, cache=cache,
+                                                        profile=profile))
+
+        with tracing.span('hedged', kind='route', primary=self.primary, secondary=self.secondary) as route:
+            started = time.perf_counter()
+            tasks = {launch(0): 0}
+            outcome = 'primary'
+            errors = {}
+            winner = None
+            try:
+                while winner is None:
+                    hedge_pending = len(tasks) + len(errors) == 1
+                    wait = started + delay - time.perf_counter() if hedge_pending else None
+                    if hedge_pending and wait <= 0:
+                        outcome = 'hedged'
+                        tasks[launch(1)] = 1
+                        continue
+                    if not tasks:
+                        break  # Both failed
+                    done, _ = await asyncio.wait(tasks, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        index = tasks.pop(task)
+                        if task.exception() is None:
+                            if index == 0:
+                                tracker.observe(time.perf_counter() - started)
+                            winner = index
+                            text = task.result()
+                            break
+                        errors[index] = task.exception()
+                    if winner is None and errors and not tasks and len(errors) == 1:
+                        outcome = 'failover'
+                        tasks[launch(1)] = 1
+            finally:
+                for task, index in tasks.items():
+                    task.cancel()
+                    if index == 0:
+                        # Censored sample: the primary took at least this long
+                        tracker.observe(time.perf_counter() - started)
+
+            if winner is None:
+                self._record(route, 'failed', None, delay, started)
+                raise errors[0]
+            if outcome == 'hedged':
+                outcome = 'hedge_won' if winner == 1 else 'primary_won'
+            self._record(route, outcome, winner, delay, started)
+            return text
+
+
+if __name__ == "__main__":
+    # Hedge wins against a slow Ollama primary must leave none of its slots held
+    import backend_limits
+    from fake_llm_server import FakeLLMServer
+
+    with FakeLLMServer(latency=2.0, tokens=5) as slow, FakeLLMServer(latency=0.05, tokens=5) as fast:
+        os.environ.update(OLLAMA_BASE_URL=slow.url, OPENAI_BASE_URL=f"{fast.url}/v1",
+                          OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "fake"))
+        HEDGE_DEFAULT_DELAY = 0.3
+        backend_limits.set_adaptive('ollama')
+        hedged = HedgedBackend('ollama', 'openai')
+        for index in range(backend_limits.current_limit('ollama') + 1):
+            hedged.complete(f"Hedge check {index}", cache=False, timeout=30)
+        time.sleep(2.5)  # Until the losers' first chunks arrive and cancel them
+        in_flight = backend_limits.in_flight('ollama')
+        print(f"{'✅' if in_flight == 0 else '❌'} outcomes {dict(hedged.outcomes)}, "
+              f"ollama requests still in flight: {in_flight}")
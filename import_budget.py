@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Check that the CLI entry points import within their startup budget.
+
+Each module is imported in a fresh interpreter with `python -X importtime`
+and its cumulative import time is compared against IMPORT_BUDGET_MS. Backend
+clients and heavy libraries (openai, httpx, requests, llama_parse,
+pdfplumber, PyPDF2, numpy) must stay lazy for these budgets to hold; the
+report lists any of them that were imported anyway.
+
+    python import_budget.py            # check all entry points
+    python import_budget.py main -n 5  # best of 5 runs for one module
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Cumulative import time budget per entry point, in milliseconds
+IMPORT_BUDGET_MS = {
+    'main': 100,
+    'main_ollama': 100,
+    'process_extracted_reports': 100,
+}
+# Libraries that must only be loaded on first use
+HEAVY_MODULES = ('openai', 'httpx', 'requests', 'llama_parse', 'pdfplumber', 'PyPDF2', 'numpy', 'asyncio')
+
+_IMPORTTIME_RE = re.compile(r"^import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)$")
+
+
+def measure(module: str) -> Tuple[float, List[str]]:
+    """
+    Import a module in a fresh interpreter.
+
+    Returns:
+        (cumulative import time in ms, heavy modules that were imported)
+    """
+    env = dict(os.environ)
+    # Entry points must import without credentials
+    env.pop("OPENAI_API_KEY", None)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    total_us = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        name = match.group(3)
+        imported.add(name)
+        if name == module and not match.group(2):
+            total_us = int(match.group(1))
+    if total_us is None:
+        raise RuntimeError(f"no import time reported for {module}")
+    return total_us / 1000, [name for name in HEAVY_MODULES if name in imported]
+
+
+def check(modules: Dict[str, float], runs: int = 3) -> bool:
+    """Print the best-of-runs import time per module; True if all are within budget."""
+    ok = True
+    for module, budget in modules.items():
+        samples = [measure(module) for _ in range(runs)]
+        best = min(ms for ms, _ in samples)
+        heavy = sorted({name for _, names in samples for name in names})
+        within = best <= budget and not heavy
+        ok = ok and within
+        status = "✅" if within else "❌"
+        print(f"{status} {module}: {best:.1f} ms (budget {budget:.0f} ms)")
+        if heavy:
+            print(f"   eagerly imported: {', '.join(heavy)}")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check entry point import times against their budget.")
+    parser.add_argument("modules", nargs="*", help="Modules to check (default: all budgeted entry points)")
+    parser.add_argument("-n", "--runs", type=int, default=3, help="Runs per module; the fastest is reported")
+    args = parser.parse_args(argv)
+
+    modules = {name: IMPORT_BUDGET_MS.get(name, max(IMPORT_BUDGET_MS.values())) for name in args.modules} \
+        if args.modules else IMPORT_BUDGET_MS
+    return 0 if check(modules, args.runs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""
+Persistent, content-addressed cache of LLM responses.
+
+Responses are stored in SQLite keyed by a SHA-256 of the backend, model,
+rendered prompt and sampling options, so re-running the pipeline over the same
+reports (or comparing backends with test_both_models) doesn't pay model
+latency twice. Entries expire after TTL_SECONDS and the least recently used
+ones are evicted once the cache grows past MAX_BYTES.
+
+Set LLM_CACHE_BYPASS=1 (or pass cache=False to the call functions) for runs
+that need fresh, non-deterministic samples.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional
+
+import tracing
+
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite3")
+MAX_BYTES = 256 * 1024 * 1024
+TTL_SECONDS = 30 * 24 * 3600
+EVICT_EVERY = 50  # Run eviction after this many writes
+BYPASS = os.getenv("LLM_CACHE_BYPASS", "") not in ("", "0", "false", "False")
+
+
+class CachedMessage:
+    __slots__ = ('content',)
+
+    def __init__(self, content: str):
+        self.content = content
+
+
+class CachedChoice:
+    __slots__ = ('message',)
+
+    def __init__(self, content: str):
+        self.message = CachedMessage(content)
+
+
+class CachedCompletion:
+    """
+    Response text in the shape of an OpenAI chat completion
+    (response.choices[0].message.content), shared by all backends.
+    """
+
+    __slots__ = ('choices',)
+
+    def __init__(self, content: str):
+        self.choices = [CachedChoice(content)]
+
+
+def cache_key(backend: str, model: str, prompt: str, options: Optional[Dict[str, Any]] = None) -> str:
+    """Content address of a request: SHA-256 over backend, model, prompt and options."""
+    material = json.dumps([backend, model, prompt, options or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed response store with TTL and size-bounded LRU eviction."""
+
+    def __init__(self, path: str = CACHE_PATH, max_bytes: int = MAX_BYTES, ttl_seconds: float = TTL_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                backend TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+        self.evict()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None on a miss or expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, backend: str, model: str, response: str) -> None:
+        """Store a response, evicting old entries periodically."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, backend, model, response, len(response.encode("utf-8")), now, now),
+            )
+            self._writes += 1
+            due = self._writes % EVICT_EVERY == 0
+        if due:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Drop expired entries, then least recently used ones until the cache
+        fits in max_bytes.
+
+        Returns:
+            Number of entries removed
+        """
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                freed = 0
+                stale = []
+                for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+                    stale.append((key,))
+                    freed += size
+                    if freed >= excess:
+                        break
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+                removed += len(stale)
+            return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters for this process plus current entry count and size."""
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ResponseCache:
+    """Return the process-wide cache, opening it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(CACHE_PATH, MAX_BYTES, TTL_SECONDS)
+        return _cache
+
+
+def _lookup(call, backend: str, model: str, prompt: str, options: Optional[Dict[str, Any]], cache: bool):
+    """Return (store, key, hit) for a request and mark the call span's cache status."""
+    if not cache or BYPASS:
+        call.set(cache='bypass')
+        return None, None, None
+    store = get_cache()
+    key = cache_key(backend, model, prompt, options)
+    hit = store.get(key)
+    call.set(cache='miss' if hit is None else 'hit')
+    return store, key, hit
+
+
+def cached_text(backend: str, model: str, prompt: str, options: Optional[Dict[str, Any]],
+                compute: Callable[[], str], cache: bool = True) -> str:
+    """
+    Return the cached response for a request or compute and store it.
+
+    The call is recorded as a tracing span with its cache status; compute
+    runs inside it so the backend can attach token usage.
+
+    Args:
+        backend: Backend name, part of the cache key
+        model: Model name, part of the cache key
+        prompt: Fully rendered prompt
+        options: Sampling options that influence the output
+        compute: Zero-argument callable performing the real model call
+        cache: False (or LLM_CACHE_BYPASS) skips both lookup and store
+
+    Returns:
+        Response text
+    """
+    with tracing.span(backend, kind='llm', backend=backend, model=model) as call:
+        store, key, hit = _lookup(call, backend, model, prompt, options, cache)
+        if hit is not None:
+            return hit
+        text = compute()
+        if store is not None:
+            store.put(key, backend, model, text)
+        return text
+
+
+async def acached_text(backend: str, model: str, prompt: str, options: Optional[Dict[str, Any]],
+                       compute, cache: bool = True) -> str:
+    """Async counterpart of cached_text; compute is a zero-argument coroutine function."""
+    with tracing.span(backend, kind='llm', backend=backend, model=model) as call:
+        store, key, hit = _lookup(call, backend, model, prompt, options, cache)
+        if hit is not None:
+            return hit
+        text = await compute()
+        if store is not None:
+            store.put(key, backend, model, text)
+        return text
+
+
+def cached_stream(backend: str, model: str, prompt: str, options: Optional[Dict[str, Any]],
+                  compute_stream: Callable[[], Iterator[str]], cache: bool = True) -> Iterator[str]:
+    """
+    Streaming counterpart of cached_text.
+
+    A hit is yielded as a single chunk; on a miss the chunks are passed
+    through as they arrive and the joined text is stored once the stream
+    completes (an abandoned stream is not cached).
+    """
+    with tracing.span(backend, kind='llm', backend=backend, model=model, stream=True) as call:
+        store, key, hit = _lookup(call, backend, model, prompt, options, cache)
+        if hit is not None:
+            yield hit
+            return
+        parts = []
+        for chunk in compute_stream():
+            if not parts:
+                call.set(ttft_s=call.elapsed())
+            parts.append(chunk)
+            yield chunk
+        if store is not None:
+            store.put(key, backend, model, "".join(parts))
+
+
+async def acached_stream(backend: str, model: str, prompt: str, options: Optional[Dict[str, Any]],
+                         compute_stream, cache: bool = True) -> AsyncIterator[str]:
+    """Async counterpart of cached_stream; compute_stream returns an async iterator."""
+    with tracing.span(backend, kind='llm', backend=backend, model=model, stream=True) as call:
+        store, key, hit = _lookup(call, backend, model, prompt, options, cache)
+        if hit is not None:
+            yield hit
+            return
+        parts = []
+        async for chunk in compute_stream():
+            if not parts:
+                call.set(ttft_s=call.elapsed())
+            parts.append(chunk)
+            yield chunk
+        if store is not None:
+            store.put(key, backend, model, "".join(parts))
+
+
+if __name__ == "__main__":
+    import sys
+
+    store = get_cache()
+    if "--clear" in sys.argv[1:]:
+        store.clear()
+        print(f"🧹 Cleared {store.path}")
+    else:
+        removed = store.evict()
+        stats = store.stats()
+        print(f"🗄️  {store.path}: {stats['entries']} entries, {stats['bytes'] / 1024:.1f} KiB "
+              f"(evicted {removed})")
@@ -1,9 +1,11 @@
 import extract_pdf
-import models
+import backends
 import diagnose_prompt
 import care_plan_prompt
 import test_reports
 import stats_finder
+import guideline_index
+import streaming
 
 PROVIDER_ASSISTANT_PROMPT = """
 Use the following information to help a provider write a portal message to a patient that helps them understand a recent radiology report and what options are available for care.
@@ -19,22 +21,23 @@ Instructions:
 - The goal of this message is to alleviate concerns, explain findings and set up the discussion in the follow-up visit so that the provider and patient can use shared decision to determine the next steps in treatment.
 """
 
-def provider_assist(care_plan, diagnosis):
-    return models.call_openai(PROVIDER_ASSISTANT_PROMPT.format(diagnosis=diagnosis, care_plan=care_plan)).choices[0].message.content
+# Every stage of this script runs on OpenAI, whatever pipeline_config routes
+BACKEND = 'openai'
 
+def provider_assist(care_plan, diagnosis, on_token=None):
+    return backends.complete_stage('provider_message', PROVIDER_ASSISTANT_PROMPT.format(diagnosis=diagnosis, care_plan=care_plan), on_token=on_token, backend=BACKEND)
 
-def care_plan(report=test_reports.JAMES_REPORT):
-    with open('acp_guidelines.md', 'r') as out_file:
-        context = out_file.read()
-    return models.call_openai(care_plan_prompt.CARE_PLAN_PROMPT.format(context=context, report=report)).choices[0].message.content
 
-def summary_diagnosis(report=test_reports.JAMES_REPORT):
-    with open('ajnr.md', 'r') as out_file:
-        context = out_file.read()
-    return models.call_openai(diagnose_prompt.DIAGNOSE_PROMPT.format(context=context, report=report)).choices[0].message.content
+def care_plan(report=test_reports.JAMES_REPORT, on_token=None):
+    context = guideline_index.retrieve_context(guideline_index.CARE_PLAN_GUIDELINES, report)
+    return backends.complete_stage('care_plan', care_plan_prompt.CARE_PLAN_PROMPT.format(context=context, report=report), on_token=on_token, backend=BACKEND)
+
+def summary_diagnosis(report=test_reports.JAMES_REPORT, on_token=None):
+    context = guideline_index.retrieve_context(guideline_index.DIAGNOSIS_GUIDELINES, report)
+    return backends.complete_stage('diagnosis', diagnose_prompt.DIAGNOSE_PROMPT.format(context=context, report=report), on_token=on_token, backend=BACKEND)
 
 def summary_age(report=test_reports.JAMES_REPORT):
-    return stats_finder.stat_finder(report=report)
+    return stats_finder.stat_finder(report=report, backend=BACKEND)
 
 def fetch_patient_age():
     return 65
@@ -44,15 +47,23 @@ def summary(diagnosis_summary, stats_diagnosis_age):
 
 def main(): 
     print("hey there")
-    care = care_plan()
-    diagnosis = summary_diagnosis()
-    response = provider_assist(care, diagnosis)
-    print("CARE*******\n\n\n\n\n")
-    print(care)
-    print("DIAGNOSIS*******\n\n\n\n\n")
-    print(diagnosis)
-    print("PROVIDER_ASSISTANT_RESPONSE*******\n\n\n\n\n")
-    print(response)
+    # Each section is printed token by token as it is generated
+    printer = streaming.StreamPrinter({
+        'care': "CARE*******\n\n\n\n",
+        'diagnosis': "DIAGNOSIS*******\n\n\n\n",
+        'provider': "PROVIDER_ASSISTANT_RESPONSE*******\n\n\n\n",
+    })
+    timers = {}
+    stages = (
+        ('care', lambda on_token: care_plan(on_token=on_token)),
+        ('diagnosis', lambda on_token: summary_diagnosis(on_token=on_token)),
+        ('provider', lambda on_token: provider_assist(outputs['care'], outputs['diagnosis'], on_token=on_token)),
+    )
+    outputs = {}
+    for name, fn in stages:
+        outputs[name] = streaming.timed_stage(name, fn, timers, printer)()
+    for name, timer in timers.items():
+        print(f"{name}: {timer.as_dict()}")
     # print(summary(summary_diagnosis(), summary_age()))
     # print(models.call_openai(diagnose_prompt.DIAGNOSE_PROMPT.format(context="", report=test_reports.REPORT)).choices[0].message.content)
     # print(stats_finder.stat_finder_age(test_reports.JAMES_REPORT))
@@ -1,20 +1,35 @@
 """
 Enhanced main module with support for both OpenAI and local Ollama models.
-This version allows you to choose between cloud-based OpenAI and local medgemma-assistant.
+This version allows you to choose between cloud-based OpenAI and local medgemma-assistant;
+a stage given a route in pipeline_config (set_route or a config file) follows that route instead.
 """
 
 import extract_pdf
-import models
+import backends
+import pipeline_config
 import ollama_models  # Our new Ollama integration
 import diagnose_prompt
 import care_plan_prompt
 import test_reports
 import stats_finder
+import guideline_index
+import stage_graph
+import streaming
+import tracing
 from typing import Optional
 
 # Configuration: Set to True to use Ollama, False to use OpenAI
 USE_OLLAMA = True  # Change this to switch between models
 
+def _backend(stage: Optional[str] = None) -> Optional[str]:
+    """
+    Backend override for a stage: None follows its configured pipeline_config
+    route, otherwise Ollama mode uses medgemma-assistant ('ollama-assistant').
+    """
+    if not USE_OLLAMA:
+        return 'openai'
+    return None if stage and pipeline_config.route_configured(stage) else 'ollama-assistant'
+
 PROVIDER_ASSISTANT_PROMPT = """
 Use the following information to help a provider write a portal message to a patient that helps them understand a recent radiology report and what options are available for care.
 
@@ -29,59 +44,70 @@ Instructions:
 - The goal of this message is to alleviate concerns, explain findings and set up the discussion in the follow-up visit so that the provider and patient can use shared decision to determine the next steps in treatment.
 """
 
-def get_ai_response(prompt: str) -> str:
+def get_ai_response(prompt: str, on_token=None, stage: str = 'provider_message') -> str:
     """
     Get AI response using either Ollama or OpenAI based on configuration.
     
     Args:
         prompt: The prompt to send to the AI model
+        on_token: Optional callback; streams the response chunk by chunk
+        stage: Pipeline stage; a configured pipeline_config route is used with Ollama
         
     Returns:
         AI response text
     """
-    if USE_OLLAMA:
-        return ollama_models.call_ollama(prompt)
-    else:
-        return models.call_openai(prompt).choices[0].message.content
+    return backends.complete_stage(stage, prompt, on_token=on_token, backend=_backend(stage))
 
-def provider_assist(care_plan: str, diagnosis: str) -> str:
+def models_used() -> str:
+    """Backend and model of every LLM stage, e.g. 'diagnosis: ollama-assistant (medgemma-assistant), ...'."""
+    routes = []
+    for stage in ('diagnosis', 'care_plan', 'stats', 'provider_message'):
+        selected, model = backends.resolve(stage, _backend(stage))
+        routes.append(f"{stage}: {selected.name} ({model or selected.default_model})")
+    return ", ".join(routes)
+
+def provider_assist(care_plan: str, diagnosis: str, on_token=None) -> str:
     """Generate provider assistance message."""
     prompt = PROVIDER_ASSISTANT_PROMPT.format(diagnosis=diagnosis, care_plan=care_plan)
-    return get_ai_response(prompt)
+    return get_ai_response(prompt, on_token=on_token)
+
+def care_plan(report: str = test_reports.JAMES_REPORT, on_token=None, diagnosis: Optional[str] = None,
+              age: Optional[int] = None) -> str:
+    """
+    Generate care plan recommendations.
 
-def care_plan(report: str = test_reports.JAMES_REPORT) -> str:
-    """Generate care plan recommendations."""
+    With Ollama the care plan is written from the diagnosis; pass the one
+    already generated to avoid a second diagnosis call.
+    """
     if USE_OLLAMA:
-        # Use Ollama's specialized care plan function
-        client = ollama_models.OllamaClient()
-        # First get a diagnosis to inform the care plan
-        with open('ajnr.md', 'r') as f:
-            context = f.read()
-        diagnosis = client.generate_diagnosis(report, context)
-        return client.generate_care_plan(diagnosis)
+        # Age-aware care plan prompt: medgemma-assistant unless the stage is routed
+        if diagnosis is None:
+            diagnosis = summary_diagnosis(report, age=age)
+        if _backend('care_plan') == 'ollama-assistant':
+            return ollama_models.OllamaClient().generate_care_plan(diagnosis, age=age, on_token=on_token)
+        return get_ai_response(ollama_models.care_plan_prompt(diagnosis, age), on_token=on_token, stage='care_plan')
     else:
         # Use original OpenAI approach
-        with open('acp_guidelines.md', 'r') as out_file:
-            context = out_file.read()
-        return models.call_openai(care_plan_prompt.CARE_PLAN_PROMPT.format(context=context, report=report)).choices[0].message.content
+        context = guideline_index.retrieve_context(guideline_index.CARE_PLAN_GUIDELINES, report)
+        return get_ai_response(care_plan_prompt.CARE_PLAN_PROMPT.format(context=context, report=report), on_token=on_token, stage='care_plan')
 
-def summary_diagnosis(report: str = test_reports.JAMES_REPORT) -> str:
+def summary_diagnosis(report: str = test_reports.JAMES_REPORT, on_token=None, age: Optional[int] = None) -> str:
     """Generate patient-friendly diagnosis summary."""
     if USE_OLLAMA:
-        # Use Ollama's specialized diagnosis function
-        client = ollama_models.OllamaClient()
-        with open('ajnr.md', 'r') as f:
-            context = f.read()
-        return client.generate_diagnosis(report, context)
+        # Age-aware diagnosis prompt: medgemma-assistant unless the stage is routed
+        context = guideline_index.retrieve_context(guideline_index.DIAGNOSIS_GUIDELINES, report)
+        if _backend('diagnosis') == 'ollama-assistant':
+            return ollama_models.OllamaClient().generate_diagnosis(report, context, age=age, on_token=on_token)
+        return get_ai_response(ollama_models.diagnosis_prompt(report, context, age), on_token=on_token,
+                               stage='diagnosis')
     else:
         # Use original OpenAI approach
-        with open('ajnr.md', 'r') as out_file:
-            context = out_file.read()
-        return models.call_openai(diagnose_prompt.DIAGNOSE_PROMPT.format(context=context, report=report)).choices[0].message.content
+        context = guideline_index.retrieve_context(guideline_index.DIAGNOSIS_GUIDELINES, report)
+        return get_ai_response(diagnose_prompt.DIAGNOSE_PROMPT.format(context=context, report=report), on_token=on_token, stage='diagnosis')
 
 def summary_age(report: str = test_reports.JAMES_REPORT) -> str:
     """Get age-specific statistics for conditions found in report."""
-    return stats_finder.stat_finder(report=report)
+    return stats_finder.stat_finder(report=report, backend=_backend('stats'))
 
 def fetch_patient_age() -> int:
     """Fetch patient age (currently returns mock data)."""
@@ -91,85 +117,102 @@ def summary(diagnosis_summary: str, stats_diagnosis_age: str) -> str:
     """Combine diagnosis and age statistics."""
     return f"{diagnosis_summary} \n\n\n\n {stats_diagnosis_age}"
 
-def run_full_pipeline(report: str = test_reports.JAMES_REPORT, patient_age: Optional[int] = None) -> dict:
+STAGE_TITLES = {
+    'care_plan': "📋 CARE PLAN",
+    'diagnosis': "🔍 DIAGNOSIS EXPLANATION",
+    'provider_message': "👨‍⚕️ PROVIDER MESSAGE",
+    'age_statistics': "📈 AGE STATISTICS",
+}
+
+def run_full_pipeline(report: str = test_reports.JAMES_REPORT, patient_age: Optional[int] = None,
+                      stream_listener=None) -> dict:
     """
     Run the complete medical AI assistant pipeline.
     
     Args:
         report: The radiology report text
         patient_age: Optional patient age for age-specific recommendations
+        stream_listener: Optional listener (e.g. streaming.StreamPrinter) that
+            receives generated tokens of every stage as they arrive
         
     Returns:
-        Dictionary containing all generated content
+        Dictionary containing all generated content and per-stage timings
+        (time to first token and total seconds)
     """
     print("🏥 Starting Medical AI Assistant Pipeline...")
-    print(f"📊 Using {'Ollama (local medgemma-assistant)' if USE_OLLAMA else 'OpenAI GPT-4'}")
+    print(f"📊 Using {'Ollama' if USE_OLLAMA else 'OpenAI'}: {models_used()}")
     
-    # Generate diagnosis
-    print("🔍 Generating patient-friendly diagnosis...")
-    if USE_OLLAMA and patient_age:
-        client = ollama_models.OllamaClient()
-        with open('ajnr.md', 'r') as f:
-            context = f.read()
-        diagnosis = client.generate_diagnosis(report, context, age=patient_age)
-    else:
-        diagnosis = summary_diagnosis(report)
+    # Each stage streams through a StageTimer so TTFT and total latency are recorded
+    timers = {}
     
-    # Generate care plan
-    print("📋 Generating care plan recommendations...")
-    if USE_OLLAMA and patient_age:
-        client = ollama_models.OllamaClient()
-        care = client.generate_care_plan(diagnosis, age=patient_age)
-    else:
-        care = care_plan(report)
+    def timed(name, fn):
+        return streaming.timed_stage(name, fn, timers, stream_listener)
+    
+    def diagnosis_stage(on_token):
+        print("🔍 Generating patient-friendly diagnosis...")
+        return summary_diagnosis(report, on_token=on_token, age=patient_age)
+    
+    def care_plan_stage(on_token, **inputs):
+        print("📋 Generating care plan recommendations...")
+        return care_plan(report, on_token=on_token, diagnosis=inputs.get('diagnosis'), age=patient_age)
+    
+    def age_statistics_stage(on_token):
+        print("📈 Fetching age-specific statistics...")
+        return summary_age(report)
     
-    # Generate provider message
-    print("👨‍⚕️ Generating provider assistance message...")
-    provider_response = provider_assist(care, diagnosis)
+    def provider_message_stage(on_token, care_plan, diagnosis):
+        print("👨‍⚕️ Generating provider assistance message...")
+        return provider_assist(care_plan, diagnosis, on_token=on_token)
     
-    # Get age statistics
-    print("📈 Fetching age-specific statistics...")
-    age_stats = summary_age(report)
+    # The Ollama care plan is written from the diagnosis; otherwise it only
+    # needs the report and runs alongside diagnosis and statistics.
+    care_plan_deps = ('diagnosis',) if USE_OLLAMA else ()
+    with tracing.span('pipeline', kind='pipeline', backend='ollama' if USE_OLLAMA else 'openai'):
+        outputs = stage_graph.run_stages([
+            stage_graph.Stage('diagnosis', timed('diagnosis', diagnosis_stage)),
+            stage_graph.Stage('care_plan', timed('care_plan', care_plan_stage), deps=care_plan_deps),
+            stage_graph.Stage('age_statistics', timed('age_statistics', age_statistics_stage)),
+            stage_graph.Stage('provider_message', timed('provider_message', provider_message_stage),
+                              deps=('care_plan', 'diagnosis')),
+        ])
     
     results = {
-        'diagnosis': diagnosis,
-        'care_plan': care,
-        'provider_message': provider_response,
-        'age_statistics': age_stats,
-        'model_used': 'Ollama (medgemma-assistant)' if USE_OLLAMA else 'OpenAI GPT-4'
+        'diagnosis': outputs['diagnosis'],
+        'care_plan': outputs['care_plan'],
+        'provider_message': outputs['provider_message'],
+        'age_statistics': outputs['age_statistics'],
+        'model_used': models_used(),
+        'timings': {name: timer.as_dict() for name, timer in timers.items()},
     }
     
     print("✅ Pipeline complete!")
     return results
 
+def print_timings(timings: dict) -> None:
+    """Print time-to-first-token and total latency per stage."""
+    print("\n⏱️  STAGE TIMINGS")
+    print("=" * 50)
+    for name, timing in timings.items():
+        ttft = f"{timing['ttft_s']:.2f}s" if timing['ttft_s'] is not None else "-"
+        print(f"{STAGE_TITLES.get(name, name)}: first token {ttft}, total {timing['total_s']:.2f}s")
+
 def main():
     """Main execution function."""
     print("🚀 Medical AI Assistant - Enhanced Version")
     print("=" * 50)
     
+    # Load the models up front so the first stage doesn't pay the model load
+    if USE_OLLAMA:
+        backends.warm_routes(extra=(('ollama-assistant', None),))
+    
     # You can specify a patient age here for more personalized results
     patient_age = 45  # Change this or set to None
     
-    # Run the full pipeline
-    results = run_full_pipeline(test_reports.JAMES_REPORT, patient_age)
-    
-    # Display results
-    print("\n📋 CARE PLAN")
-    print("=" * 50)
-    print(results['care_plan'])
-    
-    print("\n🔍 DIAGNOSIS EXPLANATION")
-    print("=" * 50)
-    print(results['diagnosis'])
-    
-    print("\n👨‍⚕️ PROVIDER MESSAGE")
-    print("=" * 50)
-    print(results['provider_message'])
-    
-    print("\n📈 AGE STATISTICS")
-    print("=" * 50)
-    print(results['age_statistics'])
+    # Run the full pipeline, displaying each section as it is generated
+    printer = streaming.StreamPrinter(STAGE_TITLES)
+    results = run_full_pipeline(test_reports.JAMES_REPORT, patient_age, stream_listener=printer)
     
+    print_timings(results['timings'])
     print(f"\n🤖 Model Used: {results['model_used']}")
 
 def test_both_models():
@@ -195,71 +238,17 @@ def test_both_models():
         'openai': openai_results
     }
 
-if __name__ == "__main__":
-    main()
+def demo():
+    """Run each stage one after another and print the sections."""
+    import models_ollama
     
-    # Optionally extract PDF and process it
-    try:
-        print("\n📄 Processing PDF...")
-        response = extract_pdf.sync_extract_report_from_pdf('red_flags.pdf')
-        extract_pdf.store_extracted_info(response, 'red_flags.md')
-        print("✅ PDF processing complete!")
-    except Exception as e:
-        print(f"⚠️ PDF processing failed: {e}")
-
-import models_ollama as models  # Use Ollama instead of OpenAI
-import diagnose_prompt
-import care_plan_prompt
-import test_reports
-import stats_finder_ollama as stats_finder
-
-PROVIDER_ASSISTANT_PROMPT = """
-Use the following information to help a provider write a portal message to a patient that helps them understand a recent radiology report and what options are available for care.
-
-# Diagnosis
-{diagnosis}
-
-# Care Plan
-{care_plan}
-
-Instructions:
-- Please be empathetic and friendly in your disposition and explain things in simple terminology.
-- The goal of this message is to alleviate concerns, explain findings and set up the discussion in the follow-up visit so that the provider and patient can use shared decision to determine the next steps in treatment.
-"""
-
-def provider_assist(care_plan, diagnosis):
-    print("🤖 Generating provider communication message...")
-    return models.call_openai(PROVIDER_ASSISTANT_PROMPT.format(diagnosis=diagnosis, care_plan=care_plan)).choices[0].message.content
-
-def care_plan(report=test_reports.JAMES_REPORT):
-    print("📋 Generating evidence-based care plan...")
-    with open('acp_guidelines.md', 'r') as out_file:
-        context = out_file.read()
-    return models.call_openai(care_plan_prompt.CARE_PLAN_PROMPT.format(context=context, report=report)).choices[0].message.content
-
-def summary_diagnosis(report=test_reports.JAMES_REPORT):
-    print("🏥 Generating patient-friendly diagnosis summary...")
-    with open('ajnr.md', 'r') as out_file:
-        context = out_file.read()
-    return models.call_openai(diagnose_prompt.DIAGNOSE_PROMPT.format(context=context, report=report)).choices[0].message.content
-
-def summary_age(report=test_reports.JAMES_REPORT):
-    print("📊 Finding age-relevant statistics...")
-    return stats_finder.stat_finder(report=report)
-
-def summary(diagnosis_summary, stats_diagnosis_age):
-    return f"{diagnosis_summary} \n\n\n\n {stats_diagnosis_age}"
-
-def fetch_patient_age():
-    return 65
-
-def main(): 
     print("🏥 MEDICAL AI ASSISTANT DEMO")
     print("===========================")
     print()
     print("🔧 Using Ollama (Local AI Models)")
-    print(f"📊 Available models: {', '.join(models.list_available_models())}")
-    print(f"🤖 Using model: {models.DEFAULT_MODEL}")
+    print(f"📊 Available models: {', '.join(models_ollama.list_available_models())}")
+    for stage in ('care_plan', 'diagnosis', 'stats', 'provider_message'):
+        print(f"🤖 {stage}: {backends.describe_stage(stage, _backend(stage))}")
     print()
     
     print("Processing MRI report for patient (57 years old):")
@@ -304,7 +293,16 @@ def main():
         print(f"\n❌ Error during processing: {e}")
         print("Make sure Ollama is running and the selected model is available.")
 
-# Using the special variable  
-# __name__ 
-if __name__=="__main__": 
-    main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
+    
+    # Optionally extract PDF and process it
+    try:
+        print("\n📄 Processing PDF...")
+        response = extract_pdf.sync_extract_report_from_pdf('red_flags.pdf')
+        extract_pdf.store_extracted_info(response, 'red_flags.md')
+        print("✅ PDF processing complete!")
+    except Exception as e:
+        print(f"⚠️ PDF processing failed: {e}")
+
+    demo()
@@ -1,26 +1,219 @@
-from openai import OpenAI
 import os
+import threading
+import weakref
+import backend_limits
+import llm_cache
+import streaming
+import tracing
 
-# Prefer environment variables for API configuration. If OPENAI_API_KEY is set,
-# the OpenAI client will pick it up automatically.
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("OPENAI_API_KEY environment variable not set")
-client = OpenAI(api_key=api_key)
-
-def call_openai(prompt='Write a Python function that returns the square of a number'):
-    # Call the OpenAI API with the prompt
-    chat_completion = client.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": prompt,
-            }
-        ],
-        model="gpt-4o",
-    )
-    return chat_completion
+# The openai package and its clients are created on first use, so importing
+# this module (e.g. on the Ollama-only path) is cheap and works without a key.
+DEFAULT_MODEL = "gpt-4o"
+
+_client = None
+_client_lock = threading.Lock()
+# AsyncOpenAI clients hold loop-bound connection pools, so keep one per event loop
+_async_clients = weakref.WeakKeyDictionary()
+
+def _api_key():
+    # Prefer environment variables for API configuration
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY environment variable not set")
+    return api_key
+
+def _timeout(timeout):
+    from openai import NOT_GIVEN
+    return NOT_GIVEN if timeout is None else timeout
+
+def get_client():
+    """Return the shared OpenAI client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+            _client = OpenAI(api_key=_api_key())
+        return _client
+
+def __getattr__(name):
+    # Backwards compatible models.client
+    if name == "client":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _messages(prompt):
+    return [
+        {
+            "role": "system",
+            "content": prompt,
+        }
+    ]
+
+def _generation_kwargs(profile):
+    # Request parameters of a pipeline_config.GenerationProfile; OpenAI has
+    # no context window setting and takes at most 4 stop sequences
+    if profile is None:
+        return {}
+    kwargs = {
+        "max_completion_tokens": profile.max_tokens,
+        "temperature": profile.temperature,
+        "stop": list(profile.stop[:4]) or None,
+    }
+    return {key: value for key, value in kwargs.items() if value is not None}
+
+def _record_finish(choice):
+    tracing.record_usage(finish_reason=getattr(choice, 'finish_reason', None))
+
+def get_async_client():
+    import asyncio  # Only loaded when async code already runs
+    loop = asyncio.get_running_loop()
+    async_client = _async_clients.get(loop)
+    if async_client is None:
+        from openai import AsyncOpenAI
+        async_client = AsyncOpenAI(api_key=_api_key())
+        _async_clients[loop] = async_client
+    return async_client
+
+def stream_openai(prompt, model=None, timeout=None, cache=True, profile=None):
+    """
+    Stream a chat completion, yielding text chunks as they are generated.
+
+    profile is an optional pipeline_config.GenerationProfile (token cap,
+    stop sequences, temperature).
+    """
+    model = model or DEFAULT_MODEL
+    generation = _generation_kwargs(profile)
+
+    def chunks():
+        with backend_limits.backend_slot('openai'):
+            stream = get_client().chat.completions.create(
+                messages=_messages(prompt),
+                model=model,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=_timeout(timeout),
+                **generation,
+            )
+            for chunk in stream:
+                # The final chunk carries the usage block and no choices
+                tracing.record_openai_usage(getattr(chunk, 'usage', None))
+                if chunk.choices:
+                    _record_finish(chunk.choices[0])
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    return llm_cache.cached_stream('openai', model, prompt, generation or None, chunks, cache=cache)
+
+async def astream_openai(prompt, model=None, timeout=None, cache=True, profile=None):
+    """Async iterator version of stream_openai."""
+    model = model or DEFAULT_MODEL
+    generation = _generation_kwargs(profile)
+
+    async def chunks():
+        async with backend_limits.async_backend_slot('openai'):
+            stream = await get_async_client().chat.completions.create(
+                messages=_messages(prompt),
+                model=model,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=_timeout(timeout),
+                **generation,
+            )
+            async for chunk in stream:
+                tracing.record_openai_usage(getattr(chunk, 'usage', None))
+                if chunk.choices:
+                    _record_finish(chunk.choices[0])
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    async for chunk in llm_cache.acached_stream('openai', model, prompt, generation or None, chunks, cache=cache):
+        yield chunk
+
+def call_openai(prompt='Write a Python function that returns the square of a number', model=None, timeout=None, cache=True,
+                on_token=None, profile=None):
+    # Stream when the caller wants chunks as they arrive
+    if on_token is not None:
+        return llm_cache.CachedCompletion(streaming.collect(stream_openai(prompt, model, timeout, cache, profile),
+                                                            on_token))
+
+    model = model or DEFAULT_MODEL
+    generation = _generation_kwargs(profile)
+
+    def compute():
+        # Call the OpenAI API with the prompt
+        with backend_limits.backend_slot('openai'):
+            chat_completion = get_client().chat.completions.create(
+                messages=_messages(prompt),
+                model=model,
+                timeout=_timeout(timeout),
+                **generation,
+            )
+        tracing.record_openai_usage(chat_completion.usage)
+        _record_finish(chat_completion.choices[0])
+        return chat_completion.choices[0].message.content
+
+    return llm_cache.CachedCompletion(llm_cache.cached_text('openai', model, prompt, generation or None, compute,
+                                                            cache=cache))
+
+async def acall_openai(prompt, model=None, timeout=None, cache=True, profile=None):
+    """
+    Awaitable version of call_openai using the AsyncOpenAI client.
+
+    Cancelling the awaiting task aborts the request; timeout is an overall
+    deadline in seconds for this call.
+    """
+    model = model or DEFAULT_MODEL
+    generation = _generation_kwargs(profile)
+
+    async def compute():
+        async with backend_limits.async_backend_slot('openai'):
+            request = get_async_client().chat.completions.create(
+                messages=_messages(prompt),
+                model=model,
+                timeout=_timeout(timeout),
+                **generation,
+            )
+            import asyncio
+            chat_completion = await asyncio.wait_for(request, timeout)
+        tracing.record_openai_usage(chat_completion.usage)
+        _record_finish(chat_completion.choices[0])
+        return chat_completion.choices[0].message.content
+
+    text = await llm_cache.acached_text('openai', model, prompt, generation or None, compute, cache=cache)
+    return llm_cache.CachedCompletion(text)
+
+def call_json(prompt, schema, name='response', model=None, timeout=None, cache=True, profile=None):
+    """
+    Generate a JSON object constrained to a JSON schema (structured outputs).
+
+    The schema must follow OpenAI's strict mode rules: every property
+    required and additionalProperties false on every object.
+
+    Returns:
+        The decoded JSON object
+    """
+    import json
+    model = model or DEFAULT_MODEL
+    response_format = {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": True}}
+    generation = _generation_kwargs(profile)
+
+    def compute():
+        with backend_limits.backend_slot('openai'):
+            chat_completion = get_client().chat.completions.create(
+                messages=_messages(prompt),
+                model=model,
+                response_format=response_format,
+                timeout=_timeout(timeout),
+                **generation,
+            )
+        tracing.record_openai_usage(chat_completion.usage)
+        _record_finish(chat_completion.choices[0])
+        return chat_completion.choices[0].message.content
+
+    text = llm_cache.cached_text('openai', model, prompt, dict(generation, response_format=response_format),
+                                 compute, cache=cache)
+    return json.loads(text)
 
 
 # Summarize the diagnosis as you would to a 5 year old.
-# Stats Finder 
+# Stats Finder
@@ -1,75 +1,159 @@
-import requests
 import json
 import os
+import ollama_http
+import llm_cache
+import streaming
 
 # Ollama configuration
-OLLAMA_BASE_URL = "http://localhost:11434"
+OLLAMA_BASE_URL = ollama_http.OLLAMA_BASE_URL
 DEFAULT_MODEL = "llama3.1:8b"  # Use the most capable model available
 
-def call_openai(prompt='Write a Python function that returns the square of a number', model=None):
+# Response objects that match OpenAI's structure (shared __slots__ classes)
+MockChoice = llm_cache.CachedChoice
+MockResponse = llm_cache.CachedCompletion
+
+def _generate_payload(prompt, model, stream=False, profile=None):
+    """
+    Prepare the request payload for Ollama.
+    
+    Options of a pipeline_config.GenerationProfile override the defaults;
+    Ollama caps generated tokens with num_predict (it ignores max_tokens).
+    """
+    options = {
+        "temperature": 0.7,
+        "top_p": 0.9,
+        "num_predict": 2000
+    }
+    options.update(ollama_http.generation_options(profile))
+    return {
+        "model": model or DEFAULT_MODEL,
+        "prompt": prompt,
+        "stream": stream,
+        "options": options
+    }
+
+def stream_openai(prompt, model=None, timeout=None, cache=True, profile=None):
+    """
+    Stream an Ollama completion, yielding text chunks as they are generated.
+    
+    Args:
+        prompt: Prompt text
+        model: Ollama model name, defaults to DEFAULT_MODEL
+        timeout: Maximum seconds to wait for each chunk
+        cache: Set to False to bypass llm_cache
+        profile: Optional pipeline_config.GenerationProfile (token cap,
+            stop sequences, temperature, context window)
+        
+    Returns:
+        Generator of text chunks
+    """
+    payload = _generate_payload(prompt, model, stream=True, profile=profile)
+    
+    def chunks():
+        for part in ollama_http.stream_json("/api/generate", payload, base_url=OLLAMA_BASE_URL, timeout=timeout):
+            if part.get('response'):
+                yield part['response']
+    
+    return llm_cache.cached_stream('ollama', payload['model'], prompt, payload['options'], chunks, cache=cache)
+
+async def astream_openai(prompt, model=None, timeout=None, cache=True, profile=None):
+    """Async iterator version of stream_openai."""
+    payload = _generate_payload(prompt, model, stream=True, profile=profile)
+    
+    async def chunks():
+        async for part in ollama_http.astream_json("/api/generate", payload, base_url=OLLAMA_BASE_URL, timeout=timeout):
+            if part.get('response'):
+                yield part['response']
+    
+    async for chunk in llm_cache.acached_stream('ollama', payload['model'], prompt, payload['options'], chunks, cache=cache):
+        yield chunk
+
+def call_openai(prompt='Write a Python function that returns the square of a number', model=None, timeout=None, cache=True,
+                on_token=None, profile=None):
     """
     Call Ollama API instead of OpenAI for local inference.
     Returns an object that mimics the OpenAI response structure.
+    Identical requests are answered from llm_cache unless cache=False.
+    If on_token is given, the response is streamed and on_token is called
+    with each chunk as it arrives. profile is an optional
+    pipeline_config.GenerationProfile.
     """
-    if model is None:
-        model = DEFAULT_MODEL
+    if on_token is not None:
+        return MockResponse(streaming.collect(stream_openai(prompt, model, timeout, cache, profile), on_token))
     
-    # Prepare the request payload for Ollama
-    payload = {
-        "model": model,
-        "prompt": prompt,
-        "stream": False,
-        "options": {
-            "temperature": 0.7,
-            "top_p": 0.9,
-            "max_tokens": 2000
-        }
-    }
+    payload = _generate_payload(prompt, model, profile=profile)
     
-    try:
-        # Call Ollama generate endpoint
-        response = requests.post(
-            f"{OLLAMA_BASE_URL}/api/generate",
-            json=payload,
-            headers={"Content-Type": "application/json"},
-            timeout=120  # Medical explanations might take a while
-        )
+    def compute():
+        # Call Ollama generate endpoint over the shared keep-alive session
+        result = ollama_http.post_json("/api/generate", payload, base_url=OLLAMA_BASE_URL, timeout=timeout)
+        return result['response']
+    
+    return MockResponse(llm_cache.cached_text('ollama', payload['model'], prompt, payload['options'], compute, cache=cache))
+
+async def acall_openai(prompt, model=None, timeout=None, cache=True, profile=None):
+    """
+    Awaitable version of call_openai.
+    
+    Args:
+        prompt: Prompt text
+        model: Ollama model name, defaults to DEFAULT_MODEL
+        timeout: Overall deadline in seconds for this call
+        cache: Set to False to bypass llm_cache
+        profile: Optional pipeline_config.GenerationProfile
+        
+    Returns:
+        Object that mimics the OpenAI response structure
+    """
+    payload = _generate_payload(prompt, model, profile=profile)
+    
+    async def compute():
+        request = ollama_http.apost_json("/api/generate", payload, base_url=OLLAMA_BASE_URL, timeout=timeout)
+        import asyncio
+        return (await asyncio.wait_for(request, timeout))['response']
+    
+    return MockResponse(await llm_cache.acached_text('ollama', payload['model'], prompt, payload['options'], compute, cache=cache))
+
+def call_json(prompt, schema, model=None, timeout=None, cache=True, profile=None):
+    """
+    Generate a JSON object constrained to a JSON schema (Ollama structured outputs).
+    
+    Args:
+        prompt: Prompt text
+        schema: JSON schema passed as the request's "format"
+        model: Ollama model name, defaults to DEFAULT_MODEL
+        timeout: Read timeout in seconds
+        cache: Set to False to bypass llm_cache
+        profile: Optional pipeline_config.GenerationProfile
         
-        if response.status_code == 200:
-            result = response.json()
-            
-            # Create a mock response object that matches OpenAI's structure
-            class MockChoice:
-                def __init__(self, content):
-                    self.message = type('obj', (object,), {'content': content})()
-            
-            class MockResponse:
-                def __init__(self, content):
-                    self.choices = [MockChoice(content)]
-            
-            return MockResponse(result['response'])
-        else:
-            raise Exception(f"Ollama API error: {response.status_code} - {response.text}")
-            
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Failed to connect to Ollama: {e}")
+    Returns:
+        The decoded JSON object
+    """
+    payload = _generate_payload(prompt, model, profile=profile)
+    payload["format"] = schema
+    # Extraction should be deterministic unless the profile says otherwise
+    if profile is None or profile.temperature is None:
+        payload["options"] = dict(payload["options"], temperature=0)
+    
+    def compute():
+        result = ollama_http.post_json("/api/generate", payload, base_url=OLLAMA_BASE_URL, timeout=timeout)
+        return result['response']
+    
+    options = dict(payload['options'], format=schema)
+    return json.loads(llm_cache.cached_text('ollama', payload['model'], prompt, options, compute, cache=cache))
 
 def test_ollama_connection():
     """Test if Ollama is running and accessible."""
     try:
-        response = requests.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=5)
-        return response.status_code == 200
+        ollama_http.get_json("/api/tags", base_url=OLLAMA_BASE_URL)
+        return True
     except:
         return False
 
 def list_available_models():
     """Get list of available Ollama models."""
     try:
-        response = requests.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            return [model['name'] for model in data.get('models', [])]
-        return []
+        data = ollama_http.get_json("/api/tags", base_url=OLLAMA_BASE_URL)
+        return [model['name'] for model in data.get('models', [])]
     except:
         return []
 
@@ -0,0 +1,350 @@
+"""
+Shared keep-alive HTTP transport for talking to a local Ollama server.
+
+Every Ollama caller goes through a pooled requests.Session so repeated prompts
+reuse TCP connections instead of paying connection (or process) setup per call.
+"""
+
+import json
+import os
+import threading
+import time
+import weakref
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+import backend_limits
+import tracing
+
+if TYPE_CHECKING:
+    import requests
+
+# Ollama server and connection pool configuration
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+POOL_SIZE = 8  # Maximum keep-alive connections per Ollama server
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 120  # Medical explanations might take a while
+# Sent as keep_alive with every generate/chat request: how long Ollama keeps
+# the model loaded afterwards ("30m", "2h", "-1" = until the server stops;
+# empty = the server's default of 5 minutes)
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Whether backends preload their model at startup (Backend.warm); OLLAMA_PRELOAD=0 disables
+PRELOAD_MODELS = os.getenv("OLLAMA_PRELOAD", "1") != "0"
+
+_sessions: Dict[Tuple[str, int], "requests.Session"] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(base_url: str = OLLAMA_BASE_URL, pool_size: int = POOL_SIZE) -> "requests.Session":
+    """
+    Return the process-wide pooled session for an Ollama server.
+
+    Args:
+        base_url: Ollama server URL
+        pool_size: Maximum number of pooled keep-alive connections
+
+    Returns:
+        A requests.Session shared by all callers with the same settings
+    """
+    # requests is imported on first use to keep module import cheap
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    key = (base_url, pool_size)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            # pool_block keeps the number of open connections at pool_size;
+            # extra callers wait for a free connection instead of opening more.
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({"Content-Type": "application/json"})
+            _sessions[key] = session
+        return session
+
+
+def keep_alive_value(keep_alive: Optional[str] = None):
+    """keep_alive as Ollama parses it: bare numbers are seconds, others durations like "30m"."""
+    value = KEEP_ALIVE if keep_alive is None else keep_alive
+    if isinstance(value, str) and value.lstrip('-').isdigit():
+        return int(value)
+    return value or None
+
+
+def generation_options(profile) -> Dict[str, Any]:
+    """
+    Request options of a pipeline_config.GenerationProfile: num_predict (the
+    hard cap on generated tokens), temperature, stop and num_ctx.
+    """
+    if profile is None:
+        return {}
+    options = {'num_predict': profile.max_tokens, 'temperature': profile.temperature,
+               'stop': list(profile.stop) or None, 'num_ctx': profile.num_ctx}
+    return {key: value for key, value in options.items() if value is not None}
+
+
+def _with_keep_alive(payload: Dict[str, Any]) -> Dict[str, Any]:
+    keep_alive = keep_alive_value()
+    if keep_alive is None or 'model' not in payload or 'keep_alive' in payload:
+        return payload
+    return dict(payload, keep_alive=keep_alive)
+
+
+def post_json(path: str, payload: Dict[str, Any], base_url: str = OLLAMA_BASE_URL,
+              pool_size: int = POOL_SIZE, timeout: Optional[float] = None,
+              connect_timeout: float = CONNECT_TIMEOUT) -> Dict[str, Any]:
+    """
+    POST a JSON payload to an Ollama endpoint over the pooled session.
+
+    The request holds one 'ollama' slot from backend_limits while in flight.
+
+    Args:
+        path: Endpoint path, e.g. "/api/generate"
+        payload: JSON request body
+        base_url: Ollama server URL
+        pool_size: Connection pool size of the session to use
+        timeout: Read timeout in seconds, defaults to READ_TIMEOUT
+        connect_timeout: Connect timeout in seconds
+
+    Returns:
+        Decoded JSON response
+    """
+    import requests
+    session = get_session(base_url, pool_size)
+    # Errors and token counts are taken inside the slot so an adaptive limit sees them
+    with backend_limits.backend_slot('ollama'):
+        try:
+            response = session.post(
+                f"{base_url}{path}",
+                json=_with_keep_alive(payload),
+                timeout=(connect_timeout, READ_TIMEOUT if timeout is None else timeout),
+            )
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Failed to connect to Ollama: {e}")
+
+        if response.status_code != 200:
+            raise Exception(f"Ollama API error: {response.status_code} - {response.text}")
+        result = response.json()
+        tracing.record_ollama_stats(result)
+    return result
+
+
+def stream_json(path: str, payload: Dict[str, Any], base_url: str = OLLAMA_BASE_URL,
+                pool_size: int = POOL_SIZE, timeout: Optional[float] = None,
+                connect_timeout: float = CONNECT_TIMEOUT) -> Iterator[Dict[str, Any]]:
+    """
+    POST a streaming request and yield each newline-delimited JSON chunk.
+
+    The payload should set "stream": True. The 'ollama' backend slot and the
+    pooled connection are held until the generator is exhausted or closed;
+    timeout bounds the wait between chunks, not the whole generation.
+    """
+    import requests
+    session = get_session(base_url, pool_size)
+    with backend_limits.backend_slot('ollama'):
+        try:
+            response = session.post(
+                f"{base_url}{path}",
+                json=_with_keep_alive(payload),
+                timeout=(connect_timeout, READ_TIMEOUT if timeout is None else timeout),
+                stream=True,
+            )
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Failed to connect to Ollama: {e}")
+
+        with response:
+            if response.status_code != 200:
+                raise Exception(f"Ollama API error: {response.status_code} - {response.text}")
+            try:
+                for line in response.iter_lines():
+                    if line:
+                        part = json.loads(line)
+                        if part.get("done"):
+                            tracing.record_ollama_stats(part)
+                        yield part
+            except requests.exceptions.RequestException as e:
+                raise Exception(f"Ollama stream interrupted: {e}")
+
+
+def get_json(path: str, base_url: str = OLLAMA_BASE_URL, timeout: float = CONNECT_TIMEOUT) -> Dict[str, Any]:
+    """GET an Ollama endpoint such as /api/tags over the pooled session."""
+    response = get_session(base_url).get(f"{base_url}{path}", timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def loaded_models(base_url: str = OLLAMA_BASE_URL) -> Dict[str, Dict[str, Any]]:
+    """Models currently resident in the Ollama server (/api/ps), by name."""
+    return {model['name']: model for model in get_json("/api/ps", base_url).get('models', [])}
+
+
+def _resident(model: str, loaded: Dict[str, Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    return loaded.get(model) or (loaded.get(f"{model}:latest") if ':' not in model else None)
+
+
+def preload(model: str, base_url: str = OLLAMA_BASE_URL, keep_alive: Optional[str] = None,
+            timeout: float = READ_TIMEOUT) -> Dict[str, Any]:
+    """
+    Load a model into the Ollama server with a zero-token request, pinned for keep_alive.
+
+    Recorded as a 'warmup' tracing span and counted in llm_model_warmups_total.
+
+    Args:
+        model: Ollama model name
+        base_url: Ollama server URL
+        keep_alive: Overrides KEEP_ALIVE
+        timeout: Read timeout in seconds (a cold load of a large model is slow)
+
+    Returns:
+        Dict with 'model', 'cold' (None if the server can't tell), 'load_s',
+        'wall_s', 'size' and 'size_vram' (bytes, None if unknown) and 'keep_alive'
+    """
+    try:
+        cold = _resident(model, loaded_models(base_url)) is None
+    except Exception:
+        cold = None
+    payload = {"model": model}
+    if keep_alive_value(keep_alive) is not None:
+        payload["keep_alive"] = keep_alive_value(keep_alive)
+    with tracing.span('ollama.preload', kind='warmup', backend='ollama', model=model) as warmup:
+        started = time.perf_counter()
+        try:
+            response = get_session(base_url).post(f"{base_url}/api/generate", json=payload,
+                                                  timeout=(CONNECT_TIMEOUT, timeout))
+        except Exception as e:
+            raise Exception(f"Failed to connect to Ollama: {e}")
+        if response.status_code != 200:
+            raise Exception(f"Ollama API error: {response.status_code} - {response.text}")
+        wall_s = time.perf_counter() - started
+        result = response.json()
+        load_s = result['load_duration'] / 1e9 if 'load_duration' in result else wall_s
+        if cold is None:
+            cold = load_s > 1.0
+        warmup.set(cold=cold, load_s=load_s)
+
+    try:
+        resident = _resident(model, loaded_models(base_url)) or {}
+    except Exception:
+        resident = {}
+    return {'model': model, 'cold': cold, 'load_s': load_s, 'wall_s': wall_s,
+            'size': resident.get('size'), 'size_vram': resident.get('size_vram'),
+            'keep_alive': payload.get('keep_alive')}
+
+
+def describe_preload(report: Dict[str, Any]) -> str:
+    """One-line summary of a preload() report."""
+    def gb(size):
+        return f"{size / 1e9:.1f} GB"
+
+    state = {True: "cold load", False: "already resident", None: "loaded"}[report['cold']]
+    line = f"{report['model']}: {state} in {report['wall_s']:.2f}s"
+    if report['cold']:
+        line += f" (load {report['load_s']:.2f}s)"
+    if report.get('size'):
+        line += f", {gb(report['size'])} resident ({gb(report.get('size_vram') or 0)} in VRAM)"
+    if report.get('keep_alive') is not None:
+        line += f", keep_alive {report['keep_alive']}"
+    return line
+
+
+def close_sessions() -> None:
+    """Close all pooled sessions (e.g. before forking worker processes)."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+# event loop -> {(base_url, pool_size): httpx.AsyncClient}
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client(base_url: str = OLLAMA_BASE_URL, pool_size: int = POOL_SIZE):
+    """
+    Return the pooled httpx.AsyncClient for the running event loop.
+
+    httpx is imported lazily (it ships with the openai package) so sync-only
+    callers don't pay for it.
+    """
+    import asyncio
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    key = (base_url, pool_size)
+    client = clients.get(key)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            headers={"Content-Type": "application/json"},
+        )
+        clients[key] = client
+    return client
+
+
+async def apost_json(path: str, payload: Dict[str, Any], base_url: str = OLLAMA_BASE_URL,
+                     pool_size: int = POOL_SIZE, timeout: Optional[float] = None,
+                     connect_timeout: float = CONNECT_TIMEOUT) -> Dict[str, Any]:
+    """
+    Async counterpart of post_json.
+
+    Cancelling the awaiting task aborts the HTTP request and releases the
+    connection and the 'ollama' backend slot.
+    """
+    import httpx
+
+    client = get_async_client(base_url, pool_size)
+    read_timeout = READ_TIMEOUT if timeout is None else timeout
+    async with backend_limits.async_backend_slot('ollama'):
+        try:
+            response = await client.post(
+                path,
+                json=_with_keep_alive(payload),
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            )
+        except httpx.HTTPError as e:
+            raise Exception(f"Failed to connect to Ollama: {e}")
+
+        if response.status_code != 200:
+            raise Exception(f"Ollama API error: {response.status_code} - {response.text}")
+        result = response.json()
+        tracing.record_ollama_stats(result)
+    return result
+
+
+async def astream_json(path: str, payload: Dict[str, Any], base_url: str = OLLAMA_BASE_URL,
+                       pool_size: int = POOL_SIZE, timeout: Optional[float] = None,
+                       connect_timeout: float = CONNECT_TIMEOUT) -> AsyncIterator[Dict[str, Any]]:
+    """Async counterpart of stream_json."""
+    import httpx
+
+    client = get_async_client(base_url, pool_size)
+    read_timeout = READ_TIMEOUT if timeout is None else timeout
+    async with backend_limits.async_backend_slot('ollama'):
+        try:
+            async with client.stream(
+                "POST", path,
+                json=_with_keep_alive(payload),
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            ) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    raise Exception(f"Ollama API error: {response.status_code} - {body.decode(errors='replace')}")
+                async for line in response.aiter_lines():
+                    if line:
+                        part = json.loads(line)
+                        if part.get("done"):
+                            tracing.record_ollama_stats(part)
+                        yield part
+        except httpx.HTTPError as e:
+            raise Exception(f"Failed to connect to Ollama: {e}")
+
+
+async def aclose_clients() -> None:
+    """Close the async clients of the running event loop."""
+    import asyncio
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
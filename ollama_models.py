@@ -1,58 +1,251 @@
 """
 Ollama model integration for the medical AI assistant project.
-This module provides an alternative to OpenAI using the local medgemma-assistant model.
+This module provides an alternative to OpenAI using the local medgemma-assistant model,
+served by the Ollama HTTP API over a pooled keep-alive connection.
 """
 
-import subprocess
 import json
-from typing import Optional, Dict, Any
+import ollama_http
+import llm_cache
+import pipeline_config
+import streaming
+from typing import Optional, Dict, Any, List, Callable, Iterator, AsyncIterator
+
+
+# Age-aware prompts of the Ollama pipeline; format them with diagnosis_prompt / care_plan_prompt
+DIAGNOSIS_PROMPT = """Please analyze this radiology report and provide a patient-friendly explanation of the findings.{age_context}
+
+Context: {context}
+
+Report: {report}
+
+Please provide:
+1. A clear explanation of what was found
+2. What these findings mean in everyday terms
+3. How common these conditions are (especially for the patient's age if provided)
+4. General guidance on next steps
+
+Keep the response under 1000 characters and use a compassionate, reassuring tone."""
+
+CARE_PLAN_PROMPT = """Based on this diagnosis, please provide evidence-based treatment recommendations{age_context}.
+
+Diagnosis: {diagnosis}
+
+Please provide:
+1. Conservative treatment options (physical therapy, lifestyle changes)
+2. Medical interventions if needed
+3. When to seek immediate medical attention
+4. Expected timeline for improvement
+5. Cost and invasiveness considerations
+
+Focus on patient-centered, accessible language and prioritize less invasive options first."""
+
+
+def diagnosis_prompt(report_text: str, context: str = "", age: Optional[int] = None) -> str:
+    """DIAGNOSIS_PROMPT for a report, mentioning the patient's age when known."""
+    age_context = f" The patient is {age} years old." if age else ""
+    return DIAGNOSIS_PROMPT.format(age_context=age_context, context=context, report=report_text)
+
+
+def care_plan_prompt(diagnosis: str, age: Optional[int] = None) -> str:
+    """CARE_PLAN_PROMPT for a diagnosis, tailored to the patient's age when known."""
+    age_context = f" for a {age}-year-old patient" if age else ""
+    return CARE_PLAN_PROMPT.format(age_context=age_context, diagnosis=diagnosis)
 
 
 class OllamaClient:
-    """Client for interacting with Ollama models locally."""
+    """Client for interacting with Ollama models over the local HTTP API."""
     
-    def __init__(self, model_name: str = "medgemma-assistant"):
+    def __init__(self, model_name: str = "medgemma-assistant",
+                 base_url: str = ollama_http.OLLAMA_BASE_URL,
+                 pool_size: int = ollama_http.POOL_SIZE,
+                 timeout: float = ollama_http.READ_TIMEOUT,
+                 connect_timeout: float = ollama_http.CONNECT_TIMEOUT,
+                 cache: bool = True):
         self.model_name = model_name
+        self.cache = cache
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+    
+    def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return ollama_http.post_json(
+                path, payload,
+                base_url=self.base_url,
+                pool_size=self.pool_size,
+                timeout=self.timeout,
+                connect_timeout=self.connect_timeout,
+            )
+        except Exception as e:
+            raise Exception(f"Failed to call Ollama: {str(e)}")
+    
+    async def _apost(self, path: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        import asyncio  # Imported here to keep sync-only startup cheap
+        timeout = self.timeout if timeout is None else timeout
+        request = ollama_http.apost_json(
+            path, payload,
+            base_url=self.base_url,
+            pool_size=self.pool_size,
+            timeout=timeout,
+            connect_timeout=self.connect_timeout,
+        )
+        try:
+            return await asyncio.wait_for(request, timeout)
+        except asyncio.TimeoutError:
+            raise Exception("Ollama request timed out")
+        except Exception as e:
+            raise Exception(f"Failed to call Ollama: {str(e)}")
     
-    def generate(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+    @staticmethod
+    def _generate_payload(model_name: str, prompt: str, system_prompt: Optional[str],
+                          stream: bool = False, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        payload = {
+            "model": model_name,
+            "prompt": prompt,
+            "stream": stream,
+        }
+        if system_prompt:
+            payload["system"] = system_prompt
+        if options:
+            payload["options"] = options
+        return payload
+    
+    @staticmethod
+    def _cache_options(system_prompt: Optional[str], options: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        # Request options (e.g. num_predict) change the output, so they are part of the cache key
+        return {"system": system_prompt, "options": options} if options else {"system": system_prompt}
+    
+    def stream(self, prompt: str, system_prompt: Optional[str] = None,
+               options: Optional[Dict[str, Any]] = None) -> Iterator[str]:
         """
-        Generate a response using the Ollama model.
+        Stream a response from /api/generate, yielding text chunks as they arrive.
         
         Args:
             prompt: The user prompt/question
             system_prompt: Optional system prompt (will override Modelfile system prompt)
+            options: Optional Ollama request options overriding the Modelfile
+                parameters (num_predict, temperature, stop, num_ctx, ...)
+            
+        Returns:
+            Generator of text chunks
+        """
+        payload = self._generate_payload(self.model_name, prompt, system_prompt, stream=True, options=options)
+        
+        def chunks():
+            try:
+                for part in ollama_http.stream_json(
+                    "/api/generate", payload,
+                    base_url=self.base_url,
+                    pool_size=self.pool_size,
+                    timeout=self.timeout,
+                    connect_timeout=self.connect_timeout,
+                ):
+                    if part.get("response"):
+                        yield part["response"]
+            except Exception as e:
+                raise Exception(f"Failed to call Ollama: {str(e)}")
+        
+        return llm_cache.cached_stream('ollama', self.model_name, prompt, self._cache_options(system_prompt, options),
+                                       chunks, cache=self.cache)
+    
+    async def astream(self, prompt: str, system_prompt: Optional[str] = None,
+                      options: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """Async iterator version of stream()."""
+        payload = self._generate_payload(self.model_name, prompt, system_prompt, stream=True, options=options)
+        
+        async def chunks():
+            async for part in ollama_http.astream_json(
+                "/api/generate", payload,
+                base_url=self.base_url,
+                pool_size=self.pool_size,
+                timeout=self.timeout,
+                connect_timeout=self.connect_timeout,
+            ):
+                if part.get("response"):
+                    yield part["response"]
+        
+        async for chunk in llm_cache.acached_stream('ollama', self.model_name, prompt,
+                                                    self._cache_options(system_prompt, options),
+                                                    chunks, cache=self.cache):
+            yield chunk
+    
+    def generate(self, prompt: str, system_prompt: Optional[str] = None,
+                 on_token: Optional[Callable[[str], None]] = None,
+                 options: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Generate a response using the Ollama /api/generate endpoint.
+        
+        Args:
+            prompt: The user prompt/question
+            system_prompt: Optional system prompt (will override Modelfile system prompt)
+            on_token: Optional callback; when given the response is streamed
+                and on_token receives each chunk as it arrives
+            options: Optional Ollama request options (see stream)
             
         Returns:
             Generated response text
         """
-        # Build the command
-        cmd = ["ollama", "run", self.model_name]
+        if on_token is not None:
+            return streaming.collect(self.stream(prompt, system_prompt, options), on_token).strip()
         
-        # If system prompt is provided, add it to the prompt
-        if system_prompt:
-            full_prompt = f"System: {system_prompt}\n\nUser: {prompt}"
-        else:
-            full_prompt = prompt
+        payload = self._generate_payload(self.model_name, prompt, system_prompt, options=options)
+        return llm_cache.cached_text(
+            'ollama', self.model_name, prompt, self._cache_options(system_prompt, options),
+            lambda: self._post("/api/generate", payload)["response"].strip(),
+            cache=self.cache,
+        )
+    
+    async def agenerate(self, prompt: str, system_prompt: Optional[str] = None,
+                        timeout: Optional[float] = None, options: Optional[Dict[str, Any]] = None) -> str:
+        """Awaitable version of generate() with an optional per-call timeout."""
+        payload = self._generate_payload(self.model_name, prompt, system_prompt, options=options)
         
-        try:
-            result = subprocess.run(
-                cmd + [full_prompt],
-                capture_output=True,
-                text=True,
-                timeout=120  # 2 minute timeout
-            )
+        async def compute():
+            return (await self._apost("/api/generate", payload, timeout))["response"].strip()
+        
+        return await llm_cache.acached_text('ollama', self.model_name, prompt,
+                                            self._cache_options(system_prompt, options),
+                                            compute, cache=self.cache)
+    
+    def chat(self, messages: List[Dict[str, str]]) -> str:
+        """
+        Generate a response using the Ollama /api/chat endpoint.
+        
+        Args:
+            messages: Chat history as [{"role": ..., "content": ...}] dicts
             
-            if result.returncode == 0:
-                return result.stdout.strip()
-            else:
-                raise Exception(f"Ollama error: {result.stderr}")
-                
-        except subprocess.TimeoutExpired:
-            raise Exception("Ollama request timed out")
-        except Exception as e:
-            raise Exception(f"Failed to call Ollama: {str(e)}")
+        Returns:
+            Content of the assistant reply
+        """
+        payload = {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": False,
+        }
+        return llm_cache.cached_text(
+            'ollama', self.model_name, json.dumps(messages), {"endpoint": "chat"},
+            lambda: self._post("/api/chat", payload)["message"]["content"].strip(),
+            cache=self.cache,
+        )
     
-    def generate_diagnosis(self, report_text: str, context: str = "", age: Optional[int] = None) -> str:
+    async def achat(self, messages: List[Dict[str, str]], timeout: Optional[float] = None) -> str:
+        """Awaitable version of chat() with an optional per-call timeout."""
+        payload = {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": False,
+        }
+        
+        async def compute():
+            return (await self._apost("/api/chat", payload, timeout))["message"]["content"].strip()
+        
+        return await llm_cache.acached_text('ollama', self.model_name, json.dumps(messages), {"endpoint": "chat"},
+                                            compute, cache=self.cache)
+    
+    def generate_diagnosis(self, report_text: str, context: str = "", age: Optional[int] = None,
+                           on_token: Optional[Callable[[str], None]] = None) -> str:
         """
         Generate a patient-friendly diagnosis explanation.
         
@@ -60,62 +253,48 @@ class OllamaClient:
             report_text: The radiology report text
             context: Additional medical context
             age: Patient age for age-appropriate statistics
+            on_token: Optional callback receiving streamed chunks
             
+        Generation settings come from the 'diagnosis' stage profile.
+        
         Returns:
             Patient-friendly diagnosis explanation
         """
-        age_context = f" The patient is {age} years old." if age else ""
-        
-        prompt = f"""Please analyze this radiology report and provide a patient-friendly explanation of the findings.{age_context}
-
-Context: {context}
-
-Report: {report_text}
-
-Please provide:
-1. A clear explanation of what was found
-2. What these findings mean in everyday terms
-3. How common these conditions are (especially for the patient's age if provided)
-4. General guidance on next steps
-
-Keep the response under 1000 characters and use a compassionate, reassuring tone."""
-        
-        return self.generate(prompt)
+        return self.generate(diagnosis_prompt(report_text, context, age), on_token=on_token,
+                             options=ollama_http.generation_options(pipeline_config.profile_for('diagnosis')))
     
-    def generate_care_plan(self, diagnosis: str, age: Optional[int] = None) -> str:
+    def generate_care_plan(self, diagnosis: str, age: Optional[int] = None,
+                           on_token: Optional[Callable[[str], None]] = None) -> str:
         """
         Generate treatment recommendations and care plan.
         
         Args:
             diagnosis: The diagnosis/findings summary
             age: Patient age for age-appropriate recommendations
+            on_token: Optional callback receiving streamed chunks
             
+        Generation settings come from the 'care_plan' stage profile.
+        
         Returns:
             Treatment care plan recommendations
         """
-        age_context = f" for a {age}-year-old patient" if age else ""
-        
-        prompt = f"""Based on this diagnosis, please provide evidence-based treatment recommendations{age_context}.
-
-Diagnosis: {diagnosis}
-
-Please provide:
-1. Conservative treatment options (physical therapy, lifestyle changes)
-2. Medical interventions if needed
-3. When to seek immediate medical attention
-4. Expected timeline for improvement
-5. Cost and invasiveness considerations
-
-Focus on patient-centered, accessible language and prioritize less invasive options first."""
-        
-        return self.generate(prompt)
+        return self.generate(care_plan_prompt(diagnosis, age), on_token=on_token,
+                             options=ollama_http.generation_options(pipeline_config.profile_for('care_plan')))
 
 
 # Convenience functions to match existing OpenAI interface
-def call_ollama(prompt: str, model_name: str = "medgemma-assistant") -> str:
+def call_ollama(prompt: str, model_name: str = "medgemma-assistant", cache: bool = True,
+                on_token: Optional[Callable[[str], None]] = None) -> str:
     """Simple function to call Ollama model, similar to call_openai interface."""
-    client = OllamaClient(model_name)
-    return client.generate(prompt)
+    client = OllamaClient(model_name, cache=cache)
+    return client.generate(prompt, on_token=on_token)
+
+
+async def acall_ollama(prompt: str, model_name: str = "medgemma-assistant", timeout: Optional[float] = None,
+                       cache: bool = True) -> str:
+    """Awaitable version of call_ollama."""
+    client = OllamaClient(model_name, cache=cache)
+    return await client.agenerate(prompt, timeout=timeout)
 
 
 # Example usage functions
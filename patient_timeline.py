@@ -0,0 +1,342 @@
+"""
+Longitudinal processing of a patient's studies.
+
+Reports are grouped by patient (the header name and date of birth; a report
+without a date of birth joins the patient of that name whose birth date fits
+its stated age at the study date, and is a timeline of its own when none or
+several do) and ordered by study date.
+The first study of a body region runs the full structured pipeline. For a
+follow-up study, the structured findings (see structured_report) are diffed
+against everything seen in earlier studies of the same region:
+
+- new findings and findings whose severity changed are spelled out;
+- unchanged findings are listed by condition and level only;
+- earlier findings of an imaged region that are no longer reported are listed.
+
+Care plan and diagnosis are prompted with that diff and a smaller guideline
+context retrieved for the changes only. A follow-up with no changes at all
+(same findings and severities, same impression and red flags) makes no
+model call after the extraction and reuses the stage outputs of the
+previous study of the region.
+
+Patients run concurrently; the studies of one patient run in date order.
+
+    python process_extracted_reports.py --timeline
+"""
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import guideline_index
+import report_fields
+import structured_report
+
+# Guideline context budget when prompting from the changes since the prior study
+FOLLOWUP_CONTEXT_TOKEN_BUDGET = 250
+UNCHANGED_NOTE = "_No change since the {date} study; its assessment still applies._\n\n"
+
+# Spinal regions by level prefix ("L4-L5" -> lumbar) and by exam wording
+_LEVEL_REGIONS = {'C': 'cervical', 'T': 'thoracic', 'L': 'lumbar', 'S': 'sacral'}
+_EXAM_REGIONS = {'cervical': 'cervical', 'cx': 'cervical', 'thoracic': 'thoracic', 'lumbar': 'lumbar',
+                 'sacr': 'sacral'}
+_REUSED_STAGES = ('care_plan', 'diagnosis', 'provider_message')
+
+
+def patient_key(report: Dict[str, Any]) -> str:
+    """
+    Timeline a report belongs to: the patient name and date of birth, else
+    the report itself (a name alone can be shared by different patients;
+    group_by_patient matches such reports on name and age).
+    """
+    name = report_fields.patient_name(report['text'])
+    born = report_fields.birth_date(report['text'])
+    return f"{name.lower()}|{born.isoformat()}" if name and born else f"report:{report['title']}"
+
+
+def study_date_of(report: Dict[str, Any]) -> Optional[date]:
+    """Study date from the report header, else from a date in the title."""
+    return report_fields.study_date(report['text']) or report_fields.parse_date(report['title'])
+
+
+def _age_at(born: date, on: date) -> int:
+    return on.year - born.year - ((on.month, on.day) < (born.month, born.day))
+
+
+def _years_before(on: date, years: int) -> date:
+    try:
+        return on.replace(year=on.year - years)
+    except ValueError:  # February 29th
+        return on.replace(year=on.year - years, day=28)
+
+
+def _age_key(report: Dict[str, Any], births: Dict[str, Set[date]], windows: Dict[str, List[list]]) -> Optional[str]:
+    """
+    Timeline of a report with a name and age but no date of birth: the one
+    date of birth seen for that name that fits the age at the study date,
+    else (no date of birth seen for the name) earlier such reports whose
+    possible birth dates overlap. None when the age conflicts or is ambiguous.
+    """
+    name = report_fields.patient_name(report['text'])
+    age = report_fields.patient_age(report['text'])
+    on = study_date_of(report)
+    if not name or age is None or on is None:
+        return None
+    name = name.lower()
+    if name in births:
+        matches = [born for born in births[name] if _age_at(born, on) == age]
+        return f"{name}|{matches[0].isoformat()}" if len(matches) == 1 else None
+    earliest, latest = _years_before(on, age + 1) + timedelta(days=1), _years_before(on, age)
+    for window in windows.setdefault(name, []):
+        if window[0] <= latest and earliest <= window[1]:
+            window[0], window[1] = max(window[0], earliest), min(window[1], latest)
+            return window[2]
+    key = f"{name}|born {earliest.isoformat()}..{latest.isoformat()}"
+    windows[name].append([earliest, latest, key])
+    return key
+
+
+def group_by_patient(reports: List[Dict[str, Any]]) -> List[List[Tuple[int, Dict[str, Any]]]]:
+    """
+    Group reports into per-patient timelines by name and date of birth. A
+    report without a date of birth but with a name, an age and a study date
+    joins the patient of that name whose date of birth fits the age; it is
+    split off only when none or several do.
+
+    Returns:
+        One list of (input index, report) per patient, ordered by study date
+        (undated reports last, in input order)
+    """
+    births: Dict[str, Set[date]] = {}
+    for report in reports:
+        name = report_fields.patient_name(report['text'])
+        born = report_fields.birth_date(report['text'])
+        if name and born:
+            births.setdefault(name.lower(), set()).add(born)
+
+    timelines: Dict[str, List[Tuple[int, Dict[str, Any]]]] = {}
+    windows: Dict[str, List[list]] = {}  # name -> [earliest, latest birth date, key] of age-only reports
+    for index, report in enumerate(reports):
+        key = patient_key(report)
+        if key.startswith('report:'):
+            key = _age_key(report, births, windows) or key
+        timelines.setdefault(key, []).append((index, report))
+    for timeline in timelines.values():
+        timeline.sort(key=lambda item: (study_date_of(item[1]) or date.max, item[0]))
+    return list(timelines.values())
+
+
+def finding_key(finding: Dict[str, Any]) -> Tuple[str, Optional[str], str]:
+    # Unmatched findings ('Other') are told apart by their description
+    description = finding.get('description', '').lower() if finding['condition'] == 'Other' else ''
+    return finding['condition'], finding.get('level'), description
+
+
+def finding_region(finding: Dict[str, Any]) -> Optional[str]:
+    level = (finding.get('level') or '').strip().upper()
+    return _LEVEL_REGIONS.get(level[:1])
+
+
+def study_regions(findings: Dict[str, Any]) -> Set[str]:
+    """Spinal regions a study covers, from its exam name and finding levels."""
+    exam = findings.get('exam', '').lower()
+    regions = {region for word, region in _EXAM_REGIONS.items() if re.search(rf"\b{word}", exam)}
+    regions.update(filter(None, map(finding_region, findings.get('findings') or [])))
+    return regions
+
+
+def _statements(findings: Dict[str, Any], field: str) -> List[str]:
+    return sorted(" ".join(statement.split()).lower() for statement in findings.get(field) or [])
+
+
+class PatientHistory:
+    """Findings seen so far in a patient's timeline and the latest result per region."""
+
+    def __init__(self):
+        self.findings: Dict[Tuple, Dict[str, Any]] = {}  # finding_key -> {'finding', 'date'}
+        self.latest: Dict[str, Dict[str, Any]] = {}  # region -> {'date', 'regions', 'result'}
+
+    def diff(self, findings: Dict[str, Any], regions: Set[str]) -> Dict[str, list]:
+        """
+        Compare a study's findings with the earlier studies of its regions.
+
+        Returns:
+            Dict of 'new' and 'unchanged' findings, 'changed' (prior, current)
+            pairs and 'not_seen' prior findings of an imaged region
+        """
+        diff = {'new': [], 'changed': [], 'unchanged': [], 'not_seen': []}
+        seen = set()
+        for finding in findings.get('findings') or []:
+            key = finding_key(finding)
+            seen.add(key)
+            prior = self.findings.get(key)
+            if prior is None:
+                diff['new'].append(finding)
+            elif prior['finding']['severity'] != finding['severity']:
+                diff['changed'].append((prior['finding'], finding))
+            else:
+                diff['unchanged'].append(finding)
+        diff['not_seen'] = [prior['finding'] for key, prior in self.findings.items()
+                            if key not in seen and finding_region(prior['finding']) in regions]
+        return diff
+
+    def prior_date(self, regions: Set[str]) -> Optional[date]:
+        dates = [self.latest[region]['date'] for region in regions if region in self.latest]
+        return max(filter(None, dates), default=None)
+
+    def reusable(self, findings: Dict[str, Any], regions: Set[str]) -> Optional[Dict[str, Any]]:
+        """
+        Latest result, if it was a study of exactly these regions with the
+        same impression and red flags as findings.
+        """
+        latest = [self.latest.get(region) for region in regions]
+        if not regions or None in latest or any(entry is not latest[0] for entry in latest):
+            return None
+        entry = latest[0]
+        if entry['regions'] != regions or any(_statements(entry['findings'], field) != _statements(findings, field)
+                                              for field in ('impression', 'red_flags')):
+            return None
+        return entry
+
+    def observe(self, when: Optional[date], findings: Dict[str, Any], regions: Set[str],
+                result: Dict[str, Any]) -> None:
+        for finding in findings.get('findings') or []:
+            self.findings[finding_key(finding)] = {'finding': finding, 'date': when}
+        entry = {'date': when, 'regions': regions, 'findings': findings, 'result': result}
+        for region in regions:
+            self.latest[region] = entry
+
+
+def render_followup(findings: Dict[str, Any], diff: Dict[str, list], prior_date: Optional[date]) -> str:
+    """Prompt text of a follow-up study: what changed since the prior studies."""
+    age = f"{findings['age']}-year-old" if findings.get('age') is not None else "age unknown,"
+    lines = [f"Patient: {age} {findings.get('sex', 'unknown')}"]
+    if findings.get('exam'):
+        lines.append(f"Exam: {findings['exam']}")
+    lines.append(f"Follow-up study, compared with prior imaging{f' (latest {prior_date})' if prior_date else ''}.")
+    if diff['new']:
+        lines.append("New findings:")
+        lines.extend(f"- {structured_report.format_finding(finding)}" for finding in diff['new'])
+    if diff['changed']:
+        lines.append("Changed findings:")
+        lines.extend(f"- {structured_report.format_finding(current)} (was {prior['severity']})"
+                     for prior, current in diff['changed'])
+    if diff['not_seen']:
+        lines.append("No longer reported:")
+        lines.extend(f"- {structured_report.format_finding(finding, description=False)}"
+                     for finding in diff['not_seen'])
+    if diff['unchanged']:
+        lines.append("Unchanged: " + "; ".join(
+            structured_report.format_finding(finding, description=False) for finding in diff['unchanged']))
+    if findings.get('impression'):
+        lines.append("Impression:")
+        lines.extend(f"- {statement}" for statement in findings['impression'])
+    if findings.get('red_flags'):
+        lines.append("Red flags: " + "; ".join(findings['red_flags']))
+    return "\n".join(lines)
+
+
+def process_study(report: Dict[str, Any], history: PatientHistory) -> Optional[Dict[str, Any]]:
+    """
+    Process one study of a timeline and record it in the patient's history.
+
+    Returns:
+        The result dict of process_extracted_reports.process_single_report,
+        or None if the study failed
+    """
+    import process_extracted_reports
+
+    title = report['title']
+    when = study_date_of(report)
+    findings = structured_report.extract_findings(report['text'])
+    regions = study_regions(findings)
+    diff = history.diff(findings, regions)
+    prior_date = history.prior_date(regions)
+    follow_up = prior_date is not None and any(diff[kind] for kind in ('changed', 'unchanged', 'not_seen'))
+    reusable = history.reusable(findings, regions)
+
+    if follow_up and reusable and not (diff['new'] or diff['changed'] or diff['not_seen']):
+        print(f"♻️  {title}: no change since {prior_date}, reusing that assessment")
+        note = UNCHANGED_NOTE.format(date=prior_date)
+        outputs = {stage: note + reusable['result'][stage] for stage in _REUSED_STAGES}
+        outputs.update(findings=findings, stats=structured_report.describe_statistics(findings))
+        result = process_extracted_reports.build_result(title, outputs)
+    else:
+        prompt_view = None
+        if follow_up:
+            summary = render_followup(findings, diff, prior_date)
+            changes = render_followup(findings, dict(diff, unchanged=[]), prior_date)
+            print(f"🔁 {title}: follow-up of {prior_date}, {len(diff['new'])} new, "
+                  f"{len(diff['changed'])} changed, {len(diff['unchanged'])} unchanged findings")
+
+            def prompt_view(guidelines, findings):
+                context = guideline_index.retrieve_context(guidelines, changes,
+                                                           token_budget=FOLLOWUP_CONTEXT_TOKEN_BUDGET)
+                return summary, context
+
+        result = process_extracted_reports.process_single_report(
+            report, completed={'findings': findings}, structured=True, prompt_view=prompt_view)
+    if result is not None:
+        history.observe(when, findings, regions, result)
+    return result
+
+
+def process_timeline(reports: List[Dict[str, Any]], max_workers: int = 4, sink=None) -> List[Optional[Dict[str, Any]]]:
+    """
+    Process reports as per-patient timelines.
+
+    Args:
+        reports: Report dicts as returned by extract_reports_from_markdown
+        max_workers: Number of patients processed concurrently
+        sink: Optional callable(index, result) invoked as each report finishes
+
+    Returns:
+        List of results in input order; failed reports are None
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(reports)
+
+    def run(timeline):
+        history = PatientHistory()
+        for index, report in timeline:
+            try:
+                result = process_study(report, history)
+            except Exception as e:
+                print(f"❌ Error processing {report.get('title', 'report')}: {e}")
+                result = None
+            results[index] = result
+            if sink is not None:
+                try:
+                    sink(index + 1, result)
+                except Exception as e:
+                    print(f"⚠️ Failed to write result for report {index + 1}: {e}")
+
+    timelines = group_by_patient(reports)
+    print(f"🗂️  {len(timelines)} patients, {len(reports)} studies")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(run, timelines))
+    return results
+
+
+if __name__ == "__main__":
+    # The sample patient's three studies: the 2021 MRI states an age instead of a date of birth
+    import process_extracted_reports
+
+    samples = process_extracted_reports.extract_reports_from_markdown('combined_reports.md')
+    grouping = [[index for index, _ in timeline] for timeline in group_by_patient(samples)]
+    print(f"{'✅' if grouping == [[0, 1, 2]] else '❌'} combined_reports.md timelines: {grouping}")
+
+    def header(age, born=None):
+        return {'title': f"age {age}", 'text': f"Name: Cashion, Danny\nDate of Study: 6/20/2021\nAge: {age}\n"
+                                               + (f"Date of Birth: {born}\n" if born else "")}
+
+    cases = [
+        ("age conflicting with the date of birth", samples[1:] + [header(50)], [[0, 1], [2]]),
+        ("ages fitting one birth date", [header(74), dict(header(78), text=header(78)['text'].replace('2021', '2025'))],
+         [[0, 1]]),
+        ("two birth dates fitting the age", [header(74), header(74, '1946-08-26'), header(74, '1947-01-02')],
+         [[0], [1], [2]]),
+    ]
+    for label, reports, expected in cases:
+        grouping = sorted([index for index, _ in timeline] for timeline in group_by_patient(reports))
+        print(f"{'✅' if grouping == sorted(expected) else '❌'} {label}: {grouping}")
@@ -0,0 +1,171 @@
+"""
+Per-stage backend routing for the report pipeline.
+
+Each pipeline stage (diagnosis, care_plan, stats, provider_message, ...) is
+sent to a backend from the backends registry and, optionally, a specific
+model, so for example the stats stage can use a small fast model while the
+care plan uses a larger one. Stages without an entry use DEFAULT_ROUTE.
+
+Every stage also has a GenerationProfile: a hard cap on generated tokens
+(Ollama num_predict, OpenAI max_completion_tokens), stop sequences,
+temperature and the Ollama context window. The prompts ask for answers of
+about 1000 characters, but only the token cap bounds output length and with
+it decode time. Every backend honors the profile (see backends).
+
+Routes and profiles can be changed in code with set_route() and
+set_profile() or loaded from a JSON file (PIPELINE_CONFIG environment
+variable or load_config()):
+
+    {
+        "default": {"backend": "ollama"},
+        "stages": {
+            "stats": {"backend": "ollama", "model": "llama3.2:1b", "max_tokens": 128},
+            "care_plan": {"backend": "openai", "model": "gpt-4o", "temperature": 0.3},
+            "diagnosis": {"num_predict": 300, "stop": ["\n\n\n"], "num_ctx": 8192}
+        }
+    }
+"""
+
+import json
+import os
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+CONFIG_PATH = os.getenv("PIPELINE_CONFIG") or None
+
+
+class Route(NamedTuple):
+    """Backend name and model (None means the backend's default model)."""
+    backend: str
+    model: Optional[str] = None
+
+
+DEFAULT_ROUTE = Route('ollama')
+
+# Routes of the process_extracted_reports / main_ollama pipeline stages
+STAGE_ROUTES: Dict[str, Route] = {
+    'findings': Route('ollama'),
+    'diagnosis': Route('ollama'),
+    'care_plan': Route('ollama'),
+    'stats': Route('ollama'),
+    'provider_message': Route('ollama'),
+}
+
+
+class GenerationProfile(NamedTuple):
+    """
+    Generation settings of a stage; None (or no stop sequences) leaves the
+    backend's default.
+    """
+    max_tokens: Optional[int] = None  # Cap on generated tokens (Ollama num_predict)
+    temperature: Optional[float] = None
+    stop: Tuple[str, ...] = ()
+    num_ctx: Optional[int] = None  # Ollama context window in tokens
+
+    def merged(self, override: "GenerationProfile") -> "GenerationProfile":
+        """This profile with the settings override sets replacing its own."""
+        return self._replace(**{field: value for field, value in override._asdict().items()
+                                if value is not None and value != ()})
+
+    def describe(self) -> str:
+        """Short summary for banners, e.g. 'max_tokens=384 temperature=0'."""
+        parts = [f"{field}={value!r}" if field == 'stop' else f"{field}={value}"
+                 for field, value in self._asdict().items() if value is not None and value != ()]
+        return " ".join(parts) or "backend defaults"
+
+
+# Limits of stages without a profile entry
+DEFAULT_PROFILE = GenerationProfile(max_tokens=2000)
+
+# Diagnosis and care plan prompts ask for ~1000 characters (~250 tokens);
+# the caps leave headroom so compliant answers are never cut off
+STAGE_PROFILES: Dict[str, GenerationProfile] = {
+    'findings': GenerationProfile(max_tokens=1024, temperature=0),
+    'diagnosis': GenerationProfile(max_tokens=384),
+    'care_plan': GenerationProfile(max_tokens=384),
+    'stats': GenerationProfile(max_tokens=256),
+    'provider_message': GenerationProfile(max_tokens=512),
+}
+
+# Stages routed by set_route ('*' once the default route was set)
+_configured_routes = set()
+
+_PROFILE_KEYS = {'max_tokens': 'max_tokens', 'num_predict': 'max_tokens', 'temperature': 'temperature',
+                 'stop': 'stop', 'num_ctx': 'num_ctx'}
+
+
+def route_for(stage: str) -> Route:
+    """Backend and model a stage is sent to."""
+    return STAGE_ROUTES.get(stage, DEFAULT_ROUTE)
+
+
+def route_configured(stage: str) -> bool:
+    """Whether a stage's route was set (set_route or a config file) rather than left at its built-in one."""
+    return stage in _configured_routes or '*' in _configured_routes
+
+
+def set_route(stage: str, backend: str, model: Optional[str] = None) -> None:
+    """Send a stage to a backend (and model); stage '*' sets the default."""
+    global DEFAULT_ROUTE
+    _configured_routes.add(stage)
+    if stage == '*':
+        DEFAULT_ROUTE = Route(backend, model)
+    else:
+        STAGE_ROUTES[stage] = Route(backend, model)
+
+
+def profile_for(stage: str) -> GenerationProfile:
+    """Generation settings of a stage."""
+    return STAGE_PROFILES.get(stage, DEFAULT_PROFILE)
+
+
+def set_profile(stage: str, **settings: Any) -> None:
+    """
+    Change generation settings of a stage (stage '*' changes the default),
+    e.g. set_profile('stats', max_tokens=128, stop=["\n\n"]).
+
+    Raises:
+        ValueError: For an unknown setting or a max_tokens/num_ctx below 1
+    """
+    global DEFAULT_PROFILE
+    unknown = set(settings) - set(_PROFILE_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown generation settings {sorted(unknown)}, expected {sorted(_PROFILE_KEYS)}")
+    fields = {_PROFILE_KEYS[key]: value for key, value in settings.items()}
+    for field in ('max_tokens', 'num_ctx'):
+        if fields.get(field) is not None and fields[field] < 1:
+            raise ValueError(f"{field} of {stage!r} must be at least 1")
+    if 'stop' in fields:
+        fields['stop'] = (fields['stop'],) if isinstance(fields['stop'], str) else tuple(fields['stop'] or ())
+    if stage == '*':
+        DEFAULT_PROFILE = DEFAULT_PROFILE._replace(**fields)
+    else:
+        STAGE_PROFILES[stage] = profile_for(stage)._replace(**fields)
+
+
+def load_config(path: str) -> None:
+    """
+    Load routes and generation profiles from a JSON file (see the module
+    docstring for the format). A stage entry without "backend" only changes
+    its profile (and, with "model", the model of its current backend).
+
+    Raises:
+        ValueError: If a route names a backend that is not registered or a
+            generation setting is invalid
+    """
+    import backends
+
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    routes = {'*': config.get('default')} if config.get('default') else {}
+    routes.update(config.get('stages', {}))
+    for stage, route in routes.items():
+        if 'backend' in route or 'model' in route:
+            backend = route.get('backend') or (DEFAULT_ROUTE if stage == '*' else route_for(stage)).backend
+            backends.get_backend(backend)  # Fail early on typos
+            set_route(stage, backend, route.get('model'))
+        set_profile(stage, **{key: value for key, value in route.items() if key not in ('backend', 'model')})
+
+
+if CONFIG_PATH:
+    load_config(CONFIG_PATH)
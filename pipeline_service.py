@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Long-running HTTP service around the report pipeline.
+
+One process keeps the backend clients, the guideline indexes and the LLM
+response cache warm, so callers (e.g. the EHR portal integration) pay no
+per-request startup cost:
+
+    POST /analyze   {"text": "...", "title": "...", "structured": false}
+                    -> {"report_hash", "coalesced", "result"} where result is
+                       the process_extracted_reports result dict
+    GET  /health    status, uptime, in-flight and waiting requests, routes
+    GET  /metrics   Prometheus metrics (tracing spans plus service gauges)
+
+Concurrent requests for the same report text (and mode) are coalesced: the
+first runs the pipeline and every other waiter gets its result. With
+--similar, a report close enough to one analyzed before reuses its
+personalized outputs (see similar_reports). At most
+SERVICE_CONCURRENCY pipelines run at once; a request that waits longer than
+SERVICE_QUEUE_TIMEOUT for a slot is answered with 503 and Retry-After.
+
+    python pipeline_service.py --port 8765 --concurrency 4
+    curl -s localhost:8765/analyze -d '{"title": "MRI", "text": "..."}'
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import backend_limits
+import tracing
+
+SERVICE_HOST = os.getenv("PIPELINE_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("PIPELINE_SERVICE_PORT", "8765"))
+SERVICE_CONCURRENCY = int(os.getenv("PIPELINE_SERVICE_CONCURRENCY", "4"))  # Pipelines run at once
+SERVICE_QUEUE_TIMEOUT = 30.0  # Seconds a request waits for a pipeline slot before a 503
+MAX_BODY_BYTES = 1_000_000
+
+
+class Busy(Exception):
+    """No pipeline slot freed up within the queue timeout."""
+
+
+def report_key(text: str, structured: bool) -> str:
+    """Coalescing key of a request: hash of the report text and pipeline mode."""
+    return hashlib.sha256(f"{int(structured)}\0{text}".encode('utf-8')).hexdigest()
+
+
+class Coalescer:
+    """Runs one computation per key at a time and shares its outcome with every concurrent caller."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+
+    def run(self, key: str, compute: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Returns:
+            (result, coalesced), coalesced being True when another caller's
+            computation was joined; its exception is raised to every waiter
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            return future.result(), True
+        try:
+            result = compute()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._in_flight)
+
+
+class PipelineService:
+    """The pipeline behind bounded concurrency and request coalescing."""
+
+    def __init__(self, concurrency: int = SERVICE_CONCURRENCY, queue_timeout: float = SERVICE_QUEUE_TIMEOUT,
+                 structured: bool = False, similar=None):
+        """
+        Args:
+            concurrency: Pipelines run at once (backend calls are further
+                bounded by backend_limits)
+            queue_timeout: Seconds a request waits for a slot before Busy
+            structured: Default pipeline mode of requests (see structured_report)
+            similar: Optional similar_reports.SimilarReports that near-duplicate
+                reports take their outputs from
+        """
+        self.concurrency = concurrency
+        self.queue_timeout = queue_timeout
+        self.structured = structured
+        self.similar = similar
+        self._similar_configs: Dict[bool, str] = {}
+        self.coalescer = Coalescer()
+        self.started = time.time()
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self.running = 0
+        self.waiting = 0
+
+    def warm(self) -> None:
+        """Import the pipeline, load the guideline indexes and warm the routed backends and models."""
+        import backends
+        import guideline_index
+        import process_extracted_reports  # noqa: F401
+
+        for source in (guideline_index.CARE_PLAN_GUIDELINES, guideline_index.DIAGNOSIS_GUIDELINES):
+            guideline_index.get_index(source)
+        backends.warm_routes()
+
+    def _compute(self, text: str, title: str, structured: bool) -> Dict[str, Any]:
+        import process_extracted_reports
+
+        with self._lock:
+            self.waiting += 1
+        acquired = self._slots.acquire(timeout=self.queue_timeout)
+        with self._lock:
+            self.waiting -= 1
+            self.running += acquired
+        if not acquired:
+            raise Busy()
+        report = {'title': title, 'text': text}
+        try:
+            if self.similar is None:
+                result = process_extracted_reports.process_single_report(report, structured=structured)
+            else:
+                if structured not in self._similar_configs:
+                    self._similar_configs[structured] = process_extracted_reports.similar_config(structured)
+                result = process_extracted_reports.process_similar(
+                    report, self.similar, self._similar_configs[structured],
+                    lambda report: process_extracted_reports.process_single_report(report, structured=structured))
+        finally:
+            with self._lock:
+                self.running -= 1
+            self._slots.release()
+        if result is None:
+            raise RuntimeError("Pipeline failed, see the service log")
+        return result
+
+    def analyze(self, text: str, title: Optional[str] = None, structured: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        Run the pipeline for a report, joining an identical request in flight.
+
+        Raises:
+            Busy: If no pipeline slot freed up within queue_timeout
+        """
+        structured = self.structured if structured is None else structured
+        key = report_key(text, structured)
+        title = title or f"report {key[:12]}"
+        with tracing.span('analyze', kind='service') as span:
+            try:
+                result, coalesced = self.coalescer.run(key, lambda: self._compute(text, title, structured))
+            except Busy:
+                span.set(outcome='rejected')
+                raise
+            except Exception:
+                span.set(outcome='failed')
+                raise
+            span.set(outcome='coalesced' if coalesced else 'computed')
+        return {'report_hash': key, 'coalesced': coalesced, 'result': dict(result, title=title)}
+
+    def health(self) -> Dict[str, Any]:
+        import backends
+        import pipeline_config
+
+        routes = {}
+        for stage in pipeline_config.STAGE_ROUTES:
+            selected, model = backends.resolve(stage)
+            profile = backends.stage_profile(stage, selected)
+            routes[stage] = {'route': f"{selected.name}:{model or selected.default_model}",
+                             'generation': {field: value for field, value in profile._asdict().items()
+                                            if value not in (None, ())}}
+        with self._lock:
+            running, waiting = self.running, self.waiting
+        health = {'status': 'ok', 'uptime_s': round(time.time() - self.started, 1), 'running': running,
+                  'waiting': waiting, 'in_flight_reports': len(self.coalescer), 'concurrency': self.concurrency,
+                  'backend_limits': backend_limits.describe_limits(), 'routes': routes}
+        if self.similar is not None:
+            health['similar_reports'] = self.similar.stats()
+        return health
+
+    def render_metrics(self) -> str:
+        with self._lock:
+            gauges = {'running': self.running, 'waiting': self.waiting}
+        lines = ["# TYPE service_pipelines gauge"]
+        lines.extend(f'service_pipelines{{state="{state}"}} {value}' for state, value in gauges.items())
+        lines.append("# TYPE service_pipeline_slots gauge")
+        lines.append(f"service_pipeline_slots {self.concurrency}")
+        return tracing.render_prometheus() + "\n".join(lines) + "\n"
+
+
+def make_server(service: PipelineService, host: str = SERVICE_HOST, port: int = SERVICE_PORT):
+    """
+    Create the HTTP server for a service (call serve_forever() to run it).
+
+    Returns:
+        A ThreadingHTTPServer, one thread per connection
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class ServiceHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, body, content_type="application/json", headers=()):
+            data = (body if isinstance(body, str) else json.dumps(body, ensure_ascii=False)).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path == "/health":
+                self._send(200, service.health())
+            elif path == "/metrics":
+                self._send(200, service.render_metrics(), "text/plain; version=0.0.4")
+            else:
+                self._send(404, {'error': f"Unknown path {path}"})
+
+        def do_POST(self):
+            if self.path.split("?")[0] != "/analyze":
+                self._send(404, {'error': f"Unknown path {self.path}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                if length < 0:
+                    raise ValueError(length)
+            except ValueError:
+                # The body can't be skipped without a valid length
+                self.close_connection = True
+                self._send(400, {'error': "Invalid Content-Length"})
+                return
+            if length > MAX_BODY_BYTES:
+                self.close_connection = True
+                self._send(413, {'error': f"Body larger than {MAX_BODY_BYTES} bytes"})
+                return
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+                text = request.get('text') or request.get('report')
+            except (ValueError, AttributeError):
+                self._send(400, {'error': "Body must be a JSON object"})
+                return
+            if not isinstance(text, str) or not text.strip():
+                self._send(400, {'error': "Missing report text ('text')"})
+                return
+            structured = request.get('structured')
+            if structured is not None and not isinstance(structured, bool):
+                self._send(400, {'error': "'structured' must be true or false"})
+                return
+            try:
+                response = service.analyze(text, title=request.get('title'), structured=structured)
+            except Busy:
+                self._send(503, {'error': "All pipeline slots are busy"},
+                           headers=(("Retry-After", str(max(1, round(service.queue_timeout)))),))
+            except Exception as e:
+                self._send(500, {'error': str(e)})
+            else:
+                self._send(200, response)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the report pipeline over HTTP")
+    parser.add_argument('--host', default=SERVICE_HOST, help="Interface to listen on")
+    parser.add_argument('--port', type=int, default=SERVICE_PORT, help="Port to listen on")
+    parser.add_argument('--concurrency', type=int, default=SERVICE_CONCURRENCY, help="Pipelines run at once")
+    parser.add_argument('--queue-timeout', type=float, default=SERVICE_QUEUE_TIMEOUT,
+                        help="Seconds a request waits for a pipeline slot before a 503")
+    parser.add_argument('--ollama-concurrency', type=int, default=None, help="Pin in-flight Ollama requests (default: adaptive, see backend_limits)")
+    parser.add_argument('--openai-concurrency', type=int, default=None, help="Max in-flight OpenAI requests")
+    parser.add_argument('--config', default=None, help="JSON file of per-stage backend routes (see pipeline_config)")
+    parser.add_argument('--backend', default=None, help="Route every stage to this backend")
+    parser.add_argument('--structured', action='store_true', help="Use structured extraction unless a request says otherwise")
+    parser.add_argument('--similar', action='store_true',
+                        help="Reuse the outputs of near-duplicate reports analyzed before (see similar_reports)")
+    parser.add_argument('--trace', default=None, help="Append trace spans as JSON lines to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    import pipeline_config
+
+    if args.ollama_concurrency:
+        backend_limits.set_limit('ollama', args.ollama_concurrency)
+    if args.openai_concurrency:
+        backend_limits.set_limit('openai', args.openai_concurrency)
+    if args.trace:
+        tracing.set_trace_path(args.trace)
+    if args.config:
+        pipeline_config.load_config(args.config)
+    if args.backend:
+        for stage in ('*',) + tuple(pipeline_config.STAGE_ROUTES):
+            pipeline_config.set_route(stage, args.backend)
+
+    similar = None
+    if args.similar:
+        import similar_reports
+        similar = similar_reports.SimilarReports()
+    service = PipelineService(concurrency=args.concurrency, queue_timeout=args.queue_timeout,
+                              structured=args.structured, similar=similar)
+    print("🔥 Warming up pipeline...")
+    started = time.perf_counter()
+    service.warm()
+    print(f"✅ Warm in {time.perf_counter() - started:.2f}s")
+    server = make_server(service, args.host, args.port)
+    print(f"🏥 Pipeline service on http://{args.host}:{server.server_port} "
+          f"({args.concurrency} concurrent pipelines)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n⏹️  Stopping")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
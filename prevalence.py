@@ -0,0 +1,108 @@
+"""
+Array-backed view of data.stats_data for vectorized prevalence lookups.
+
+data.stats_data stores asymptomatic prevalence as strings ('37%') keyed by
+decade strings. This module parses it once into a (conditions x decades)
+float array so cohort-sized batches of (age, condition) pairs are answered
+with a single indexed read instead of per-patient dict lookups.
+
+    >>> prevalence.lookup([34, 71], ['Disk bulge', 'Spondylolisthesis'])
+    array([0.4 , 0.35])
+"""
+
+from typing import Sequence, Union
+
+import numpy as np
+
+import data
+
+CONDITIONS = tuple(data.stats_data)
+DECADES = np.array(sorted(int(decade) for decade in next(iter(data.stats_data.values()))))
+
+# TABLE[condition_id, decade_index] is the prevalence as a fraction (0.37 for '37%')
+TABLE = np.array([
+    [float(data.stats_data[condition][str(decade)].rstrip('%')) / 100 for decade in DECADES]
+    for condition in CONDITIONS
+])
+TABLE.flags.writeable = False
+
+_CONDITION_IDS = {condition: index for index, condition in enumerate(CONDITIONS)}
+_DECADE_STEP = int(DECADES[1] - DECADES[0])
+
+Conditions = Union[str, int, Sequence[Union[str, int]], np.ndarray]
+
+
+def condition_ids(conditions: Conditions) -> np.ndarray:
+    """
+    Row indices into TABLE for condition names (ids are passed through).
+
+    Raises:
+        KeyError: For a name that is not in data.stats_data
+    """
+    values = np.asarray(conditions)
+    if values.dtype.kind in "iu":
+        return values.astype(np.intp)
+    ids = [_CONDITION_IDS[name] for name in values.ravel().tolist()]
+    return np.array(ids, dtype=np.intp).reshape(values.shape)
+
+
+def age_decade(ages) -> np.ndarray:
+    """Decade used for each age, clamped to the table's range (20s..80s)."""
+    ages = np.asarray(ages, dtype=float)
+    decades = np.floor(np.nan_to_num(ages) / _DECADE_STEP) * _DECADE_STEP
+    return np.clip(decades, DECADES[0], DECADES[-1]).astype(int)
+
+
+def lookup(ages, conditions: Conditions, interpolate: bool = False) -> np.ndarray:
+    """
+    Prevalence for each (age, condition) pair.
+
+    Args:
+        ages: Patient ages (scalar or array); NaN marks an unknown age
+        conditions: Condition names or TABLE row ids, broadcast against ages
+        interpolate: Interpolate linearly between decade values instead of
+            using the value of the age's decade
+
+    Returns:
+        Float array of fractions in the broadcast shape of ages and
+        conditions; NaN where the age is unknown. Ages outside the table are
+        clamped to the 20s/80s values.
+    """
+    ages = np.asarray(ages, dtype=float)
+    ids = condition_ids(conditions)
+    ages, ids = np.broadcast_arrays(ages, ids)
+    known = np.isfinite(ages)
+
+    position = (np.clip(np.where(known, ages, DECADES[0]), DECADES[0], DECADES[-1]) - DECADES[0]) / _DECADE_STEP
+    lower = np.floor(position).astype(np.intp)
+    if interpolate:
+        upper = np.minimum(lower + 1, len(DECADES) - 1)
+        fraction = position - lower
+        result = TABLE[ids, lower] * (1 - fraction) + TABLE[ids, upper] * fraction
+    else:
+        result = TABLE[ids, lower]
+    return np.where(known, result, np.nan)
+
+
+def percent(condition: str, age: float, interpolate: bool = False) -> str:
+    """Prevalence for one patient formatted like data.stats_data ('37%')."""
+    return f"{lookup(age, condition, interpolate) * 100:.0f}%"
+
+
+def age_table(ages, interpolate: bool = False) -> np.ndarray:
+    """Prevalence of every condition for each age, shape (len(ages), len(CONDITIONS))."""
+    ages = np.asarray(ages, dtype=float)
+    return lookup(ages[:, None], np.arange(len(CONDITIONS)), interpolate)
+
+
+if __name__ == "__main__":
+    import time
+
+    rng = np.random.default_rng(0)
+    cohort_ages = rng.uniform(15, 95, 100_000)
+    cohort_conditions = rng.integers(0, len(CONDITIONS), cohort_ages.size)
+
+    started = time.perf_counter()
+    values = lookup(cohort_ages, cohort_conditions, interpolate=True)
+    elapsed = time.perf_counter() - started
+    print(f"📊 {values.size} lookups in {elapsed * 1000:.1f} ms (mean prevalence {values.mean():.1%})")
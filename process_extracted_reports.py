@@ -3,11 +3,27 @@
 Process the extracted medical reports through the Medical AI Assistant
 """
 
+import argparse
 import re
-import models_ollama as models
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import diagnose_prompt
 import care_plan_prompt
-import stats_finder_ollama as stats_finder
+import stats_finder
+import structured_report
+import analysis_manifest
+import similar_reports
+import backends
+import pipeline_config
+import guideline_index
+import stage_graph
+import backend_limits
+import streaming
+import tracing
+
+# Extract structured findings once and prompt the other stages from them
+# (see structured_report) instead of from the raw report
+STRUCTURED_EXTRACTION = False
 
 PROVIDER_ASSISTANT_PROMPT = """
 Use the following information to help a provider write a portal message to a patient that helps them understand a recent radiology report and what options are available for care.
@@ -49,8 +65,27 @@ def extract_reports_from_markdown(filename="combined_reports.md"):
     
     return reports
 
-def process_single_report(report_data):
-    """Process a single report through the medical AI pipeline."""
+def process_single_report(report_data, stream_listener=None, completed=None, on_stage=None, structured=None,
+                          prompt_view=None):
+    """
+    Process a single report through the medical AI pipeline.
+    
+    Args:
+        report_data: Dict with 'title' and 'text'
+        stream_listener: Optional listener (e.g. streaming.StreamPrinter)
+            receiving each stage's tokens as they are generated
+        completed: Optional dict of stage name -> output of stages finished
+            in an earlier run; they are not run again
+        on_stage: Optional callable(stage, output) invoked as each stage
+            finishes, e.g. to checkpoint it
+        structured: Run the structured findings extraction first and build
+            the other stages from it; defaults to STRUCTURED_EXTRACTION
+        prompt_view: Optional callable(guidelines, findings) returning the
+            (report, context) pair the care plan and diagnosis prompts are
+            built from in structured mode (see patient_timeline)
+    """
+    completed = completed or {}
+    structured = STRUCTURED_EXTRACTION if structured is None else structured
     title = report_data['title']
     report_text = report_data['text']
     
@@ -78,41 +113,104 @@ def process_single_report(report_data):
     print(f"👤 Patient: Age {age}, {gender}")
     print()
     
-    try:
-        # Generate analysis components
+    def prompt_inputs(guidelines, findings):
+        # In structured mode stages see the compact findings and a smaller context
+        if findings is None:
+            return report_text, guideline_index.retrieve_context(guidelines, report_text)
+        if prompt_view is not None:
+            return prompt_view(guidelines, findings)
+        report = structured_report.render_findings(findings)
+        context = guideline_index.retrieve_context(guidelines, report,
+                                                   token_budget=structured_report.CONTEXT_TOKEN_BUDGET)
+        return report, context
+    
+    def findings_stage(on_token):
+        print("🧾 Extracting structured findings...")
+        return structured_report.extract_findings(report_text)
+    
+    def care_plan_stage(on_token, findings=None):
         print("📋 Generating evidence-based care plan...")
-        with open('acp_guidelines.md', 'r') as f:
-            context = f.read()
-        care_plan = models.call_openai(
-            care_plan_prompt.CARE_PLAN_PROMPT.format(context=context, report=report_text)
-        ).choices[0].message.content
-        
+        report, context = prompt_inputs(guideline_index.CARE_PLAN_GUIDELINES, findings)
+        return backends.complete_stage(
+            'care_plan',
+            care_plan_prompt.CARE_PLAN_PROMPT.format(context=context, report=report),
+            on_token=on_token
+        )
+    
+    def diagnosis_stage(on_token, findings=None):
         print("🏥 Generating patient-friendly diagnosis summary...")
-        with open('ajnr.md', 'r') as f:
-            context = f.read()
-        diagnosis = models.call_openai(
-            diagnose_prompt.DIAGNOSE_PROMPT.format(context=context, report=report_text)
-        ).choices[0].message.content
-        
+        report, context = prompt_inputs(guideline_index.DIAGNOSIS_GUIDELINES, findings)
+        return backends.complete_stage(
+            'diagnosis',
+            diagnose_prompt.DIAGNOSE_PROMPT.format(context=context, report=report),
+            on_token=on_token
+        )
+    
+    def stats_stage(on_token, findings=None):
         print("📊 Finding age-relevant statistics...")
-        stats = stats_finder.stat_finder(report_text)
-        
+        if findings is not None:
+            return structured_report.describe_statistics(findings)
+        return stats_finder.stat_finder(report_text)
+    
+    def provider_message_stage(on_token, care_plan, diagnosis):
         print("🤖 Generating provider communication message...")
-        provider_message = models.call_openai(
-            PROVIDER_ASSISTANT_PROMPT.format(diagnosis=diagnosis, care_plan=care_plan)
-        ).choices[0].message.content
-        
-        return {
-            'title': title,
-            'care_plan': care_plan,
-            'diagnosis': diagnosis,
-            'stats': stats,
-            'provider_message': provider_message
-        }
+        return backends.complete_stage(
+            'provider_message',
+            PROVIDER_ASSISTANT_PROMPT.format(diagnosis=diagnosis, care_plan=care_plan),
+            on_token=on_token
+        )
+    
+    # Stages stream through StageTimers to record time to first token and total latency
+    timers = {}
+    
+    def timed(name, fn):
+        if name in completed:
+            return lambda **inputs: completed[name]
+        stage = streaming.timed_stage(name, fn, timers, stream_listener)
+        if on_stage is None:
+            return stage
         
+        def run(**inputs):
+            output = stage(**inputs)
+            on_stage(name, output)
+            return output
+        return run
+    
+    if completed:
+        print(f"♻️  Resuming, already done: {', '.join(completed)}")
+    try:
+        with tracing.span('report', kind='pipeline', report=title):
+            # Care plan, diagnosis and stats are independent (apart from the
+            # structured findings they share in structured mode); the provider
+            # message starts as soon as care plan and diagnosis are ready.
+            deps = ('findings',) if structured else ()
+            stages = [stage_graph.Stage('findings', timed('findings', findings_stage))] if structured else []
+            outputs = stage_graph.run_stages(stages + [
+                stage_graph.Stage('care_plan', timed('care_plan', care_plan_stage), deps=deps),
+                stage_graph.Stage('diagnosis', timed('diagnosis', diagnosis_stage), deps=deps),
+                stage_graph.Stage('stats', timed('stats', stats_stage), deps=deps),
+                stage_graph.Stage('provider_message', timed('provider_message', provider_message_stage),
+                                  deps=('care_plan', 'diagnosis')),
+            ])
     except Exception as e:
         print(f"❌ Error processing {title}: {e}")
         return None
+    
+    return build_result(title, outputs, {name: timer.as_dict() for name, timer in timers.items()})
+
+def build_result(title, outputs, timings=None):
+    """Result dict of a report from its stage outputs."""
+    result = {
+        'title': title,
+        'care_plan': outputs['care_plan'],
+        'diagnosis': outputs['diagnosis'],
+        'stats': outputs['stats'],
+        'provider_message': outputs['provider_message'],
+        'timings': timings or {},
+    }
+    if 'findings' in outputs:
+        result['findings'] = outputs['findings']
+    return result
 
 def display_results(results):
     """Display the analysis results."""
@@ -143,72 +241,280 @@ def display_results(results):
         print("💌 PROVIDER COMMUNICATION MESSAGE")
         print(f"{'='*60}")
         print(result['provider_message'])
+        
+        if result.get('timings'):
+            print(f"\n⏱️  Stage timings: " + ", ".join(
+                f"{name} {t['ttft_s'] or 0:.2f}s to first token / {t['total_s']:.2f}s total"
+                for name, t in result['timings'].items()
+            ))
 
-def save_results_to_file(results):
+def analysis_header(structured=None):
+    """
+    Analysis file header naming the backend, model and generation settings of
+    each stage; structured overrides STRUCTURED_EXTRACTION like in
+    process_single_report.
+    """
+    structured = STRUCTURED_EXTRACTION if structured is None else structured
+    stages = {stage: backends.describe_stage(stage) for stage in ('findings', 'diagnosis', 'care_plan', 'stats',
+                                                                  'provider_message')}
+    if not structured:
+        del stages['findings']
+    if structured or stats_finder.USE_LOCAL_MATCHER:
+        stages['stats'] = "local condition matcher"
+    lines = "".join(f"- {stage}: {description}\n" for stage, description in stages.items())
+    return f"# Comprehensive Medical AI Analysis\n\nGenerated using:\n{lines}\n"
+
+def format_result_section(index, result):
+    """Render one report's analysis as a markdown section."""
+    return (
+        f"## Report {index}: {result['title']}\n\n"
+        "### Care Plan\n"
+        f"{result['care_plan']}\n\n"
+        "### Patient-Friendly Diagnosis\n"
+        f"{result['diagnosis']}\n\n"
+        "### Age-Relevant Statistics\n"
+        f"{result['stats']}\n\n"
+        "### Provider Communication Message\n"
+        f"{result['provider_message']}\n\n---\n\n"
+    )
+
+def save_results_to_file(results, filename='comprehensive_analysis.md', structured=None):
     """Save results to a comprehensive analysis file."""
-    with open('comprehensive_analysis.md', 'w') as f:
-        f.write("# Comprehensive Medical AI Analysis\n\n")
-        f.write(f"Generated using Llama 3.1 8B model\n\n")
+    with open(filename, 'w') as f:
+        f.write(analysis_header(structured))
         
         for i, result in enumerate(results, 1):
             if result is None:
                 continue
-                
-            f.write(f"## Report {i}: {result['title']}\n\n")
-            
-            f.write("### Care Plan\n")
-            f.write(result['care_plan'])
-            f.write("\n\n")
-            
-            f.write("### Patient-Friendly Diagnosis\n")
-            f.write(result['diagnosis'])
-            f.write("\n\n")
-            
-            f.write("### Age-Relevant Statistics\n")
-            f.write(result['stats'])
-            f.write("\n\n")
-            
-            f.write("### Provider Communication Message\n")
-            f.write(result['provider_message'])
-            f.write("\n\n---\n\n")
+            f.write(format_result_section(i, result))
 
-def main():
+class MarkdownResultSink:
+    """
+    Streams per-report sections to the analysis file as reports finish.
+    
+    Sections are appended in completion order so partial progress is on disk
+    during long batches; finalize() rewrites the file in input order.
+    """
+    
+    def __init__(self, filename='comprehensive_analysis.md', structured=None):
+        self.filename = filename
+        self.structured = structured
+        self._lock = threading.Lock()
+        with open(self.filename, 'w') as f:
+            f.write(analysis_header(structured))
+    
+    def __call__(self, index, result):
+        if result is None:
+            return
+        with self._lock:
+            with open(self.filename, 'a') as f:
+                f.write(format_result_section(index, result))
+    
+    def finalize(self, results):
+        with self._lock:
+            save_results_to_file(results, self.filename, self.structured)
+
+def process_incremental(report, manifest, fingerprints):
+    """
+    Process a report, reusing the stage outputs stored in an
+    analysis_manifest.AnalysisManifest whose fingerprints still match.
+    """
+    key = analysis_manifest.text_hash(report['text'])
+    completed = manifest.completed(key, fingerprints)
+    if all(stage in completed for stage in fingerprints):
+        return build_result(report['title'], completed)
+    
+    def record(stage, output):
+        manifest.record(key, report['title'], stage, fingerprints[stage], output)
+    
+    result = process_single_report(report, completed=completed, on_stage=record,
+                                   structured='findings' in fingerprints)
+    manifest.save()
+    return result
+
+def process_similar(report, similar, config, process):
+    """
+    Reuse the personalized outputs of a near-duplicate report stored in a
+    similar_reports.SimilarReports, else run process(report) and store the
+    outputs it produced.
+    """
+    match = similar.lookup(report['text'], config)
+    if match is not None:
+        print(f"♻️  {report['title']}: {match['similarity']:.0%} similar to {match['title']}, reusing its assessment")
+        result = build_result(report['title'], match['outputs'])
+        result['reused_from'] = {'title': match['title'], 'similarity': round(match['similarity'], 3)}
+        return result
+    result = process(report)
+    if result is not None:
+        similar.store(report['text'], report['title'], config, result)
+    return result
+
+def similar_config(structured):
+    """similar_reports config key of the current prompts and routes."""
+    return similar_reports.config_key(analysis_manifest.stage_fingerprints(PROVIDER_ASSISTANT_PROMPT, structured))
+
+def process_reports_batch(reports, max_workers=4, sink=None, manifest=None, similar=None):
+    """
+    Process reports on a bounded worker pool.
+    
+    Args:
+        reports: Report dicts as returned by extract_reports_from_markdown
+        max_workers: Number of reports processed concurrently; backend calls
+            are further bounded by backend_limits
+        sink: Optional callable(index, result) invoked as each report finishes
+        manifest: Optional analysis_manifest.AnalysisManifest; only stages
+            whose inputs, prompt or route changed since it was written are run
+        similar: Optional similar_reports.SimilarReports; reports close
+            enough to one processed before reuse its outputs
+        
+    Returns:
+        List of results in input order; failed reports are None
+    """
+    results = [None] * len(reports)
+    if manifest is not None:
+        fingerprints = analysis_manifest.stage_fingerprints(PROVIDER_ASSISTANT_PROMPT, STRUCTURED_EXTRACTION)
+    if similar is not None:
+        config = similar_config(STRUCTURED_EXTRACTION)
+    
+    def process(report):
+        if manifest is not None:
+            return process_incremental(report, manifest, fingerprints)
+        return process_single_report(report)
+    
+    def run(report):
+        try:
+            if similar is not None:
+                return process_similar(report, similar, config, process)
+            return process(report)
+        except Exception as e:
+            print(f"❌ Error processing {report.get('title', 'report')}: {e}")
+            return None
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run, report): i for i, report in enumerate(reports)}
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            if sink is not None:
+                try:
+                    sink(i + 1, results[i])
+                except Exception as e:
+                    print(f"⚠️ Failed to write result for report {i + 1}: {e}")
+    
+    return results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Process extracted reports through the Medical AI Assistant")
+    parser.add_argument('--input', default='combined_reports.md', help="Combined reports markdown file")
+    parser.add_argument('--output', default='comprehensive_analysis.md', help="Analysis markdown file")
+    parser.add_argument('--workers', type=int, default=4, help="Reports processed concurrently")
+    parser.add_argument('--ollama-concurrency', type=int, default=None, help="Pin in-flight Ollama requests (default: adaptive, see backend_limits)")
+    parser.add_argument('--openai-concurrency', type=int, default=None, help="Max in-flight OpenAI requests")
+    parser.add_argument('--config', default=None, help="JSON file of per-stage backend routes (see pipeline_config)")
+    parser.add_argument('--backend', default=None, choices=backends.available_backends() + ('ollama',),
+                        help="Send every stage to this backend")
+    parser.add_argument('--structured', action='store_true',
+                        help="Extract structured findings first and prompt the other stages from them")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--incremental', action='store_true',
+                      help="Only rerun reports and stages whose text, prompt or route changed (see analysis_manifest)")
+    mode.add_argument('--timeline', action='store_true',
+                      help="Process each patient's studies in date order, prompting follow-ups with the changes only (see patient_timeline)")
+    parser.add_argument('--similar', action='store_true',
+                        help="Reuse the outputs of near-duplicate reports processed before (see similar_reports)")
+    parser.add_argument('--similarity-threshold', type=float, default=similar_reports.SIMILARITY_THRESHOLD,
+                        help="Estimated shingle similarity at which --similar reuses outputs")
+    parser.add_argument('--quiet', action='store_true', help="Don't print full results at the end")
+    parser.add_argument('--trace', default=None, help="Append stage/backend spans to this JSON lines file")
+    parser.add_argument('--metrics', default=None, help="Write Prometheus-style metrics to this file when done")
+    parser.add_argument('--metrics-port', type=int, default=None, help="Serve Prometheus metrics on this port")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    global STRUCTURED_EXTRACTION
+    args = parse_args(argv)
+    if args.similar and args.timeline:
+        raise SystemExit("--similar does not apply to --timeline runs")
+    if args.ollama_concurrency:
+        backend_limits.set_limit('ollama', args.ollama_concurrency)
+    if args.openai_concurrency:
+        backend_limits.set_limit('openai', args.openai_concurrency)
+    if args.trace:
+        tracing.set_trace_path(args.trace)
+    if args.metrics_port:
+        tracing.serve_metrics(args.metrics_port)
+    if args.config:
+        pipeline_config.load_config(args.config)
+    if args.structured:
+        STRUCTURED_EXTRACTION = True
+    if args.backend:
+        for stage in ('*',) + tuple(pipeline_config.STAGE_ROUTES):
+            pipeline_config.set_route(stage, args.backend)
+    
     print("🏥 MEDICAL AI ASSISTANT - PROCESSING EXTRACTED REPORTS")
     print("=" * 60)
-    print(f"🤖 Using model: {models.DEFAULT_MODEL}")
+    for stage in pipeline_config.STAGE_ROUTES:
+        print(f"🤖 {stage}: {backends.describe_stage(stage)}")
+    print(f"⚙️  Workers: {args.workers}, backend limits: {backend_limits.describe_limits()}")
+    backends.warm_routes()
     print()
     
     # Extract reports from the combined markdown file
     print("📄 Loading extracted reports...")
-    reports = extract_reports_from_markdown()
+    reports = extract_reports_from_markdown(args.input)
     
     print(f"✅ Found {len(reports)} reports to process:")
     for i, report in enumerate(reports, 1):
         print(f"  {i}. {report['title']}")
     print()
     
-    # Process each report
-    results = []
-    for report in reports:
-        result = process_single_report(report)
-        results.append(result)
-    
-    # Display results
-    print(f"\n{'='*80}")
-    print("📊 PROCESSING COMPLETE - DISPLAYING RESULTS")
-    print(f"{'='*80}")
+    # Process reports, streaming each finished section to the output file
+    # Timelines always run the structured pipeline (see patient_timeline)
+    sink = MarkdownResultSink(args.output, structured=True if args.timeline else None)
+    manifest = None
+    if args.incremental:
+        manifest = analysis_manifest.AnalysisManifest(analysis_manifest.manifest_path_for(args.output))
+        print(f"♻️  Incremental: {len(manifest.reports)} reports in {manifest.path}")
+    similar = None
+    if args.similar:
+        similar = similar_reports.SimilarReports(threshold=args.similarity_threshold)
+        print(f"🧬 Near-duplicates: {similar.stats()['entries']} reports in {similar.path}, "
+              f"threshold {similar.threshold}")
+    if args.timeline:
+        import patient_timeline
+        results = patient_timeline.process_timeline(reports, max_workers=args.workers, sink=sink)
+    else:
+        results = process_reports_batch(reports, max_workers=args.workers, sink=sink, manifest=manifest,
+                                        similar=similar)
+    if manifest is not None:
+        removed = manifest.prune(analysis_manifest.text_hash(report['text']) for report in reports)
+        manifest.save()
+        if removed:
+            print(f"🧹 Dropped {removed} reports no longer in {args.input} from the manifest")
     
-    display_results(results)
+    if not args.quiet:
+        # Display results
+        print(f"\n{'='*80}")
+        print("📊 PROCESSING COMPLETE - DISPLAYING RESULTS")
+        print(f"{'='*80}")
+        
+        display_results(results)
     
-    # Save to file
-    save_results_to_file(results)
+    # Rewrite the file in input order
+    sink.finalize(results)
     
     successful_analyses = len([r for r in results if r is not None])
     print(f"\n{'='*80}")
     print("✅ ANALYSIS COMPLETE!")
     print(f"{'='*80}")
     print(f"📊 Successfully analyzed {successful_analyses}/{len(reports)} reports")
-    print(f"💾 Comprehensive analysis saved to: comprehensive_analysis.md")
+    print(f"💾 Comprehensive analysis saved to: {args.output}")
+    if similar is not None:
+        print(f"🧬 Reused {similar.hits} near-duplicate assessments ({similar.stats()['entries']} reports indexed)")
+    print(f"⚙️  Backend limits at the end: {backend_limits.describe_limits()}")
+    if args.metrics:
+        tracing.write_prometheus(args.metrics)
+        print(f"📈 Metrics written to: {args.metrics}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,98 @@
+"""
+Regex helpers for pulling header fields (dates, age, sex) out of radiology reports.
+
+Handles the layouts seen in test_reports.py (markdown header tables) and
+combined_reports.md (label: value lines and pdfplumber label/value rows).
+"""
+
+import re
+from datetime import date
+from typing import Optional
+
+_DATE_RE = re.compile(r"\b(?:(\d{4})-(\d{1,2})-(\d{1,2})|(\d{1,2})/(\d{1,2})/(\d{4}))\b")
+_DOB_LABEL_RE = re.compile(r"date of birth|\bDOB\b", re.IGNORECASE)
+_STUDY_LABEL_RE = re.compile(r"exam date|study date|date of study|date of exam|date of service", re.IGNORECASE)
+_AGE_RE = re.compile(r"\bAge:?\s*\|?\s*(\d{1,3})\b", re.IGNORECASE)
+_NAME_LABEL_RE = re.compile(r"^\|?\s*(?:(?:patient\s+)?name\b|patient:)", re.IGNORECASE | re.MULTILINE)
+_NAME_RE = re.compile(r"([A-Za-z][A-Za-z'\-]*),\s*([A-Za-z][A-Za-z'\-]*)")
+_AGE_SEX_RE = re.compile(r"Age\s+Sex\n.*?\s+(\d+)\s+(Male|Female)")
+_SEX_RE = re.compile(r"\b(?:Sex|Gender):?\s*\|?\s*(Male|Female|M|F)\b", re.IGNORECASE)
+
+# How far after a label to look for its value (values may sit on the next line)
+_LABEL_WINDOW = 80
+
+
+def parse_date(text: str) -> Optional[date]:
+    """Parse the first YYYY-MM-DD or M/D/YYYY date in text."""
+    match = _DATE_RE.search(text)
+    if not match:
+        return None
+    try:
+        if match.group(1):
+            return date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        return date(int(match.group(6)), int(match.group(4)), int(match.group(5)))
+    except ValueError:
+        return None
+
+
+def _labelled_date(report: str, label_re) -> Optional[date]:
+    for match in label_re.finditer(report):
+        value = parse_date(report[match.end():match.end() + _LABEL_WINDOW])
+        if value is not None:
+            return value
+    return None
+
+
+def birth_date(report: str) -> Optional[date]:
+    """Patient date of birth from the report header, if present."""
+    return _labelled_date(report, _DOB_LABEL_RE)
+
+
+def study_date(report: str) -> Optional[date]:
+    """Exam/study date from the report header, if present."""
+    return _labelled_date(report, _STUDY_LABEL_RE)
+
+
+def patient_name(report: str) -> Optional[str]:
+    """Patient name ("Last, First", title-cased) from the report header, if present."""
+    for match in _NAME_LABEL_RE.finditer(report):
+        value = _NAME_RE.search(report, match.end(), match.end() + _LABEL_WINDOW)
+        if value:
+            return f"{value.group(1).title()}, {value.group(2).title()}"
+    return None
+
+
+def patient_sex(report: str) -> Optional[str]:
+    """Patient sex ('male' or 'female') from the report header, if present."""
+    match = _AGE_SEX_RE.search(report)
+    if match:
+        return match.group(2).lower()
+    match = _SEX_RE.search(report)
+    if match:
+        return 'male' if match.group(1).lower() in ('m', 'male') else 'female'
+    return None
+
+
+def patient_age(report: str, today: Optional[date] = None) -> Optional[int]:
+    """
+    Patient age at the time of the study.
+
+    Uses an explicit "Age" field when present, otherwise the date of birth and
+    the study date (or today when the report has no study date).
+
+    Args:
+        report: Radiology report text
+        today: Fallback reference date, defaults to date.today()
+
+    Returns:
+        Age in whole years, or None if it can't be determined
+    """
+    match = _AGE_RE.search(report) or _AGE_SEX_RE.search(report)
+    if match:
+        return int(match.group(1))
+
+    born = birth_date(report)
+    if born is None:
+        return None
+    on = study_date(report) or today or date.today()
+    return on.year - born.year - ((on.month, on.day) < (born.month, born.day))
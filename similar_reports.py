@@ -0,0 +1,456 @@
+"""
+Near-duplicate cache of pipeline outputs for templated reports.
+
+Radiology reports are heavily templated: two "mild degenerative disc disease
+at L5-S1" studies often differ only in the patient header, dates and IDs, so
+the exact-text caches (llm_cache, analysis_manifest) miss them. This cache
+normalizes a report to its findings/impression text (header fields, dates,
+times, image references and long IDs stripped, see normalize_report), splits
+it into word SHINGLE_SIZE-grams and stores a MinHash signature of the
+shingles next to the report's stage outputs.
+
+Candidates are found through a banded LSH index (one indexed SQLite row per
+band and report), so a lookup costs one index probe per band however many
+reports are stored, and are ranked by the Jaccard similarity their
+signatures estimate. A report within SIMILARITY_THRESHOLD of a stored one
+reuses its outputs, after personalize() swaps in the new patient's age and
+name, provided both come from patients of the same sex and age decade (the
+age group the statistics are taken from), were processed under the same
+prompts, routes and mode, and mention exactly the same clinical terms in the
+same order (severity grades, negations, sides, spinal levels, measurements
+and condition nouns, see clinical_terms): "mild" turning into "moderate", or
+the severe and mild grades of two levels trading places, changes only a few
+shingles but must never reuse the other assessment.
+
+    python process_extracted_reports.py --similar
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import report_fields
+import tracing
+
+SIMILAR_REPORTS_PATH = os.getenv("SIMILAR_REPORTS_PATH", ".similar_reports.sqlite3")
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILAR_REPORTS_THRESHOLD", "0.9"))  # Estimated Jaccard of the shingles
+NUM_PERM = 128  # MinHash signature length
+SHINGLE_SIZE = 3  # Words per shingle
+LSH_RECALL = 0.99  # Chance a pair at the threshold shares at least one band
+MAX_CANDIDATES = 50  # Candidates (most shared bands first) whose signatures are compared
+MINHASH_SEED = 1
+
+# Stage outputs stored per report
+STAGES = ('findings', 'care_plan', 'diagnosis', 'stats', 'provider_message')
+
+_PRIME = 4294967311  # Smallest prime above 2**32
+_HEADER_LABELS = (
+    r"patient(?: name| id)?", r"name", r"date of birth", r"dob", r"mrn", r"medical record(?: number| no\.?)?",
+    r"accession(?: number| no\.?)?", r"referring(?: physician| provider)?", r"ordering(?: physician| provider)?",
+    r"exam date", r"study date", r"date of (?:exam|study|service)", r"age", r"sex", r"gender",
+    r"(?:electronically )?signed(?: by)?", r"dictated(?: by)?", r"transcribed(?: by)?", r"radiologist",
+)
+_HEADER_LINE_RE = re.compile(rf"^[\s|#*]*(?:{'|'.join(_HEADER_LABELS)})\s*[:|].*$", re.IGNORECASE | re.MULTILINE)
+_NOISE_RES = (
+    re.compile(r"\b\d{1,4}[/-]\d{1,2}[/-]\d{1,4}\b"),  # 1/4/1977, 2024-01-01
+    re.compile(r"\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{1,2},?\s+\d{4}\b",
+               re.IGNORECASE),
+    re.compile(r"\b\d{1,2}:\d{2}(?::\d{2})?\s*(?:[ap]\.?m\.?)?", re.IGNORECASE),
+    re.compile(r"\b(?:series|image|img|se|im)\s*#?\s*\d+\b", re.IGNORECASE),
+    re.compile(r"\b\d{5,}\b"),  # Patient IDs, accession numbers
+)
+# Normalized tokens that change the assessment when they differ or move:
+# severities (also "mild-to-moderate"), negations, sides, spinal levels
+# (l5-s1, c5), numbers (measurements, list items) and condition nouns
+_SEVERITY_TERM = r"(?:minimal|mild|moderate|severe|marked)"
+_CLINICAL_TERM_RE = re.compile(
+    rf"^(?:{_SEVERITY_TERM}(?:(?:-to-|-|/){_SEVERITY_TERM})*|small|large|tiny|advanced|early|significant|"
+    r"no|not|without|normal|abnormal|acute|chronic|new|left|right|bilateral|central|foraminal|"
+    r"[ctls]\d{1,2}(?:-[ctls]?\d{1,2})?|\d+(?:\.\d+)?|"
+    r"stenosis|bulg(?:e|es|ing)|protrusions?|herniations?|herniated|extrusions?|fractures?|compression|"
+    r"(?:spondylo|antero|retro)listhesis|degeneration|degenerative|desiccation|fissures?|tears?|"
+    r"arthropathy|arthrosis|hypertrophy|edema|cord|myelopathy|impingement|narrowing|osteophytes?|"
+    r"effusions?|cysts?|mass|lesions?|enhancement|equina)$")
+_CLINICAL_TERMS_VERSION = 2  # Part of the stored layout: changing the gate clears the index
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-/.][a-z0-9]+)*")
+_TITLE_RE = r"\b(?:Mr|Mrs|Ms|Miss|Dr)\.?\s+"
+_AGE_MENTION_RE = r"\b{age}(?=\s*-?\s*(?:years?|yrs?|y/?o)\b)"
+_AGE_LABEL_RE = r"(\bage[ds]?\s*:?\s*){age}\b"
+
+_permutations = None
+_permutations_lock = threading.Lock()
+
+
+def normalize_report(text: str) -> str:
+    """
+    Template-comparable form of a report: its findings and impression
+    without header fields, signatures, dates, times, image references and
+    IDs, lowercased.
+    """
+    match = re.search(r"\bFINDINGS\b", text, flags=re.IGNORECASE)
+    if match:
+        text = text[match.start():]
+    text = _HEADER_LINE_RE.sub(" ", text)
+    for noise_re in _NOISE_RES:
+        text = noise_re.sub(" ", text)
+    return " ".join(_TOKEN_RE.findall(text.lower()))
+
+
+def clinical_terms(normalized: str) -> str:
+    """
+    Digest of the clinical terms of a normalized report in the order they
+    appear, which near-duplicates must share. Order keeps each grade tied
+    to its level and condition: "severe ... L3-L4 and mild ... L4-L5" and
+    the same sentence with the grades swapped digest differently.
+    """
+    terms = [token for token in normalized.split() if _CLINICAL_TERM_RE.match(token)]
+    return hashlib.sha256(" ".join(terms).encode('utf-8')).hexdigest()[:16]
+
+
+def shingles(normalized: str, size: int = SHINGLE_SIZE) -> List[int]:
+    """32-bit hashes of the distinct word size-grams of a normalized report."""
+    words = normalized.split()
+    if len(words) <= size:
+        grams = {" ".join(words)} if words else set()
+    else:
+        grams = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return sorted(zlib.crc32(gram.encode('utf-8')) for gram in grams)
+
+
+def _minhash_permutations():
+    global _permutations
+    import numpy as np  # Only loaded once the cache is used
+
+    with _permutations_lock:
+        if _permutations is None:
+            rng = np.random.default_rng(MINHASH_SEED)
+            # a < 2**31 and hashes < 2**32 keep a * hash + b inside uint64
+            a = rng.integers(1, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+            b = rng.integers(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+            _permutations = (a, b)
+        return _permutations
+
+
+def minhash(hashes: List[int]):
+    """
+    MinHash signature of a shingle hash set.
+
+    Returns:
+        uint32 array of NUM_PERM minimums over the hash permutations
+        (a * h + b) mod _PRIME
+    """
+    import numpy as np
+
+    a, b = _minhash_permutations()
+    values = np.asarray(hashes, dtype=np.uint64)[:, None]
+    permuted = (values * a + b) % np.uint64(_PRIME)
+    return (permuted.min(axis=0) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+
+def lsh_layout(threshold: float, num_perm: int = NUM_PERM) -> Tuple[int, int]:
+    """
+    LSH bands for a similarity threshold.
+
+    Picks the longest bands (fewest unrelated candidates) for which a pair
+    at the threshold still shares a band with probability LSH_RECALL.
+
+    Returns:
+        (bands, rows per band)
+    """
+    for rows in sorted((r for r in range(1, num_perm + 1) if num_perm % r == 0), reverse=True):
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= LSH_RECALL:
+            return bands, rows
+    return num_perm, 1
+
+
+def _buckets(signature, rows: int, profile: str) -> List[int]:
+    # Bucket id of each band: profile, band index and values hashed to a
+    # signed 64-bit int, so only reports that may stand in for each other collide
+    data = signature.tobytes()
+    width = rows * signature.itemsize
+    salt = profile.encode('utf-8')
+    return [int.from_bytes(hashlib.blake2b(band.to_bytes(2, 'big') + data[start:start + width],
+                                           digest_size=8, key=salt[:64]).digest(), 'big', signed=True)
+            for band, start in enumerate(range(0, len(data), width))]
+
+
+def patient_fields(text: str) -> Dict[str, Any]:
+    """Header fields a reused output is personalized with."""
+    return {'age': report_fields.patient_age(text), 'sex': report_fields.patient_sex(text),
+            'name': report_fields.patient_name(text)}
+
+
+def _age_group(age: Optional[int]) -> str:
+    if age is None:
+        return '-'
+    import prevalence
+    return str(int(prevalence.age_decade(age)))
+
+
+def _name_forms(name: str) -> Tuple[str, str, str]:
+    last, _, first = name.partition(", ")
+    return f"{first} {last}".strip(), last, first
+
+
+def _replacements(source: Dict[str, Any], target: Dict[str, Any]) -> List[Tuple[re.Pattern, str]]:
+    replacements = []
+    if source.get('age') is not None and target.get('age') is not None and source['age'] != target['age']:
+        replacements.append((re.compile(_AGE_MENTION_RE.format(age=source['age'])), str(target['age'])))
+        replacements.append((re.compile(_AGE_LABEL_RE.format(age=source['age']), re.IGNORECASE),
+                             rf"\g<1>{target['age']}"))
+    if source.get('name') and source['name'] != target.get('name'):
+        old_full, old_last, old_first = _name_forms(source['name'])
+        titled = re.compile(rf"({_TITLE_RE}){re.escape(old_last)}\b", re.IGNORECASE)
+        if target.get('name'):
+            new_full, new_last, new_first = _name_forms(target['name'])
+            names = [(source['name'], target['name']), (old_full, new_full)]
+            titled_name = rf"\g<1>{new_last}"
+            names_after = [(old_last, new_last), (old_first, new_first)]
+        else:
+            names = [(source['name'], "the patient"), (old_full, "the patient")]
+            titled_name = "the patient"
+            names_after = []
+        # Full names first, then "Ms. Last", then the bare first and last names
+        replacements.extend((re.compile(rf"\b{re.escape(old)}\b", re.IGNORECASE), new) for old, new in names)
+        replacements.append((titled, titled_name))
+        replacements.extend((re.compile(rf"\b{re.escape(old)}\b", re.IGNORECASE), new) for old, new in names_after)
+    return replacements
+
+
+def personalize(outputs: Dict[str, Any], source: Dict[str, Any], target: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Stage outputs of a near-duplicate report rewritten for another patient.
+
+    Mentions of the source patient's age ("52-year-old", "Age: 52") and name
+    are replaced with the target's. Structured findings take the target's
+    age and their statistics are recomputed from them.
+
+    Args:
+        outputs: Stage outputs of the stored report
+        source: patient_fields of the stored report
+        target: patient_fields of the new report
+    """
+    replacements = _replacements(source, target)
+
+    def rewrite(text: str) -> str:
+        for pattern, replacement in replacements:
+            text = pattern.sub(replacement, text)
+        return text
+
+    personalized = {stage: rewrite(output) if isinstance(output, str) else output
+                    for stage, output in outputs.items()}
+    if isinstance(outputs.get('findings'), dict):
+        import structured_report
+        findings = dict(outputs['findings'], age=target.get('age'))
+        if target.get('sex'):
+            findings['sex'] = target['sex']
+        personalized['findings'] = findings
+        personalized['stats'] = structured_report.describe_statistics(findings)
+    return personalized
+
+
+class SimilarReports:
+    """SQLite-backed MinHash/LSH index of processed reports and their stage outputs."""
+
+    def __init__(self, path: str = SIMILAR_REPORTS_PATH, threshold: float = SIMILARITY_THRESHOLD):
+        """
+        Args:
+            path: SQLite file of the index
+            threshold: Estimated Jaccard similarity of the normalized reports'
+                shingles at or above which outputs are reused
+        """
+        if not 0 < threshold <= 1:
+            raise ValueError(f"Similarity threshold must be in (0, 1], got {threshold}")
+        self.path = path
+        self.threshold = threshold
+        self.bands, self.rows = lsh_layout(threshold)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS reports (
+                id INTEGER PRIMARY KEY,
+                text_hash TEXT NOT NULL,
+                profile TEXT NOT NULL,
+                title TEXT NOT NULL,
+                patient TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                outputs TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                UNIQUE (text_hash, profile)
+            )
+        """)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS bands (bucket INTEGER NOT NULL, report_id INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bands_bucket ON bands (bucket)")
+        self._check_layout()
+
+    def _check_layout(self) -> None:
+        # Signatures depend on the MinHash parameters and profiles on the
+        # clinical terms gate; bands also on the threshold
+        minhash_params = json.dumps([NUM_PERM, SHINGLE_SIZE, MINHASH_SEED, _CLINICAL_TERMS_VERSION])
+        stored = dict(self._conn.execute("SELECT key, value FROM meta"))
+        with self._lock:
+            if stored.get('minhash', minhash_params) != minhash_params:
+                print(f"⚠️ {self.path} was built with other MinHash or clinical terms parameters, clearing it")
+                self._conn.execute("DELETE FROM reports")
+                self._conn.execute("DELETE FROM bands")
+            elif stored.get('rows', str(self.rows)) != str(self.rows):
+                self._rebuild_bands()
+            self._conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                   [('minhash', minhash_params), ('rows', str(self.rows))])
+
+    def _rebuild_bands(self) -> None:
+        import numpy as np
+
+        self._conn.execute("BEGIN")
+        self._conn.execute("DELETE FROM bands")
+        for report_id, profile, signature in self._conn.execute(
+                "SELECT id, profile, signature FROM reports").fetchall():
+            buckets = _buckets(np.frombuffer(signature, dtype=np.uint32), self.rows, profile)
+            self._conn.executemany("INSERT INTO bands VALUES (?, ?)", [(bucket, report_id) for bucket in buckets])
+        self._conn.execute("COMMIT")
+
+    @staticmethod
+    def profile(config: str, patient: Dict[str, Any], terms: str) -> str:
+        """
+        Reports whose outputs can stand in for each other: same pipeline
+        config, sex, age decade and clinical terms.
+        """
+        return f"{config}:{patient.get('sex') or '-'}:{_age_group(patient.get('age'))}:{terms}"
+
+    def lookup(self, text: str, config: str) -> Optional[Dict[str, Any]]:
+        """
+        Outputs of the most similar stored report, personalized for this one.
+
+        Args:
+            text: Report text
+            config: Fingerprint of the prompts, routes and mode the outputs
+                must have been produced under (see config_key)
+
+        Returns:
+            Dict of 'title' and 'similarity' of the stored report and the
+            personalized stage 'outputs', or None below the threshold
+        """
+        import numpy as np
+
+        with tracing.span('lookup', kind='similarity') as span:
+            normalized = normalize_report(text)
+            hashes = shingles(normalized)
+            patient = patient_fields(text)
+            profile = self.profile(config, patient, clinical_terms(normalized))
+            best = None
+            if hashes:
+                signature = minhash(hashes)
+                buckets = _buckets(signature, self.rows, profile)
+                with self._lock:
+                    ids = [row[0] for row in self._conn.execute(
+                        f"SELECT report_id FROM bands WHERE bucket IN ({','.join('?' * len(buckets))}) "
+                        "GROUP BY report_id ORDER BY COUNT(*) DESC LIMIT ?", (*buckets, MAX_CANDIDATES))]
+                    rows = self._conn.execute(
+                        f"SELECT title, patient, signature, outputs FROM reports "
+                        f"WHERE id IN ({','.join('?' * len(ids))}) AND profile = ?",
+                        (*ids, profile)).fetchall() if ids else []
+                for title, stored_patient, stored_signature, outputs in rows:
+                    similarity = float(np.mean(np.frombuffer(stored_signature, dtype=np.uint32) == signature))
+                    if similarity >= self.threshold and (best is None or similarity > best[0]):
+                        best = (similarity, title, stored_patient, outputs)
+                span.set(candidates=len(rows))
+            span.set(outcome='miss' if best is None else 'hit')
+            if best is None:
+                with self._lock:
+                    self.misses += 1
+                return None
+            similarity, title, stored_patient, outputs = best
+            span.set(similarity=round(similarity, 3))
+            with self._lock:
+                self.hits += 1
+        outputs = personalize(json.loads(outputs), json.loads(stored_patient), patient)
+        return {'title': title, 'similarity': similarity, 'outputs': outputs}
+
+    def store(self, text: str, title: str, config: str, result: Dict[str, Any]) -> bool:
+        """
+        Index a processed report with the stage outputs of its result dict.
+
+        Returns:
+            False if the report was too short to index or already stored
+        """
+        normalized = normalize_report(text)
+        hashes = shingles(normalized)
+        if not hashes:
+            return False
+        signature = minhash(hashes)
+        patient = patient_fields(text)
+        outputs = {stage: result[stage] for stage in STAGES if stage in result}
+        text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        profile = self.profile(config, patient, clinical_terms(normalized))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO reports (text_hash, profile, title, patient, signature, outputs, "
+                    "created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (text_hash, profile, title, json.dumps(patient), signature.tobytes(),
+                     json.dumps(outputs, ensure_ascii=False), time.time()))
+                inserted = cursor.rowcount > 0
+                if inserted:
+                    buckets = _buckets(signature, self.rows, profile)
+                    self._conn.executemany("INSERT INTO bands VALUES (?, ?)",
+                                           [(bucket, cursor.lastrowid) for bucket in buckets])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return inserted
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters for this process plus the number of stored reports."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+def config_key(fingerprints: Dict[str, str]) -> str:
+    """Fingerprint of a pipeline configuration from analysis_manifest.stage_fingerprints."""
+    material = json.dumps(fingerprints, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()[:16]
+
+
+if __name__ == "__main__":
+    # Near-duplicates that must never share outputs, checked against a throwaway
+    # index whose low threshold leaves the clinical terms gate as the only guard
+    import tempfile
+
+    findings = ("FINDINGS: Alignment is normal. Vertebral body heights are maintained. The conus terminates "
+                "normally. L1-L2 and L2-L3: No disc herniation or stenosis. {0} central canal stenosis at "
+                "L3-L4 with a broad-based disc bulge and facet arthropathy. {1} central canal stenosis at "
+                "L4-L5 with a disc bulge and facet arthropathy. L5-S1: No significant disc bulge. "
+                "IMPRESSION: Multilevel degenerative changes as described.")
+    report = "Patient: DOE, JANE\nAge: 64 years  Sex: F\n" + findings.format("Severe", "Mild")
+    cases = [
+        ("same findings, another patient", "Patient: ROE, MARY\nAge: 66 years  Sex: F\n" +
+         findings.format("Severe", "Mild"), True),
+        ("severities swapped between levels", "Patient: DOE, JANE\nAge: 64 years  Sex: F\n" +
+         findings.format("Mild", "Severe"), False),
+        ("one grade changed", "Patient: DOE, JANE\nAge: 64 years  Sex: F\n" +
+         findings.format("Severe", "Moderate"), False),
+        ("compound grade", "Patient: DOE, JANE\nAge: 64 years  Sex: F\n" +
+         findings.format("Severe", "Mild-to-moderate"), False),
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        similar = SimilarReports(os.path.join(directory, "check.sqlite3"), threshold=0.5)
+        similar.store(report, "stored", "check", {'care_plan': "Care plan for Jane Doe, 64-year-old"})
+        for label, text, reuse in cases:
+            hit = similar.lookup(text, "check")
+            estimate = minhash(shingles(normalize_report(text))) == minhash(shingles(normalize_report(report)))
+            print(f"{'✅' if (hit is not None) == reuse else '❌'} {label}: "
+                  f"{'reused' if hit else 'not reused'} (similarity {estimate.mean():.2f})")
@@ -0,0 +1,85 @@
+"""
+Minimal stage-graph executor for the report pipeline.
+
+A pipeline is a list of named stages, each with the names of the stages whose
+outputs it needs. Independent stages run concurrently on a thread pool (the
+work is dominated by waiting on LLM calls) and a dependent stage is started as
+soon as all of its inputs are available.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+
+class Stage:
+    """A named unit of pipeline work and the stages it depends on."""
+
+    def __init__(self, name: str, fn: Callable[..., Any], deps: Sequence[str] = ()):
+        """
+        Args:
+            name: Unique stage name, also the key of its output
+            fn: Callable invoked with the outputs of deps as keyword arguments
+            deps: Names of the stages whose outputs fn needs
+        """
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, deps={self.deps!r})"
+
+
+def _check_graph(stages: List[Stage]) -> None:
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate stage names in {names}")
+    known = set(names)
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in known]
+        if missing:
+            raise ValueError(f"Stage {stage.name!r} depends on unknown stages {missing}")
+
+
+def run_stages(stages: List[Stage], max_workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Run a stage graph, starting each stage as soon as its dependencies finish.
+
+    Args:
+        stages: Stages to run; order only matters as a tie-breaker
+        max_workers: Thread pool size, defaults to the number of stages
+
+    Returns:
+        Dictionary mapping stage name to its output
+
+    Raises:
+        ValueError: If the graph has unknown dependencies or a cycle
+        Exception: The first exception raised by a stage (remaining running
+            stages are allowed to finish, pending ones are not started)
+    """
+    _check_graph(stages)
+    results: Dict[str, Any] = {}
+    pending = list(stages)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(stages))) as executor:
+        while pending or running:
+            ready = [stage for stage in pending if all(dep in results for dep in stage.deps)]
+            for stage in ready:
+                pending.remove(stage)
+                kwargs = {dep: results[dep] for dep in stage.deps}
+                running[executor.submit(stage.fn, **kwargs)] = stage
+
+            if not running:
+                raise ValueError(f"Stage graph has a cycle among {[s.name for s in pending]}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    pending.clear()
+                    wait(running)
+                    raise error
+                results[stage.name] = future.result()
+
+    return results
@@ -1,6 +1,10 @@
-import models
+import backends
 import data
 import json
+import condition_matcher
+
+# Set to True to answer from the local condition matcher instead of the model
+USE_LOCAL_MATCHER = False
 
 stats_prompt = """Identify if the report presented diagnoses one of the following diagnosis : {diagnosis}.
 
@@ -23,15 +27,23 @@ Instructions:
 - If there is no matching diagnosis return nothing.
 """
 
-def identify_disease_in_report(report):
-    return models.call_openai(stats_prompt.format(report=report, diagnosis=",".join(data.stats_data.keys()), stats=json.dumps(data.stats_data))).choices[0].message.content
+# Model calls use the 'stats' stage route from pipeline_config unless a
+# backend/model is passed explicitly.
+def identify_disease_in_report(report, backend=None, model=None):
+    prompt = stats_prompt.format(report=report, diagnosis=",".join(data.stats_data.keys()), stats=json.dumps(data.stats_data))
+    return backends.complete_stage('stats', prompt, backend=backend, model=model)
 
-def stat_finder(report):
+def stat_finder(report, local=None, backend=None, model=None):
     # Identify the diagnosis in the Report.
-    return identify_disease_in_report(report)
+    if (USE_LOCAL_MATCHER if local is None else local):
+        return condition_matcher.describe_conditions(report)
+    return identify_disease_in_report(report, backend=backend, model=model)
 
-def stat_finder_age(report):
+def stat_finder_age(report, local=None, backend=None, model=None):
     # Identify the diagnosis in the Report.
-    return models.call_openai(stats_for_age_prompt.format(data=json.dumps(data.stats_data), report=report)).choices[0].message.content
+    if (USE_LOCAL_MATCHER if local is None else local):
+        return condition_matcher.describe_age_statistics(report)
+    prompt = stats_for_age_prompt.format(data=json.dumps(data.stats_data), report=report)
+    return backends.complete_stage('stats', prompt, backend=backend, model=model)
 
 
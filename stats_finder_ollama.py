@@ -1,35 +1,22 @@
-import models_ollama as models
-import data
-import json
-
-stats_prompt = """Identify if the report presented diagnoses one of the following diagnosis : {diagnosis}.
-
-Return NO DIAGNOSIS if there is no diagnosis that matches this list {diagnosis}
+"""
+Ollama variant of stats_finder, kept for existing imports.
 
-Here is the report
-{report}
+stats_finder now routes its model calls through the backends registry; this
+module pins them to the 'ollama' backend. Toggle the local matcher with
+stats_finder.USE_LOCAL_MATCHER.
 """
 
-stats_for_age_prompt = """
-If there is a matching diagnosis, return the percentage corresponding to the persons age group.
-This information might be relevant for your answer.
-{data}
+import stats_finder
+from stats_finder import stats_prompt, stats_for_age_prompt  # noqa: F401
 
-This is the persons report:
-{report}
+BACKEND = 'ollama'
 
-Instructions:
-- Don't return more than one percentage.
-- If there is no matching diagnosis return nothing.
-"""
 
 def identify_disease_in_report(report):
-    return models.call_openai(stats_prompt.format(report=report, diagnosis=",".join(data.stats_data.keys()), stats=json.dumps(data.stats_data))).choices[0].message.content
+    return stats_finder.identify_disease_in_report(report, backend=BACKEND)
 
-def stat_finder(report):
-    # Identify the diagnosis in the Report.
-    return identify_disease_in_report(report)
+def stat_finder(report, local=None):
+    return stats_finder.stat_finder(report, local=local, backend=BACKEND)
 
-def stat_finder_age(report):
-    # Identify the diagnosis in the Report.
-    return models.call_openai(stats_for_age_prompt.format(data=json.dumps(data.stats_data), report=report)).choices[0].message.content
\ No newline at end of file
+def stat_finder_age(report, local=None):
+    return stats_finder.stat_finder_age(report, local=local, backend=BACKEND)
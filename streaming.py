@@ -0,0 +1,167 @@
+"""
+Helpers for consuming token streams from the LLM backends.
+
+Backends expose streams as generators (stream_openai, OllamaClient.stream)
+or async iterators (astream_openai, OllamaClient.astream). Pipeline stages
+consume them through a StageTimer, which records time-to-first-token and total
+latency and forwards each chunk to an optional listener such as StreamPrinter.
+"""
+
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+import tracing
+
+
+def collect(tokens: Iterable[str], on_token: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Join a token stream, calling on_token with each chunk as it arrives.
+
+    If on_token raises (e.g. to abandon the stream), a generator stream is
+    closed right away so it releases its connection and backend slot instead
+    of waiting for garbage collection.
+    """
+    parts = []
+    try:
+        for token in tokens:
+            parts.append(token)
+            if on_token is not None:
+                on_token(token)
+    except BaseException:
+        close = getattr(tokens, 'close', None)
+        if close is not None:
+            close()
+        raise
+    return "".join(parts)
+
+
+class StageTimer:
+    """
+    Timing and token fan-out for one pipeline stage.
+
+    Use the instance itself as the on_token callback of a backend call, then
+    call done() when the stage returns.
+    """
+
+    def __init__(self, stage: str, listener=None):
+        """
+        Args:
+            stage: Stage name reported to the listener
+            listener: Optional object with token(stage, text) and stage_done(stage)
+        """
+        self.stage = stage
+        self.listener = listener
+        self.started = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def __call__(self, token: str) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        if self.listener is not None:
+            self.listener.token(self.stage, token)
+
+    def done(self, text: Optional[str] = None) -> None:
+        """
+        Mark the stage complete.
+
+        Args:
+            text: Output of a stage that did not stream; it is forwarded to
+                the listener as a single chunk
+        """
+        if text is not None and self.first_token_at is None:
+            self(text)
+        self.finished_at = time.perf_counter()
+        if self.listener is not None:
+            self.listener.stage_done(self.stage)
+
+    def as_dict(self) -> Dict[str, Optional[float]]:
+        """Seconds to first token and total seconds, rounded to milliseconds."""
+        def since_start(t):
+            return None if t is None else round(t - self.started, 3)
+        return {'ttft_s': since_start(self.first_token_at), 'total_s': since_start(self.finished_at)}
+
+
+class StreamPrinter:
+    """
+    Prints concurrently streaming stages without interleaving them.
+
+    The first stage to produce a token is printed live; chunks from other
+    stages are buffered. When the live stage finishes, the next stage's
+    buffer is flushed and it continues live.
+    """
+
+    def __init__(self, titles: Optional[Dict[str, str]] = None, out=None):
+        self.titles = titles or {}
+        self.out = out or sys.stdout
+        self._lock = threading.Lock()
+        self._live: Optional[str] = None
+        self._buffers: Dict[str, List[str]] = {}
+        self._finished: List[str] = []
+
+    def _header(self, stage: str) -> None:
+        title = self.titles.get(stage, stage)
+        self.out.write(f"\n{title}\n{'=' * 50}\n")
+
+    def _promote(self) -> None:
+        # Flush buffered stages (finished ones completely) until one is still streaming
+        while self._live is None and self._buffers:
+            stage = next((s for s in self._buffers if s in self._finished), next(iter(self._buffers)))
+            self._header(stage)
+            self.out.write("".join(self._buffers.pop(stage)))
+            if stage in self._finished:
+                self.out.write("\n")
+            else:
+                self._live = stage
+        self.out.flush()
+
+    def token(self, stage: str, text: str) -> None:
+        with self._lock:
+            if self._live is None and not self._buffers:
+                self._live = stage
+                self._header(stage)
+            if stage == self._live:
+                self.out.write(text)
+                self.out.flush()
+            else:
+                self._buffers.setdefault(stage, []).append(text)
+
+    def stage_done(self, stage: str) -> None:
+        with self._lock:
+            self._finished.append(stage)
+            if stage == self._live:
+                self.out.write("\n")
+                self._live = None
+                self._promote()
+
+
+def timed_stage(name: str, fn: Callable, timers: Dict[str, StageTimer], listener=None) -> Callable:
+    """
+    Wrap a stage function for stage_graph so it is timed, traced and streamed.
+
+    The stage is recorded as a tracing span, a child of the span that is
+    current when timed_stage is called (stage_graph runs it on a worker
+    thread, where that span would not be visible).
+
+    Args:
+        name: Stage name
+        fn: Stage function called as fn(on_token, **inputs); it should pass
+            on_token to its backend call so the stage streams
+        timers: Dict that receives the stage's StageTimer under name
+        listener: Optional token listener shared by all stages
+
+    Returns:
+        Stage callable accepting the stage inputs as keyword arguments
+    """
+    parent = tracing.current_span()
+
+    def run(**inputs):
+        with tracing.span(name, kind='stage', parent=parent) as stage_span:
+            timer = timers[name] = StageTimer(name, listener)
+            output = fn(timer, **inputs)
+            timer.done(output if timer.first_token_at is None and isinstance(output, str) else None)
+            stage_span.set(ttft_s=timer.as_dict()['ttft_s'])
+            return output
+    return run
@@ -0,0 +1,193 @@
+"""
+Structured findings extraction for the report pipeline.
+
+One schema-constrained model call (Ollama "format" / OpenAI structured
+outputs) turns a radiology report into a compact JSON structure: patient age
+and sex, exam, findings with spinal level and severity, impression and red
+flags. In structured mode the diagnosis and care plan prompts are built from
+render_findings() of that structure, and the statistics are looked up
+locally, instead of every stage re-reading the raw report.
+
+    findings = extract_findings(report_text)
+    print(render_findings(findings))
+    print(describe_statistics(findings))
+"""
+
+import json
+from typing import Any, Dict, List, Optional
+
+import backends
+import data
+import report_fields
+
+# Conditions the prevalence table covers, plus a catch-all for other findings
+CONDITIONS = tuple(data.stats_data) + ('Other',)
+SEVERITIES = ('mild', 'moderate', 'severe', 'unspecified')
+SEXES = ('male', 'female', 'unknown')
+# Guideline context budget when prompting from the findings instead of the report
+CONTEXT_TOKEN_BUDGET = 500
+
+
+def _object(properties: Dict[str, Any]) -> Dict[str, Any]:
+    # Strict structured outputs need every property required and no extras
+    return {"type": "object", "properties": properties, "required": list(properties),
+            "additionalProperties": False}
+
+
+FINDINGS_SCHEMA = _object({
+    "age": {"type": ["integer", "null"]},
+    "sex": {"type": "string", "enum": list(SEXES)},
+    "exam": {"type": "string"},
+    "findings": {"type": "array", "items": _object({
+        "condition": {"type": "string", "enum": list(CONDITIONS)},
+        "level": {"type": ["string", "null"]},
+        "severity": {"type": "string", "enum": list(SEVERITIES)},
+        "description": {"type": "string"},
+    })},
+    "impression": {"type": "array", "items": {"type": "string"}},
+    "red_flags": {"type": "array", "items": {"type": "string"}},
+})
+
+EXTRACTION_PROMPT = """You extract structured data from radiology reports.
+
+Read the report below and return:
+- age: patient age in years at the exam, or null if it is not stated
+- sex: male, female or unknown
+- exam: the imaging study, e.g. "MRI lumbar spine without contrast"
+- findings: every abnormal finding, one entry per condition and spinal level. Use the closest
+  condition from this list, or "Other": {conditions}. level is the spinal level (e.g. "L4-L5")
+  or null. description is at most 15 words. Leave out normal findings.
+- impression: the impression statements, at most 20 words each
+- red_flags: findings that need urgent attention (fracture, cord compression, cauda equina,
+  infection, malignancy), or an empty list
+
+Report:
+{report}
+"""
+
+
+def extract_findings(report: str, backend: Optional[str] = None, model: Optional[str] = None,
+                     cache: bool = True) -> Dict[str, Any]:
+    """
+    Extract the structured findings of a report with one model call.
+
+    Args:
+        report: Radiology report text
+        backend: Backend overriding the 'findings' stage route
+        model: Model overriding the 'findings' stage route
+        cache: Set to False to bypass llm_cache
+
+    Returns:
+        Normalized findings (see FINDINGS_SCHEMA)
+    """
+    prompt = EXTRACTION_PROMPT.format(conditions=", ".join(CONDITIONS), report=report)
+    raw = backends.complete_stage_json('findings', prompt, FINDINGS_SCHEMA, backend=backend, model=model, cache=cache)
+    return normalize(raw, report)
+
+
+def _strings(values: Any) -> List[str]:
+    return [str(value).strip() for value in values or [] if str(value).strip()] if isinstance(values, list) else []
+
+
+def normalize(raw: Dict[str, Any], report: str = "") -> Dict[str, Any]:
+    """
+    Coerce a model reply into the schema's shape.
+
+    Backends without constrained decoding may return loose values: unknown
+    conditions become 'Other', unknown severities 'unspecified', and a
+    missing age falls back to the report header.
+    """
+    age = raw.get('age')
+    try:
+        age = int(age) if age is not None else None
+    except (TypeError, ValueError):
+        age = None
+    if age is None and report:
+        age = report_fields.patient_age(report)
+
+    sex = str(raw.get('sex') or 'unknown').lower()
+    findings = []
+    for item in raw.get('findings') or []:
+        if not isinstance(item, dict):
+            continue
+        condition = item.get('condition')
+        severity = str(item.get('severity') or 'unspecified').lower()
+        findings.append({
+            'condition': condition if condition in CONDITIONS else 'Other',
+            'level': item.get('level') or None,
+            'severity': severity if severity in SEVERITIES else 'unspecified',
+            'description': str(item.get('description') or '').strip(),
+        })
+    return {
+        'age': age,
+        'sex': sex if sex in SEXES else 'unknown',
+        'exam': str(raw.get('exam') or '').strip(),
+        'findings': findings,
+        'impression': _strings(raw.get('impression')),
+        'red_flags': _strings(raw.get('red_flags')),
+    }
+
+
+def format_finding(finding: Dict[str, Any], description: bool = True) -> str:
+    """One finding as "L4-L5: Disk bulge (mild) - description"."""
+    level = f"{finding['level']}: " if finding.get('level') else ""
+    severity = f" ({finding['severity']})" if finding.get('severity') != 'unspecified' else ""
+    text = f" - {finding['description']}" if description and finding.get('description') else ""
+    return f"{level}{finding['condition']}{severity}{text}"
+
+
+def render_findings(findings: Dict[str, Any]) -> str:
+    """Compact text form of the findings, substituted for the report in stage prompts."""
+    age = f"{findings['age']}-year-old" if findings.get('age') is not None else "age unknown,"
+    lines = [f"Patient: {age} {findings.get('sex', 'unknown')}"]
+    if findings.get('exam'):
+        lines.append(f"Exam: {findings['exam']}")
+    lines.append("Findings:")
+    lines.extend(f"- {format_finding(finding)}" for finding in findings.get('findings') or [])
+    if not findings.get('findings'):
+        lines.append("- No abnormal findings")
+    if findings.get('impression'):
+        lines.append("Impression:")
+        lines.extend(f"- {statement}" for statement in findings['impression'])
+    if findings.get('red_flags'):
+        lines.append("Red flags: " + "; ".join(findings['red_flags']))
+    return "\n".join(lines)
+
+
+def describe_statistics(findings: Dict[str, Any]) -> str:
+    """
+    The stats stage answered from the findings: each matched condition with
+    its levels and, when the age is known, its prevalence for the age group.
+    """
+    levels: Dict[str, List[str]] = {}
+    for finding in findings.get('findings') or []:
+        if finding['condition'] == 'Other':
+            continue
+        found = levels.setdefault(finding['condition'], [])
+        if finding.get('level') and finding['level'] not in found:
+            found.append(finding['level'])
+    if not levels:
+        return "NO DIAGNOSIS"
+
+    age = findings.get('age')
+    if age is not None:
+        import prevalence  # numpy is only loaded once a lookup is needed
+        decade = int(prevalence.age_decade(age))
+    lines = []
+    for condition, found in levels.items():
+        line = f"- {condition}" + (f" ({', '.join(found)})" if found else "")
+        if age is not None:
+            line += f": {prevalence.percent(condition, age)} of asymptomatic people in their {decade}s"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import test_reports
+
+    findings = extract_findings(test_reports.JAMES_REPORT)
+    print(json.dumps(findings, indent=2))
+    print()
+    print(render_findings(findings))
+    print()
+    print(describe_statistics(findings))
@@ -0,0 +1,331 @@
+"""
+Span-based tracing and metrics for the report pipeline.
+
+Every pipeline run, pipeline stage and LLM backend call is recorded as a
+span: wall time plus attributes such as backend, model, cache status,
+queue time (waiting for a backend_limits slot), prompt/completion tokens and
+tokens per second. Finished spans are
+
+- aggregated in-process into Prometheus-style metrics (render_prometheus,
+  write_prometheus or serve_metrics for a scrape endpoint), and
+- appended as JSON lines to TRACE_PATH when it is set (env PIPELINE_TRACE_PATH
+  or set_trace_path()).
+
+Spans nest through a context variable, so a backend call made inside a stage
+becomes a child of that stage. Stages run on worker threads capture their
+parent explicitly (see streaming.timed_stage).
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+TRACE_PATH = os.getenv("PIPELINE_TRACE_PATH") or None
+# Upper bounds (seconds) of the span duration histogram buckets
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Attributes summed into the parent span when a child finishes
+_ROLLUP_ATTRS = ('queue_s', 'prompt_tokens', 'completion_tokens')
+
+
+class Span:
+    """One timed unit of work: a pipeline run, a stage or a backend call."""
+
+    def __init__(self, name: str, kind: str, parent: Optional["Span"] = None, **attrs: Any):
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(8).hex()
+        self.span_id = os.urandom(8).hex()
+        self.attrs: Dict[str, Any] = dict(attrs)
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration_s: Optional[float] = None
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def set(self, **attrs: Any) -> None:
+        """Set attributes on the span."""
+        with self._lock:
+            self.attrs.update(attrs)
+
+    def add(self, **amounts: float) -> None:
+        """Add to numeric attributes (e.g. queue time from several waits)."""
+        with self._lock:
+            for key, amount in amounts.items():
+                self.attrs[key] = self.attrs.get(key, 0) + amount
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.duration_s = self.elapsed()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        tokens = self.attrs.get('completion_tokens')
+        if tokens and 'tokens_per_s' not in self.attrs and self.kind == 'llm' and self.duration_s > 0:
+            self.attrs['tokens_per_s'] = tokens / self.duration_s
+        if self.parent is not None:
+            self.parent.add(**{key: self.attrs[key] for key in _ROLLUP_ATTRS if self.attrs.get(key)})
+
+    def to_dict(self) -> Dict[str, Any]:
+        record = {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent.span_id if self.parent is not None else None,
+            'name': self.name,
+            'kind': self.kind,
+            'start': round(self.start, 6),
+            'duration_s': None if self.duration_s is None else round(self.duration_s, 6),
+            'status': 'error' if self.error else 'ok',
+        }
+        if self.error:
+            record['error'] = self.error
+        with self._lock:
+            record.update({key: round(value, 6) if isinstance(value, float) else value
+                           for key, value in self.attrs.items()})
+        return record
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    """The innermost active span in this thread/task, if any."""
+    return _current.get()
+
+
+def current_llm_span() -> Optional[Span]:
+    """The innermost active backend-call span, if any."""
+    span = _current.get()
+    return span if span is not None and span.kind == 'llm' else None
+
+
+@contextmanager
+def span(name: str, kind: str = 'stage', parent: Optional[Span] = None, **attrs: Any) -> Iterator[Span]:
+    """
+    Record a span around a block.
+
+    Args:
+        name: Span name, e.g. the stage name or "ollama.generate"
+        kind: 'pipeline', 'stage', 'route' (backend choice), 'llm',
+            'warmup' (a model preload), 'service' (a pipeline_service
+            request) or 'similarity' (a similar_reports lookup)
+        parent: Explicit parent; defaults to the current span (pass it when
+            the block runs on a different thread than its parent)
+        **attrs: Initial attributes
+
+    Yields:
+        The Span, so the block can set further attributes
+    """
+    current = Span(name, kind, parent if parent is not None else _current.get(), **attrs)
+    token = _current.set(current)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # Finished in another context (e.g. an abandoned generator)
+            _current.set(current.parent)
+        current.finish(error)
+        _export(current)
+
+
+def annotate(**attrs: Any) -> None:
+    """Attach attributes to the active span of any kind (e.g. a stage's generation limits)."""
+    current = _current.get()
+    if current is not None:
+        current.set(**{key: value for key, value in attrs.items() if value is not None})
+
+
+def record_usage(**attrs: Any) -> None:
+    """Attach token counts and timings to the active backend-call span."""
+    current = current_llm_span()
+    if current is not None:
+        current.set(**{key: value for key, value in attrs.items() if value is not None})
+
+
+def record_ollama_stats(result: Dict[str, Any]) -> None:
+    """
+    Record the statistics Ollama returns with a final response: prompt and
+    completion tokens, model load time, prompt evaluation time and
+    generation speed (durations are reported in nanoseconds).
+    """
+    if 'eval_count' not in result and 'prompt_eval_count' not in result:
+        return
+    eval_count = result.get('eval_count')
+    eval_duration = result.get('eval_duration')
+    record_usage(
+        prompt_tokens=result.get('prompt_eval_count'),
+        completion_tokens=eval_count,
+        load_s=result['load_duration'] / 1e9 if result.get('load_duration') else None,
+        prompt_eval_s=result['prompt_eval_duration'] / 1e9 if result.get('prompt_eval_duration') else None,
+        tokens_per_s=eval_count / (eval_duration / 1e9) if eval_count and eval_duration else None,
+        finish_reason=result.get('done_reason'),
+    )
+
+
+def record_openai_usage(usage) -> None:
+    """Record the usage block of an OpenAI completion (or final stream chunk)."""
+    if usage is not None:
+        record_usage(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+
+
+def record_queue_time(seconds: float) -> None:
+    """Add time spent waiting for a backend slot to the active backend-call span."""
+    current = current_llm_span()
+    if current is not None:
+        current.add(queue_s=seconds)
+
+
+class Metrics:
+    """In-process aggregation of finished spans into Prometheus metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self.histograms: Dict[Tuple[Tuple[str, str], ...], List[float]] = {}
+
+    def _inc(self, metric: str, amount: float = 1, **labels: Any) -> None:
+        key = (metric, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, finished: Span) -> None:
+        labels = {'kind': finished.kind, 'name': finished.name}
+        attrs = finished.attrs
+        with self._lock:
+            # Histogram: one count per bucket, then sum and count
+            buckets = self.histograms.setdefault(tuple(sorted(labels.items())), [0] * (len(DURATION_BUCKETS) + 2))
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if finished.duration_s <= bound:
+                    buckets[index] += 1
+            buckets[-2] += finished.duration_s
+            buckets[-1] += 1
+            if finished.error:
+                self._inc('pipeline_span_errors_total', **labels)
+            if finished.kind == 'route':
+                self._inc('llm_route_decisions_total', outcome=attrs.get('outcome', ''),
+                          primary=attrs.get('primary', ''), secondary=attrs.get('secondary', ''))
+            if finished.kind == 'warmup':
+                warmup_labels = {'backend': attrs.get('backend', ''), 'model': attrs.get('model', '')}
+                state = 'failed' if finished.error else 'cold' if attrs.get('cold') else 'warm'
+                self._inc('llm_model_warmups_total', state=state, **warmup_labels)
+                if attrs.get('load_s'):
+                    self._inc('llm_model_load_seconds_total', attrs['load_s'], phase='warmup', **warmup_labels)
+            if finished.kind == 'service':
+                self._inc('service_requests_total', endpoint=finished.name, outcome=attrs.get('outcome', ''))
+            if finished.kind == 'similarity':
+                self._inc('similar_report_lookups_total', outcome=attrs.get('outcome', ''))
+            if finished.kind == 'llm':
+                llm_labels = {'backend': attrs.get('backend', ''), 'model': attrs.get('model', '')}
+                self._inc('llm_requests_total', cache=attrs.get('cache', 'none'), **llm_labels)
+                if attrs.get('queue_s'):
+                    self._inc('llm_queue_seconds_total', attrs['queue_s'], **llm_labels)
+                if attrs.get('load_s'):
+                    self._inc('llm_model_load_seconds_total', attrs['load_s'], phase='request', **llm_labels)
+                for kind in ('prompt', 'completion'):
+                    if attrs.get(f'{kind}_tokens'):
+                        self._inc('llm_tokens_total', attrs[f'{kind}_tokens'], type=kind, **llm_labels)
+                if attrs.get('finish_reason') == 'length':
+                    # Generation stopped at the stage's max_tokens cap
+                    self._inc('llm_length_capped_total', **llm_labels)
+                if attrs.get('completion_tokens') and attrs.get('tokens_per_s'):
+                    self._inc('llm_generation_seconds_total',
+                              attrs['completion_tokens'] / attrs['tokens_per_s'], **llm_labels)
+
+    def render(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        def fmt(labels):
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+
+        lines = [
+            "# HELP pipeline_span_duration_seconds Wall time of pipeline runs, stages and backend calls",
+            "# TYPE pipeline_span_duration_seconds histogram",
+        ]
+        with self._lock:
+            for labels, buckets in sorted(self.histograms.items()):
+                for index, bound in enumerate(DURATION_BUCKETS):
+                    lines.append(f"pipeline_span_duration_seconds_bucket{fmt(labels + (('le', str(bound)),))} {buckets[index]}")
+                lines.append(f"pipeline_span_duration_seconds_bucket{fmt(labels + (('le', '+Inf'),))} {buckets[-1]}")
+                lines.append(f"pipeline_span_duration_seconds_sum{fmt(labels)} {buckets[-2]:.6f}")
+                lines.append(f"pipeline_span_duration_seconds_count{fmt(labels)} {buckets[-1]}")
+            described = set()
+            for (metric, labels), value in sorted(self.counters.items()):
+                if metric not in described:
+                    lines.append(f"# TYPE {metric} counter")
+                    described.add(metric)
+                lines.append(f"{metric}{fmt(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+metrics = Metrics()
+_trace_lock = threading.Lock()
+
+
+def set_trace_path(path: Optional[str]) -> None:
+    """Append finished spans as JSON lines to path (None disables)."""
+    global TRACE_PATH
+    TRACE_PATH = path
+
+
+def _export(finished: Span) -> None:
+    metrics.observe(finished)
+    if TRACE_PATH:
+        line = json.dumps(finished.to_dict(), ensure_ascii=False)
+        with _trace_lock, open(TRACE_PATH, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+
+
+def render_prometheus() -> str:
+    return metrics.render()
+
+
+def write_prometheus(path: str) -> None:
+    """Write the current metrics to a file, e.g. for node_exporter's textfile collector."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(metrics.render())
+    os.replace(tmp_path, path)
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1"):
+    """
+    Serve the metrics at http://host:port/metrics from a daemon thread.
+
+    Returns:
+        The running HTTP server (call shutdown() to stop it)
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server